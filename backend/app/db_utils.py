@@ -0,0 +1,12 @@
+"""Dialect-aware helpers for bulk database writes"""
+from app import db
+from sqlalchemy.dialects import postgresql, sqlite
+
+def dialect_insert(model):
+    """
+    INSERT construct for the active dialect that supports ON CONFLICT clauses
+    (PostgreSQL in production, SQLite in tests).
+    """
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql.insert(model)
+    return sqlite.insert(model)
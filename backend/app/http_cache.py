@@ -0,0 +1,28 @@
+"""Conditional (ETag) and gzip responses for precomputed bodies"""
+from flask import Response, request
+import gzip
+
+def cached_response(etag: str, body_gz: bytes, mimetype: str = 'application/json') -> Response:
+    """
+    Serve a gzipped body with a weak ETag: 304 Not Modified when the client's
+    If-None-Match matches, the gzipped bytes when it accepts gzip, and the
+    decompressed body otherwise. Clients revalidate on every request.
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    elif 'gzip' in request.accept_encodings:
+        response = Response(body_gz, mimetype=mimetype)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(gzip.decompress(body_gz), mimetype=mimetype)
+    response.set_etag(etag, weak=True)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.no_cache = True
+    return response
+
+def not_modified(etag: str) -> Response:
+    """Bare 304 Not Modified for a client whose If-None-Match matches etag"""
+    response = Response(status=304)
+    response.set_etag(etag, weak=True)
+    response.cache_control.no_cache = True
+    return response
@@ -1,8 +1,55 @@
 from app import db
-from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, Text, DateTime, Enum, ARRAY
+from sqlalchemy import Column, Integer, BigInteger, String, Float, Boolean, ForeignKey, Text, DateTime, Enum, ARRAY, JSON, LargeBinary
 from sqlalchemy.orm import relationship
+from sqlalchemy.types import TypeDecorator
 from datetime import datetime
 import enum
+import os
+
+try:
+    from pgvector.sqlalchemy import Vector
+except ImportError:  # pgvector is optional; only needed for EMBEDDING_STORAGE=pgvector
+    Vector = None
+
+# 'array' stores float8[]; 'pgvector' stores a native vector column with an ANN index
+EMBEDDING_STORAGE = os.getenv('EMBEDDING_STORAGE', 'array')
+EMBEDDING_DIMENSIONS = int(os.getenv('EMBEDDING_DIMENSIONS', '1536'))
+
+def pgvector_enabled(dialect) -> bool:
+    """Whether embeddings are stored as pgvector columns on this dialect"""
+    return dialect.name == 'postgresql' and EMBEDDING_STORAGE == 'pgvector' and Vector is not None
+
+class EmbeddingVector(TypeDecorator):
+    """
+    Embedding column type.
+    PostgreSQL uses vector(EMBEDDING_DIMENSIONS) in pgvector mode and float8[]
+    otherwise; other dialects (SQLite in tests) fall back to JSON.
+    """
+    impl = JSON
+    cache_ok = True
+    
+    def load_dialect_impl(self, dialect):
+        if pgvector_enabled(dialect):
+            return dialect.type_descriptor(Vector(EMBEDDING_DIMENSIONS))
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(ARRAY(Float))
+        return dialect.type_descriptor(JSON())
+    
+    def process_result_value(self, value, dialect):
+        # pgvector returns NumPy arrays; keep the list interface of ARRAY(Float)
+        if value is not None and hasattr(value, 'tolist'):
+            return value.tolist()
+        return value
+
+class StringList(TypeDecorator):
+    """List of strings: ARRAY(String) on PostgreSQL, JSON on other dialects"""
+    impl = JSON
+    cache_ok = True
+    
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(ARRAY(String))
+        return dialect.type_descriptor(JSON())
 
 class JobStatus(enum.Enum):
     PENDING = "PENDING"
@@ -18,6 +65,8 @@ class Collection(db.Model):
     description = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    clustering_backend = Column(String(50))  # Default clustering backend for discovery jobs
+    clustering_params = Column(JSON)  # Default clustering settings (reduction, n_components, ...)
     
     documents = relationship('Document', back_populates='collection', cascade='all, delete-orphan')
     topics = relationship('Topic', back_populates='collection', cascade='all, delete-orphan')
@@ -32,23 +81,80 @@ class Document(db.Model):
     content = Column(Text, nullable=False)
     file_path = Column(String(1000))
     file_type = Column(String(50))
+    file_mtime = Column(Float)  # Source file modification time, for incremental folder loads
+    file_hash = Column(String(64))  # SHA-256 of the source file
+    minhash = Column(LargeBinary)  # MinHash signature of the content's shingles (uint32 array)
+    # Earlier document this one nearly duplicates; duplicates are not embedded or clustered
+    duplicate_of_id = Column(Integer, ForeignKey('documents.id', ondelete='SET NULL'), index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     collection = relationship('Collection', back_populates='documents')
     topic_assignments = relationship('DocumentTopic', back_populates='document', cascade='all, delete-orphan')
     embeddings = relationship('DocumentEmbedding', back_populates='document', cascade='all, delete-orphan', uselist=False)
+    chunks = relationship('DocumentChunk', back_populates='document', cascade='all, delete-orphan')
+    lsh_buckets = relationship('DocumentLSHBucket', back_populates='document', cascade='all, delete-orphan')
+    
+    # Keyset pagination of a collection's documents
+    __table_args__ = (
+        db.Index('ix_documents_collection_id_id', 'collection_id', 'id'),
+        db.Index('ix_documents_collection_id_file_hash', 'collection_id', 'file_hash'),
+    )
+
+class DocumentLSHBucket(db.Model):
+    """One LSH band bucket of a document's MinHash signature, for near-duplicate lookups"""
+    __tablename__ = 'document_lsh_buckets'
+    
+    id = Column(Integer, primary_key=True)
+    collection_id = Column(Integer, ForeignKey('collections.id'), nullable=False)
+    document_id = Column(Integer, ForeignKey('documents.id'), nullable=False, index=True)
+    bucket = Column(BigInteger, nullable=False)  # Hash of the band index and its signature rows
+    
+    document = relationship('Document', back_populates='lsh_buckets')
+    
+    __table_args__ = (db.Index('ix_document_lsh_buckets_collection_id_bucket', 'collection_id', 'bucket'),)
 
 class DocumentEmbedding(db.Model):
     __tablename__ = 'document_embeddings'
     
     id = Column(Integer, primary_key=True)
     document_id = Column(Integer, ForeignKey('documents.id'), nullable=False, unique=True)
-    embedding = Column(ARRAY(Float))  # Vector embedding
+    embedding = Column(EmbeddingVector)  # Vector embedding
     model = Column(String(100))
     created_at = Column(DateTime, default=datetime.utcnow)
     
     document = relationship('Document', back_populates='embeddings')
 
+class DocumentChunk(db.Model):
+    __tablename__ = 'document_chunks'
+    
+    id = Column(Integer, primary_key=True)
+    document_id = Column(Integer, ForeignKey('documents.id'), nullable=False, index=True)
+    chunk_index = Column(Integer, nullable=False)  # Position within the document
+    content = Column(Text, nullable=False)
+    start_char = Column(Integer)  # Offsets of the chunk in Document.content
+    end_char = Column(Integer)
+    token_count = Column(Integer)  # Estimated tokens
+    embedding = Column(EmbeddingVector)
+    model = Column(String(100))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    document = relationship('Document', back_populates='chunks')
+    
+    __table_args__ = (db.UniqueConstraint('document_id', 'chunk_index', name='_document_chunk_uc'),)
+
+class EmbeddingCacheEntry(db.Model):
+    __tablename__ = 'embedding_cache'
+    
+    id = Column(Integer, primary_key=True)
+    model = Column(String(100), nullable=False)
+    content_hash = Column(String(64), nullable=False)  # SHA-256 of the truncated text
+    embedding = Column(EmbeddingVector)
+    hit_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow, index=True)  # For LRU eviction
+    
+    __table_args__ = (db.UniqueConstraint('model', 'content_hash', name='_embedding_cache_uc'),)
+
 class Topic(db.Model):
     __tablename__ = 'topics'
     
@@ -60,10 +166,18 @@ class Topic(db.Model):
     avg_confidence = Column(Float, default=0.0)
     color = Column(String(7))  # Hex color
     size_score = Column(Float, default=0.0)
+    centroid = Column(EmbeddingVector)  # Mean member embedding, updated as documents are added
+    clustered_document_count = Column(Integer)  # Size at the last full clustering
+    version = Column(Integer, nullable=False, default=1, server_default='1')  # Bumped when assignments, name or insights change
+    parent_id = Column(Integer, ForeignKey('topics.id'), index=True)  # Parent of a sub-topic, None at the top level
+    level = Column(Integer, nullable=False, default=0, server_default='0')  # Depth in the topic hierarchy
+    expanded_at = Column(DateTime)  # When sub-topics were materialized (None until first expanded)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     collection = relationship('Collection', back_populates='topics')
+    parent = relationship('Topic', remote_side=[id], back_populates='children')
+    children = relationship('Topic', back_populates='parent', cascade='all, delete-orphan')
     document_assignments = relationship('DocumentTopic', back_populates='topic', cascade='all, delete-orphan')
     insights = relationship('TopicInsight', back_populates='topic', cascade='all, delete-orphan', uselist=False)
     source_relationships = relationship('TopicRelationship', foreign_keys='TopicRelationship.source_topic_id', back_populates='source_topic', cascade='all, delete-orphan')
@@ -81,14 +195,18 @@ class DocumentTopic(db.Model):
     document = relationship('Document', back_populates='topic_assignments')
     topic = relationship('Topic', back_populates='document_assignments')
     
-    __table_args__ = (db.UniqueConstraint('document_id', 'topic_id', name='_document_topic_uc'),)
+    __table_args__ = (
+        db.UniqueConstraint('document_id', 'topic_id', name='_document_topic_uc'),
+        # Topic drill-downs page a topic's documents by relevance
+        db.Index('ix_document_topics_topic_id_relevance', 'topic_id', 'relevance_score'),
+    )
 
 class TopicRelationship(db.Model):
     __tablename__ = 'topic_relationships'
     
     id = Column(Integer, primary_key=True)
     source_topic_id = Column(Integer, ForeignKey('topics.id'), nullable=False)
-    target_topic_id = Column(Integer, ForeignKey('topics.id'), nullable=False)
+    target_topic_id = Column(Integer, ForeignKey('topics.id'), nullable=False, index=True)
     similarity_score = Column(Float, default=0.0)
     relationship_type = Column(String(50))  # RELATED, SIMILAR, etc.
     common_document_count = Column(Integer, default=0)
@@ -104,9 +222,9 @@ class TopicInsight(db.Model):
     id = Column(Integer, primary_key=True)
     topic_id = Column(Integer, ForeignKey('topics.id'), nullable=False, unique=True)
     summary = Column(Text)
-    themes = Column(ARRAY(String))  # List of themes
-    common_questions = Column(ARRAY(String))  # List of questions
-    related_concepts = Column(ARRAY(String))  # List of concepts
+    themes = Column(StringList)  # List of themes
+    common_questions = Column(StringList)  # List of questions
+    related_concepts = Column(StringList)  # List of concepts
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -122,6 +240,13 @@ class DiscoveryJob(db.Model):
     current_step = Column(String(255))
     error_message = Column(Text)
     rq_job_id = Column(String(255))  # RQ job ID
+    clustering_backend = Column(String(50))  # Backend used: kmeans, minibatch
+    clustering_params = Column(JSON)  # Full clustering settings used by the job
+    n_clusters = Column(Integer)  # Cluster count of the last full clustering
+    silhouette_score = Column(Float)  # Silhouette score of an automatically chosen cluster count
+    incremental = Column(Boolean, default=False)
+    checkpoints = Column(JSON)  # Completed stages: {stage: {completed_at, ...stage results}}
+    stage_rq_job_ids = Column(JSON)  # RQ jobs enqueued for the concurrent stages and finalize: {stage: job ID}
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     completed_at = Column(DateTime)
@@ -0,0 +1,55 @@
+"""Lazily created Redis connections and RQ queue"""
+from typing import Optional
+from rq import Queue
+from redis import Redis
+import threading
+import time
+import os
+
+_queue = None
+
+# Short-timeout connection for caches and rate limits, which fall back to
+# process-local state while Redis is unreachable
+_redis = None
+_redis_checked_at = None
+_redis_lock = threading.Lock()
+
+# How long to wait before trying an unreachable Redis again
+REDIS_RETRY_SECONDS = 30
+
+# RQ job statuses of jobs that are waiting or running
+ACTIVE_JOB_STATUSES = ('queued', 'deferred', 'scheduled', 'started')
+
+def get_queue() -> Queue:
+    """The default RQ queue, connected on first use"""
+    global _queue
+    if _queue is None:
+        redis_conn = Redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+        _queue = Queue(connection=redis_conn)
+    return _queue
+
+def get_redis() -> Optional[Redis]:
+    """The shared Redis connection, or None while Redis is unreachable"""
+    global _redis, _redis_checked_at
+    with _redis_lock:
+        if _redis is not None:
+            return _redis
+        if _redis_checked_at is not None and time.monotonic() - _redis_checked_at < REDIS_RETRY_SECONDS:
+            return None
+        _redis_checked_at = time.monotonic()
+    try:
+        redis_conn = Redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+                                    socket_connect_timeout=1, socket_timeout=2)
+        redis_conn.ping()
+    except Exception:
+        return None
+    with _redis_lock:
+        _redis = redis_conn
+    return redis_conn
+
+def redis_failed():
+    """Stop using the shared connection after an error until the next retry"""
+    global _redis, _redis_checked_at
+    with _redis_lock:
+        _redis = None
+        _redis_checked_at = time.monotonic()
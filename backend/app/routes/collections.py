@@ -1,31 +1,38 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, abort
+from sqlalchemy import select, func
 from app import db
-from app.models import Collection
+from app.models import Collection, Document, Topic
 from app.services.document_service import DocumentService
-from app.services.discovery_job import DiscoveryJobService
-from rq import Queue
-from redis import Redis
-import os
+from app.services.clustering import ClusteringEngine
+from app.queue import get_queue
 
 bp = Blueprint('collections', __name__, url_prefix='/collections')
-redis_conn = Redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
-q = Queue(connection=redis_conn)
 
 document_service = DocumentService()
-discovery_service = DiscoveryJobService()
+
+def _with_counts():
+    """Collections with their document and topic counts, counted in SQL instead of loading the rows"""
+    document_count = select(func.count(Document.id)).where(
+        Document.collection_id == Collection.id
+    ).correlate(Collection).scalar_subquery()
+    topic_count = select(func.count(Topic.id)).where(
+        Topic.collection_id == Collection.id,
+        Topic.parent_id.is_(None)
+    ).correlate(Collection).scalar_subquery()
+    return db.session.query(Collection, document_count.label('document_count'), topic_count.label('topic_count'))
 
 @bp.route('', methods=['GET'])
 def list_collections():
     """List all collections"""
-    collections = Collection.query.all()
+    collections = _with_counts().order_by(Collection.id).all()
     return jsonify([{
         'id': c.id,
         'name': c.name,
         'description': c.description,
         'created_at': c.created_at.isoformat() if c.created_at else None,
-        'document_count': len(c.documents),
-        'topic_count': len(c.topics)
-    } for c in collections])
+        'document_count': document_count,
+        'topic_count': topic_count
+    } for c, document_count, topic_count in collections])
 
 @bp.route('', methods=['POST'])
 def create_collection():
@@ -33,27 +40,41 @@ def create_collection():
     data = request.get_json()
     collection = Collection(
         name=data.get('name', 'Untitled Collection'),
-        description=data.get('description')
+        description=data.get('description'),
+        clustering_backend=data.get('clustering_backend'),
+        clustering_params=data.get('clustering_params')
     )
+    # Validate default clustering settings before saving
+    try:
+        ClusteringEngine.for_collection(collection)
+    except (TypeError, ValueError, AttributeError) as e:
+        return jsonify({'error': f'Invalid clustering settings: {str(e)}'}), 400
     db.session.add(collection)
     db.session.commit()
     return jsonify({
         'id': collection.id,
         'name': collection.name,
-        'description': collection.description
+        'description': collection.description,
+        'clustering_backend': collection.clustering_backend,
+        'clustering_params': collection.clustering_params
     }), 201
 
 @bp.route('/<int:collection_id>', methods=['GET'])
 def get_collection(collection_id):
     """Get a collection by ID"""
-    collection = Collection.query.get_or_404(collection_id)
+    row = _with_counts().filter(Collection.id == collection_id).first()
+    if row is None:
+        abort(404)
+    collection, document_count, topic_count = row
     return jsonify({
         'id': collection.id,
         'name': collection.name,
         'description': collection.description,
         'created_at': collection.created_at.isoformat() if collection.created_at else None,
-        'document_count': len(collection.documents),
-        'topic_count': len(collection.topics)
+        'document_count': document_count,
+        'topic_count': topic_count,
+        'clustering_backend': collection.clustering_backend,
+        'clustering_params': collection.clustering_params
     })
 
 @bp.route('/<int:collection_id>', methods=['DELETE'])
@@ -91,12 +112,26 @@ def start_discovery(collection_id):
     else:
         incremental = bool(incremental)
     
+    # Clustering backend for this job (falls back to the collection defaults)
+    try:
+        clustering = ClusteringEngine.for_collection(collection, {
+            'backend': data.get('clustering_backend'),
+            'reduction': data.get('dimensionality_reduction'),
+            'n_components': data.get('n_components'),
+            'n_clusters': data.get('n_clusters')
+        })
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid clustering settings: {str(e)}'}), 400
+    
     # Create job record first
     from app.models import DiscoveryJob, JobStatus
     job = DiscoveryJob(
         collection_id=collection_id,
         status=JobStatus.PENDING,
-        rq_job_id=None  # Will be set after enqueue
+        rq_job_id=None,  # Will be set after enqueue
+        incremental=incremental,
+        clustering_backend=clustering.backend,
+        clustering_params=clustering.settings()
     )
     db.session.add(job)
     db.session.commit()
@@ -104,7 +139,7 @@ def start_discovery(collection_id):
     # Enqueue the job with job_id
     from app.workers import run_discovery_job
     try:
-        rq_job = q.enqueue(run_discovery_job, collection_id, incremental, job.id)
+        rq_job = get_queue().enqueue(run_discovery_job, collection_id, incremental, job.id)
         # Update job with RQ job ID
         job.rq_job_id = rq_job.id
         db.session.commit()
@@ -135,7 +170,8 @@ def start_discovery(collection_id):
         'job_id': job.id,
         'rq_job_id': rq_job.id,
         'status': job.status.value,
-        'collection_id': collection_id
+        'collection_id': collection_id,
+        'clustering_backend': job.clustering_backend
     }), 202
 
 @bp.route('/<int:collection_id>/discover/status', methods=['GET'])
@@ -2,17 +2,15 @@ from flask import Blueprint, request, jsonify
 from app import db
 from app.models import Collection, Document
 from app.services.document_service import DocumentService
-from app.services.discovery_job import DiscoveryJobService
-from rq import Queue
-from redis import Redis
-import os
+from app.queue import get_queue
+from sqlalchemy import func
 
 bp = Blueprint('documents', __name__, url_prefix='/collections')
-redis_conn = Redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
-q = Queue(connection=redis_conn)
 
 document_service = DocumentService()
-discovery_service = DiscoveryJobService()
+
+DOCUMENTS_PAGE_SIZE = 100
+DOCUMENTS_MAX_PAGE_SIZE = 1000
 
 @bp.route('/<int:collection_id>/documents', methods=['POST'])
 def add_documents(collection_id):
@@ -33,43 +31,68 @@ def add_documents(collection_id):
     else:
         return jsonify({'error': 'Invalid format. Provide "content" or "documents" array'}), 400
     
-    # Add documents
-    added_docs = document_service.add_documents_batch(collection_id, documents)
+    # Add documents (bulk insert + batched embeddings)
+    result = document_service.ingest_documents(collection_id, documents)
     
     # Trigger incremental discovery
     incremental = data.get('trigger_discovery', True)
     if incremental:
         from app.workers import run_discovery_job
-        rq_job = q.enqueue(run_discovery_job, collection_id, incremental=True)
-        
         from app.models import DiscoveryJob, JobStatus
         job = DiscoveryJob(
             collection_id=collection_id,
             status=JobStatus.PENDING,
-            rq_job_id=rq_job.id
+            incremental=True
         )
         db.session.add(job)
         db.session.commit()
+        
+        rq_job = get_queue().enqueue(run_discovery_job, collection_id, True, job.id)
+        job.rq_job_id = rq_job.id
+        db.session.commit()
     
     return jsonify({
-        'documents_added': len(added_docs),
-        'document_ids': [doc.id for doc in added_docs],
+        'documents_added': len(result['document_ids']),
+        'document_ids': result['document_ids'],
+        'duplicates': result['duplicates'],
+        'failed_documents': result['failed'],
+        'embedding_failures': result['embedding_failed'],
         'incremental_discovery_triggered': incremental
     }), 201
 
 @bp.route('/<int:collection_id>/documents', methods=['GET'])
 def list_documents(collection_id):
-    """List documents in a collection"""
-    collection = Collection.query.get_or_404(collection_id)
-    documents = Document.query.filter_by(collection_id=collection_id).all()
+    """
+    List documents in a collection in ID order, one page at a time.
+    Pass ?limit= (default 100, at most 1000) and ?cursor= from the previous
+    page's X-Next-Cursor header; the header is absent on the last page.
+    """
+    Collection.query.get_or_404(collection_id)
+    limit = min(max(1, request.args.get('limit', DOCUMENTS_PAGE_SIZE, type=int)), DOCUMENTS_MAX_PAGE_SIZE)
+    cursor = request.args.get('cursor')
+    if cursor is not None and not cursor.isdigit():
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    # Keyset pagination on (collection_id, id); content is only read for the preview
+    query = db.session.query(
+        Document.id, Document.title,
+        func.substr(Document.content, 1, 200).label('content_preview'),
+        Document.file_type, Document.created_at
+    ).filter(Document.collection_id == collection_id)
+    if cursor is not None:
+        query = query.filter(Document.id > int(cursor))
+    rows = query.order_by(Document.id).limit(limit + 1).all()
     
-    return jsonify([{
+    response = jsonify([{
         'id': doc.id,
         'title': doc.title,
-        'content_preview': doc.content[:200] if doc.content else '',
+        'content_preview': doc.content_preview or '',
         'file_type': doc.file_type,
         'created_at': doc.created_at.isoformat() if doc.created_at else None
-    } for doc in documents])
+    } for doc in rows[:limit]])
+    if len(rows) > limit:
+        response.headers['X-Next-Cursor'] = str(rows[limit - 1].id)
+    return response
 
 @bp.route('/<int:collection_id>/documents/<int:document_id>', methods=['GET'])
 def get_document(collection_id, document_id):
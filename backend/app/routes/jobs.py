@@ -1,5 +1,10 @@
 from flask import Blueprint, jsonify
-from app.models import DiscoveryJob
+from app import db
+from app.models import DiscoveryJob, JobStatus
+from app.services.embedding_cache import EmbeddingCache
+from app.services.genai_clients import GenAIClientRegistry
+from app.services.rate_limiter import RateLimiter
+from app.services.qa_cache import QACache
 
 bp = Blueprint('jobs', __name__, url_prefix='/jobs')
 
@@ -15,10 +20,55 @@ def get_job(job_id):
         'progress': job.progress,
         'current_step': job.current_step,
         'error_message': job.error_message,
+        'clustering_backend': job.clustering_backend,
+        'clustering_params': job.clustering_params,
+        'n_clusters': job.n_clusters,
+        'silhouette_score': job.silhouette_score,
+        'incremental': job.incremental,
+        'checkpoints': job.checkpoints or {},
         'created_at': job.created_at.isoformat() if job.created_at else None,
         'completed_at': job.completed_at.isoformat() if job.completed_at else None
     })
 
+@bp.route('/<int:job_id>/resume', methods=['POST'])
+def resume_job(job_id):
+    """
+    Re-enqueue a failed or interrupted job; it continues after its last
+    completed stage. Only FAILED jobs, and RUNNING jobs none of whose RQ
+    jobs (the discovery job, its stage jobs and finalize) are still queued
+    or running, can be resumed.
+    """
+    job = DiscoveryJob.query.get_or_404(job_id)
+    if job.status not in (JobStatus.FAILED, JobStatus.RUNNING):
+        return jsonify({'error': f'Job is {job.status.value} and cannot be resumed'}), 409
+    
+    from app.queue import get_queue, ACTIVE_JOB_STATUSES
+    from app.workers import run_discovery_job
+    try:
+        queue = get_queue()
+        rq_job_ids = [job.rq_job_id] + list((job.stage_rq_job_ids or {}).values())
+        for rq_job_id in filter(None, rq_job_ids):
+            rq_job = queue.fetch_job(rq_job_id)
+            if rq_job is not None and rq_job.get_status() in ACTIVE_JOB_STATUSES:
+                return jsonify({'error': 'Job is still running'}), 409
+        rq_job = queue.enqueue(run_discovery_job, job.collection_id, bool(job.incremental), job.id)
+    except Exception as e:
+        return jsonify({
+            'error': 'Failed to resume discovery job',
+            'message': str(e)
+        }), 500
+    
+    job.status = JobStatus.PENDING
+    job.rq_job_id = rq_job.id
+    db.session.commit()
+    
+    return jsonify({
+        'job_id': job.id,
+        'rq_job_id': rq_job.id,
+        'completed_stages': list(job.checkpoints or {}),
+        'status': job.status.value
+    }), 202
+
 @bp.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
@@ -27,3 +77,13 @@ def health():
         'service': 'topic-discovery-api'
     })
 
+
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Runtime metrics for this process"""
+    return jsonify({
+        'embedding_cache': EmbeddingCache().stats(),
+        'genai_http': GenAIClientRegistry.stats(),
+        'genai_rate_limit': RateLimiter().stats(),
+        'qa_cache': QACache().stats()
+    })
@@ -1,125 +1,78 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context, abort
 from app import db
-from app.models import Collection, Topic, TopicRelationship, DocumentTopic, TopicInsight
-from app.services.genai_service import GenAIService
+from app.models import Topic
+from app.services.qa_service import QAService
+from app.services.graph_snapshot import GraphSnapshotStore
+from app.services.topic_detail import TopicDetailService
+from app.sse import sse_event, SSE_HEADERS
+from app.http_cache import cached_response, not_modified
+from app.queue import get_queue
 
 bp = Blueprint('topics', __name__, url_prefix='')
-genai_service = GenAIService()
+qa_service = QAService()
+graph_snapshots = GraphSnapshotStore()
+topic_details = TopicDetailService()
 
 @bp.route('/collections/<int:collection_id>/topics/graph', methods=['GET'])
 def get_topic_graph(collection_id):
-    """Get topic graph JSON for a collection"""
-    collection = Collection.query.get_or_404(collection_id)
-    topics = Topic.query.filter_by(collection_id=collection_id).all()
-    relationships = TopicRelationship.query.join(
-        Topic, TopicRelationship.source_topic_id == Topic.id
-    ).filter(Topic.collection_id == collection_id).all()
-    
-    # Build nodes
-    nodes = []
-    for topic in topics:
-        nodes.append({
-            'id': f't{topic.id}',
-            'label': topic.name,
-            'size_score': topic.size_score,
-            'document_count': topic.document_count,
-            'avg_confidence': topic.avg_confidence,
-            'color': topic.color or '#3498db'
-        })
+    """Get topic graph JSON for a collection (precomputed snapshot, ETag-validated and gzipped)"""
+    snapshot = graph_snapshots.get(collection_id)
+    if snapshot is None:
+        abort(404)
+    return cached_response(snapshot.etag, snapshot.body_gz)
+
+@bp.route('/topics/<int:topic_id>/graph', methods=['GET'])
+def get_subtopic_graph(topic_id):
+    """
+    Get the sub-topic level of the graph below a topic (JSON API, HTML
+    fragment for HTMX), ETag-validated and gzipped. The first request for a
+    topic enqueues its expansion and answers 202 with a pending level, which
+    clients poll until the sub-topics are clustered and named.
+    """
+    topic = Topic.query.get_or_404(topic_id)
+    if not graph_snapshots.hierarchy.is_materialized(topic):
+        try:
+            graph_snapshots.hierarchy.enqueue_expand(topic, get_queue())
+        except Exception as e:
+            return jsonify({
+                'error': 'Failed to start topic expansion',
+                'message': str(e)
+            }), 500
+        graph = graph_snapshots.pending_subgraph(topic)
+        if request.headers.get('HX-Request'):
+            from flask import render_template
+            return render_template('graph.html', graph=graph, collection_id=topic.collection_id), 202
+        return jsonify(graph), 202
     
-    # Build edges
-    edges = []
-    for rel in relationships:
-        edges.append({
-            'source': f't{rel.source_topic_id}',
-            'target': f't{rel.target_topic_id}',
-            'weight': rel.similarity_score,
-            'type': rel.relationship_type
-        })
+    snapshot = graph_snapshots.get_level(topic)
     
-    return jsonify({
-        'nodes': nodes,
-        'edges': edges
-    })
+    if request.headers.get('HX-Request'):
+        from flask import render_template
+        import gzip
+        etag = f'{snapshot.etag}-html'
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+        html = render_template('graph.html', graph=snapshot.graph, collection_id=topic.collection_id)
+        return cached_response(etag, gzip.compress(html.encode('utf-8')), mimetype='text/html')
+    
+    return cached_response(snapshot.etag, snapshot.body_gz)
 
 @bp.route('/topics/<int:topic_id>', methods=['GET'])
 def get_topic(topic_id):
-    """Get topic drill-down view (JSON API)"""
+    """Get topic drill-down view (JSON API, HTML fragment for HTMX); documents are paged with ?page=&per_page="""
     topic = Topic.query.get_or_404(topic_id)
-    
-    # Get insights
-    insight = TopicInsight.query.filter_by(topic_id=topic_id).first()
-    
-    # Get documents ranked by relevance
-    assignments = DocumentTopic.query.filter_by(topic_id=topic_id).order_by(
-        DocumentTopic.relevance_score.desc()
-    ).all()
-    
-    documents = []
-    for assignment in assignments:
-        doc = assignment.document
-        documents.append({
-            'id': doc.id,
-            'title': doc.title,
-            'content_preview': doc.content[:200] if doc.content else '',
-            'relevance_score': assignment.relevance_score,
-            'is_primary': assignment.is_primary
-        })
-    
-    # Get related topics
-    related_topics = []
-    relationships = TopicRelationship.query.filter(
-        ((TopicRelationship.source_topic_id == topic_id) |
-         (TopicRelationship.target_topic_id == topic_id))
-    ).all()
-    
-    for rel in relationships:
-        related_topic_id = rel.target_topic_id if rel.source_topic_id == topic_id else rel.source_topic_id
-        related_topic = Topic.query.get(related_topic_id)
-        if related_topic:
-            related_topics.append({
-                'id': related_topic.id,
-                'name': related_topic.name,
-                'similarity_score': rel.similarity_score,
-                'relationship_type': rel.relationship_type
-            })
-    
-    # Sort by similarity
-    related_topics.sort(key=lambda x: x['similarity_score'], reverse=True)
+    topic_data = topic_details.get_topic_detail(
+        topic,
+        page=request.args.get('page', type=int),
+        per_page=request.args.get('per_page', type=int)
+    )
     
     # Return HTML for HTMX requests, JSON for API requests
     if request.headers.get('HX-Request'):
         from flask import render_template
-        topic_data = {
-            'id': topic.id,
-            'name': topic.name,
-            'document_count': topic.document_count,
-            'size_score': topic.size_score,
-            'insights': {
-                'summary': insight.summary if insight else None,
-                'themes': insight.themes if insight else [],
-                'common_questions': insight.common_questions if insight else [],
-                'related_concepts': insight.related_concepts if insight else []
-            } if insight else None,
-            'documents': documents,
-            'related_topics': related_topics
-        }
         return render_template('topic_detail.html', topic=topic_data)
     
-    return jsonify({
-        'id': topic.id,
-        'name': topic.name,
-        'document_count': topic.document_count,
-        'size_score': topic.size_score,
-        'insights': {
-            'summary': insight.summary if insight else None,
-            'themes': insight.themes if insight else [],
-            'common_questions': insight.common_questions if insight else [],
-            'related_concepts': insight.related_concepts if insight else []
-        } if insight else None,
-        'documents': documents,
-        'related_topics': related_topics
-    })
+    return jsonify(topic_data)
 
 @bp.route('/topics/<int:topic_id>/qa', methods=['POST'])
 def topic_qa(topic_id):
@@ -135,64 +88,36 @@ def topic_qa(topic_id):
     if not question:
         return jsonify({'error': 'Question is required'}), 400
     
-    # Get relevant documents
-    assignments = DocumentTopic.query.filter_by(topic_id=topic_id).order_by(
-        DocumentTopic.relevance_score.desc()
-    ).limit(5).all()
-    
-    documents = [assignment.document for assignment in assignments]
-    doc_texts = [f"Document {i+1}:\n{doc.content[:1000]}" for i, doc in enumerate(documents)]
-    context = "\n\n".join(doc_texts)
-    
-    # Generate answer with citations
-    prompt = f"""You are answering a question about the topic "{topic.name}".
-
-Context from relevant documents:
-{context[:4000]}
-
-Question: {question}
-
-Provide a comprehensive answer with inline citations. Format citations as [Doc1], [Doc2], etc. where Doc1 refers to the first document, Doc2 to the second, etc.
-
-Answer:"""
-    
     try:
-        answer = genai_service.chat_completion([
-            {'role': 'system', 'content': 'You are a helpful assistant that provides detailed answers with citations.'},
-            {'role': 'user', 'content': prompt}
-        ])
-        
-        # Extract citations from answer
-        import re
-        citation_pattern = r'\[Doc(\d+)\]'
-        citations = re.findall(citation_pattern, answer)
-        citation_doc_ids = [int(c) - 1 for c in citations if int(c) <= len(documents)]
-        
-        # Map citations to document IDs
-        cited_documents = []
-        for idx in set(citation_doc_ids):
-            if 0 <= idx < len(documents):
-                cited_documents.append({
-                    'document_id': documents[idx].id,
-                    'title': documents[idx].title,
-                    'preview': documents[idx].content[:200]
-                })
+        result = qa_service.answer(topic, question)
         
         # Return HTML for HTMX requests, JSON for API requests
         if request.headers.get('HX-Request'):
             from flask import render_template
             return render_template('qa_answer.html', 
-                                 answer=answer, 
-                                 citations=cited_documents,
+                                 answer=result['answer'], 
+                                 citations=result['citations'],
                                  topic_id=topic_id,
                                  topic_name=topic.name)
         
-        return jsonify({
-            'answer': answer,
-            'citations': cited_documents,
-            'topic_id': topic_id,
-            'topic_name': topic.name
-        })
+        return jsonify(result)
     except Exception as e:
         return jsonify({'error': f'Failed to generate answer: {str(e)}'}), 500
 
+@bp.route('/topics/<int:topic_id>/qa/stream', methods=['POST'])
+def topic_qa_stream(topic_id):
+    """Topic-scoped Q&A streamed as Server-Sent Events: token, citation, then done or error"""
+    topic = Topic.query.get_or_404(topic_id)
+    if request.is_json:
+        data = request.get_json() or {}
+    else:
+        data = request.form.to_dict()
+    question = data.get('question')
+    
+    if not question:
+        return jsonify({'error': 'Question is required'}), 400
+    
+    events = qa_service.answer_stream(topic, question)
+    return Response(stream_with_context(sse_event(event, payload) for event, payload in events),
+                    mimetype='text/event-stream', headers=SSE_HEADERS)
+
@@ -1,12 +1,20 @@
-from flask import Blueprint, render_template, request, jsonify
+from flask import Blueprint, render_template, request, jsonify, Response, stream_with_context, abort
+from markupsafe import escape
 from app import db
-from app.models import Collection, Topic, TopicRelationship, DocumentTopic, TopicInsight, Document, DiscoveryJob
-from app.services.genai_service import GenAIService
+from app.models import Collection, Topic, Document, DiscoveryJob
+from app.services.qa_service import QAService
+from app.services.graph_snapshot import GraphSnapshotStore
+from app.services.topic_detail import TopicDetailService
+from app.sse import sse_event, SSE_HEADERS
+from app.http_cache import cached_response, not_modified
+import gzip
 import json
 
 bp = Blueprint('ui', __name__, url_prefix='')
 
-genai_service = GenAIService()
+qa_service = QAService()
+graph_snapshots = GraphSnapshotStore()
+topic_details = TopicDetailService()
 
 @bp.route('/')
 def index():
@@ -17,34 +25,9 @@ def index():
     # Get graph data if collection is selected
     graph = None
     if collection_id:
-        collection = Collection.query.get(collection_id)
-        if collection:
-            topics = Topic.query.filter_by(collection_id=collection_id).all()
-            relationships = TopicRelationship.query.join(
-                Topic, TopicRelationship.source_topic_id == Topic.id
-            ).filter(Topic.collection_id == collection_id).all()
-            
-            nodes = []
-            for topic in topics:
-                nodes.append({
-                    'id': f't{topic.id}',
-                    'label': topic.name,
-                    'size_score': topic.size_score,
-                    'document_count': topic.document_count,
-                    'avg_confidence': topic.avg_confidence,
-                    'color': topic.color or '#3498db'
-                })
-            
-            edges = []
-            for rel in relationships:
-                edges.append({
-                    'source': f't{rel.source_topic_id}',
-                    'target': f't{rel.target_topic_id}',
-                    'weight': rel.similarity_score,
-                    'type': rel.relationship_type
-                })
-            
-            graph = {'nodes': nodes, 'edges': edges}
+        snapshot = graph_snapshots.get(collection_id)
+        if snapshot:
+            graph = snapshot.graph
     
     return render_template('index.html', 
                          collections=collections, 
@@ -53,97 +36,27 @@ def index():
 
 @bp.route('/collections/<int:collection_id>/graph')
 def get_graph(collection_id):
-    """Get graph HTML fragment"""
-    collection = Collection.query.get_or_404(collection_id)
-    topics = Topic.query.filter_by(collection_id=collection_id).all()
-    relationships = TopicRelationship.query.join(
-        Topic, TopicRelationship.source_topic_id == Topic.id
-    ).filter(Topic.collection_id == collection_id).all()
-    
-    nodes = []
-    for topic in topics:
-        nodes.append({
-            'id': f't{topic.id}',
-            'label': topic.name,
-            'size_score': topic.size_score,
-            'document_count': topic.document_count,
-            'avg_confidence': topic.avg_confidence,
-            'color': topic.color or '#3498db'
-        })
-    
-    edges = []
-    for rel in relationships:
-        edges.append({
-            'source': f't{rel.source_topic_id}',
-            'target': f't{rel.target_topic_id}',
-            'weight': rel.similarity_score,
-            'type': rel.relationship_type
-        })
-    
-    graph = {'nodes': nodes, 'edges': edges}
-    return render_template('graph.html', graph=graph)
+    """Get graph HTML fragment (rendered from the graph snapshot, ETag-validated and gzipped)"""
+    snapshot = graph_snapshots.get(collection_id)
+    if snapshot is None:
+        abort(404)
+    
+    etag = f'{snapshot.etag}-html'
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+    html = render_template('graph.html', graph=snapshot.graph, collection_id=collection_id)
+    return cached_response(etag, gzip.compress(html.encode('utf-8')), mimetype='text/html')
 
-@bp.route('/topics/<int:topic_id>')
-def get_topic_detail(topic_id):
-    """Get topic detail HTML fragment"""
-    topic = Topic.query.get_or_404(topic_id)
-    
-    # Get insights
-    insight = TopicInsight.query.filter_by(topic_id=topic_id).first()
-    
-    # Get documents ranked by relevance
-    assignments = DocumentTopic.query.filter_by(topic_id=topic_id).order_by(
-        DocumentTopic.relevance_score.desc()
-    ).all()
-    
-    documents = []
-    for assignment in assignments:
-        doc = assignment.document
-        documents.append({
-            'id': doc.id,
-            'title': doc.title,
-            'content_preview': doc.content[:200] if doc.content else '',
-            'relevance_score': assignment.relevance_score,
-            'is_primary': assignment.is_primary
-        })
-    
-    # Get related topics
-    related_topics = []
-    relationships = TopicRelationship.query.filter(
-        ((TopicRelationship.source_topic_id == topic_id) |
-         (TopicRelationship.target_topic_id == topic_id))
-    ).all()
-    
-    for rel in relationships:
-        related_topic_id = rel.target_topic_id if rel.source_topic_id == topic_id else rel.source_topic_id
-        related_topic = Topic.query.get(related_topic_id)
-        if related_topic:
-            related_topics.append({
-                'id': related_topic.id,
-                'name': related_topic.name,
-                'similarity_score': rel.similarity_score,
-                'relationship_type': rel.relationship_type
-            })
-    
-    # Sort by similarity
-    related_topics.sort(key=lambda x: x['similarity_score'], reverse=True)
-    
-    topic_data = {
-        'id': topic.id,
-        'name': topic.name,
-        'document_count': topic.document_count,
-        'size_score': topic.size_score,
-        'insights': {
-            'summary': insight.summary if insight else None,
-            'themes': insight.themes if insight else [],
-            'common_questions': insight.common_questions if insight else [],
-            'related_concepts': insight.related_concepts if insight else []
-        } if insight else None,
-        'documents': documents,
-        'related_topics': related_topics
-    }
-    
-    return render_template('topic_detail.html', topic=topic_data)
+@bp.route('/topics/<int:topic_id>/documents')
+def get_topic_documents(topic_id):
+    """Get the next page of a topic's documents as an HTML fragment (the detail view itself is served by the topics blueprint)"""
+    Topic.query.get_or_404(topic_id)
+    page, per_page = topic_details.page_args(request.args.get('page', type=int), request.args.get('per_page', type=int))
+    documents, has_more = topic_details.get_documents(topic_id, page, per_page)
+    return render_template('topic_documents.html',
+                         topic_id=topic_id,
+                         documents=documents,
+                         documents_page={'page': page, 'per_page': per_page, 'has_more': has_more})
 
 @bp.route('/topics/<int:topic_id>/qa', methods=['POST'])
 def topic_qa_html(topic_id):
@@ -154,57 +67,50 @@ def topic_qa_html(topic_id):
     if not question:
         return jsonify({'error': 'Question is required'}), 400
     
-    # Get relevant documents
-    assignments = DocumentTopic.query.filter_by(topic_id=topic_id).order_by(
-        DocumentTopic.relevance_score.desc()
-    ).limit(5).all()
-    
-    documents = [assignment.document for assignment in assignments]
-    doc_texts = [f"Document {i+1}:\n{doc.content[:1000]}" for i, doc in enumerate(documents)]
-    context = "\n\n".join(doc_texts)
-    
-    # Generate answer with citations
-    prompt = f"""You are answering a question about the topic "{topic.name}".
-
-Context from relevant documents:
-{context[:4000]}
-
-Question: {question}
-
-Provide a comprehensive answer with inline citations. Format citations as [Doc1], [Doc2], etc. where Doc1 refers to the first document, Doc2 to the second, etc.
-
-Answer:"""
-    
     try:
-        answer = genai_service.chat_completion([
-            {'role': 'system', 'content': 'You are a helpful assistant that provides detailed answers with citations.'},
-            {'role': 'user', 'content': prompt}
-        ])
-        
-        # Extract citations from answer
-        import re
-        citation_pattern = r'\[Doc(\d+)\]'
-        citations = re.findall(citation_pattern, answer)
-        citation_doc_ids = [int(c) - 1 for c in citations if int(c) <= len(documents)]
-        
-        # Map citations to document IDs
-        cited_documents = []
-        for idx in set(citation_doc_ids):
-            if 0 <= idx < len(documents):
-                cited_documents.append({
-                    'document_id': documents[idx].id,
-                    'title': documents[idx].title,
-                    'preview': documents[idx].content[:200]
-                })
-        
+        result = qa_service.answer(topic, question)
         return render_template('qa_answer.html', 
-                             answer=answer, 
-                             citations=cited_documents,
+                             answer=result['answer'], 
+                             citations=result['citations'],
                              topic_id=topic_id,
                              topic_name=topic.name)
     except Exception as e:
         return jsonify({'error': f'Failed to generate answer: {str(e)}'}), 500
 
+@bp.route('/topics/<int:topic_id>/qa/stream')
+def topic_qa_stream_html(topic_id):
+    """
+    Streaming topic Q&A for HTMX. A plain request returns the answer fragment,
+    whose EventSource (Accept: text/event-stream) reconnects here for the
+    stream of escaped tokens, citation items and the final rendered answer.
+    """
+    topic = Topic.query.get_or_404(topic_id)
+    question = request.args.get('question')
+    
+    if not question:
+        return jsonify({'error': 'Question is required'}), 400
+    
+    if 'text/event-stream' not in request.headers.get('Accept', ''):
+        return render_template('qa_stream.html', topic_id=topic_id, question=question)
+    
+    def fragments():
+        for event, data in qa_service.answer_stream(topic, question):
+            if event == 'token':
+                yield sse_event('token', str(escape(data['text'])))
+            elif event == 'citation':
+                yield sse_event('citation', render_template('qa_citation.html', citation=data))
+            elif event == 'done':
+                yield sse_event('done', render_template('qa_answer.html',
+                                                        answer=data['answer'],
+                                                        citations=data['citations'],
+                                                        topic_id=topic_id,
+                                                        topic_name=topic.name))
+            else:
+                # Errors also end the stream, replacing the partial answer
+                yield sse_event('done', f'<div class="p-4 bg-red-50 rounded-md text-red-700">{escape(data["error"])}</div>')
+    
+    return Response(stream_with_context(fragments()), mimetype='text/event-stream', headers=SSE_HEADERS)
+
 @bp.route('/documents/<int:document_id>/preview')
 def document_preview(document_id):
     """Get document preview HTML fragment"""
@@ -0,0 +1,49 @@
+from typing import List, Tuple, Optional
+import os
+
+# Separators a chunk prefers to end on, strongest first
+BOUNDARIES = ('\n\n', '\n', '. ', ' ')
+
+class DocumentChunker:
+    """
+    Splits document text into overlapping chunks of roughly chunk_tokens
+    tokens (~4 characters per token, as in GenAIService.estimate_tokens).
+    Chunks end on a paragraph, line, sentence or word boundary when one falls
+    in their last quarter, and consecutive chunks share about overlap_tokens.
+    """
+    
+    CHARS_PER_TOKEN = 4
+    
+    def __init__(self, chunk_tokens: Optional[int] = None, overlap_tokens: Optional[int] = None):
+        self.chunk_tokens = int(chunk_tokens or os.getenv('CHUNK_SIZE_TOKENS', '400'))
+        self.overlap_tokens = int(overlap_tokens if overlap_tokens is not None else os.getenv('CHUNK_OVERLAP_TOKENS', '50'))
+        
+        if self.chunk_tokens < 1 or self.overlap_tokens < 0:
+            raise ValueError("Chunk size must be positive and overlap non-negative")
+        if self.overlap_tokens >= self.chunk_tokens:
+            raise ValueError("Chunk overlap must be smaller than the chunk size")
+    
+    def split(self, text: str) -> List[Tuple[int, int]]:
+        """(start, end) character offsets of the chunks of text; blank chunks are skipped"""
+        size = self.chunk_tokens * self.CHARS_PER_TOKEN
+        overlap = self.overlap_tokens * self.CHARS_PER_TOKEN
+        spans = []
+        start = 0
+        while start < len(text):
+            end = min(len(text), start + size)
+            if end < len(text):
+                for separator in BOUNDARIES:
+                    cut = text.rfind(separator, start + size * 3 // 4, end)
+                    if cut != -1:
+                        end = cut + len(separator)
+                        break
+            if text[start:end].strip():
+                spans.append((start, end))
+            if end >= len(text):
+                break
+            
+            # Step back by the overlap, then further back to the start of a word
+            next_start = max(end - overlap, start + 1)
+            space = text.rfind(' ', start + 1, next_start) if overlap else -1
+            start = space + 1 if space != -1 else next_start
+        return spans
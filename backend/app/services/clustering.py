@@ -0,0 +1,297 @@
+from typing import List, Dict, Any, Optional, Callable, Iterable, Tuple, Union
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.decomposition import PCA
+from sklearn.random_projection import GaussianRandomProjection
+from sklearn.metrics import silhouette_score
+from scipy import sparse
+import numpy as np
+import os
+
+CLUSTERING_BACKENDS = ('kmeans', 'minibatch')
+DIMENSIONALITY_REDUCTIONS = ('none', 'pca', 'random_projection')
+
+# A source of (document IDs, float32 embedding chunk) pairs; called once per pass
+ChunkSource = Callable[[], Iterable[Tuple[List[int], np.ndarray]]]
+
+class ClusteringEngine:
+    """
+    Pluggable clustering backends for topic discovery.
+    'kmeans' runs full KMeans on an in-memory matrix; 'minibatch' streams
+    embedding chunks through MiniBatchKMeans.partial_fit so the collection
+    never has to fit in memory. Either backend can reduce dimensionality
+    first with PCA or a Gaussian random projection.
+    The number of clusters is fixed (n_clusters) or, with n_clusters='auto',
+    chosen per run by silhouette score on a subsample.
+    """
+    
+    # Rows scored by silhouette_score, which is quadratic in its input
+    SILHOUETTE_SAMPLE_SIZE = 2000
+    
+    def __init__(self, backend: Optional[str] = None, reduction: Optional[str] = None,
+                 n_components: Optional[int] = None, batch_size: Optional[int] = None,
+                 n_init: Optional[int] = None, epochs: Optional[int] = None,
+                 sample_size: Optional[int] = None, n_clusters: Optional[Union[int, str]] = None,
+                 max_clusters: Optional[int] = None, k_candidates: Optional[int] = None,
+                 random_state: int = 42):
+        self.backend = backend or os.getenv('CLUSTERING_BACKEND', 'kmeans')
+        self.reduction = reduction or os.getenv('CLUSTERING_REDUCTION', 'none')
+        self.n_components = int(n_components or os.getenv('CLUSTERING_N_COMPONENTS', '64'))
+        self.batch_size = int(batch_size or os.getenv('CLUSTERING_BATCH_SIZE', '2048'))
+        self.n_init = int(n_init or os.getenv('CLUSTERING_N_INIT', '10'))
+        self.epochs = int(epochs or os.getenv('CLUSTERING_EPOCHS', '2'))
+        self.sample_size = int(sample_size or os.getenv('CLUSTERING_SAMPLE_SIZE', '10000'))
+        n_clusters = str(n_clusters or os.getenv('CLUSTERING_N_CLUSTERS', 'auto')).lower()
+        self.n_clusters = n_clusters if n_clusters == 'auto' else int(n_clusters)
+        self.max_clusters = int(max_clusters or os.getenv('CLUSTERING_MAX_CLUSTERS', '50'))
+        self.k_candidates = int(k_candidates or os.getenv('CLUSTERING_K_CANDIDATES', '8'))
+        self.random_state = random_state
+        
+        if self.backend not in CLUSTERING_BACKENDS:
+            raise ValueError(f"Unknown clustering backend '{self.backend}'. Choose from: {', '.join(CLUSTERING_BACKENDS)}")
+        if self.reduction not in DIMENSIONALITY_REDUCTIONS:
+            raise ValueError(f"Unknown dimensionality reduction '{self.reduction}'. Choose from: {', '.join(DIMENSIONALITY_REDUCTIONS)}")
+        if min(self.n_components, self.batch_size, self.n_init, self.epochs, self.sample_size) < 1:
+            raise ValueError("Clustering n_components, batch_size, n_init, epochs and sample_size must be positive")
+        if self.n_clusters != 'auto' and self.n_clusters < 1:
+            raise ValueError("Clustering n_clusters must be 'auto' or a positive number")
+        if self.max_clusters < 2 or self.k_candidates < 1:
+            raise ValueError("Clustering max_clusters must be at least 2 and k_candidates positive")
+    
+    @classmethod
+    def from_settings(cls, settings: Optional[Dict[str, Any]] = None) -> 'ClusteringEngine':
+        """Build an engine from a settings dict (as stored on collections and jobs)"""
+        settings = settings or {}
+        return cls(
+            backend=settings.get('backend'),
+            reduction=settings.get('reduction'),
+            n_components=settings.get('n_components'),
+            batch_size=settings.get('batch_size'),
+            n_init=settings.get('n_init'),
+            epochs=settings.get('epochs'),
+            sample_size=settings.get('sample_size'),
+            n_clusters=settings.get('n_clusters'),
+            max_clusters=settings.get('max_clusters'),
+            k_candidates=settings.get('k_candidates')
+        )
+    
+    @classmethod
+    def for_collection(cls, collection, overrides: Optional[Dict[str, Any]] = None) -> 'ClusteringEngine':
+        """Collection defaults, then per-job overrides, then environment defaults"""
+        settings = dict(collection.clustering_params or {})
+        if collection.clustering_backend:
+            settings['backend'] = collection.clustering_backend
+        settings.update({key: value for key, value in (overrides or {}).items() if value not in (None, '')})
+        return cls.from_settings(settings)
+    
+    def settings(self) -> Dict[str, Any]:
+        """Settings needed to reproduce this engine"""
+        return {
+            'backend': self.backend,
+            'reduction': self.reduction,
+            'n_components': self.n_components,
+            'batch_size': self.batch_size,
+            'n_init': self.n_init,
+            'epochs': self.epochs,
+            'sample_size': self.sample_size,
+            'n_clusters': self.n_clusters,
+            'max_clusters': self.max_clusters,
+            'k_candidates': self.k_candidates
+        }
+    
+    @property
+    def streaming(self) -> bool:
+        """Whether this engine reads embeddings in chunks instead of one matrix"""
+        return self.backend == 'minibatch'
+    
+    def fit(self, doc_ids: List[int], matrix: np.ndarray, n_clusters: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Cluster an in-memory embedding matrix into n_clusters clusters (or
+        the engine's cluster count, see select_k).
+        Returns doc_ids, labels, centroids (mean member embedding in the
+        original space), each document's cosine similarity to its centroid,
+        n_clusters and the silhouette score of an automatic choice (else None).
+        """
+        reduced = self._reduce_matrix(matrix)
+        score = None
+        if n_clusters is None:
+            rng = np.random.default_rng(self.random_state)
+            sample = reduced[rng.choice(len(reduced), self.sample_size, replace=False)] \
+                if len(reduced) > self.sample_size else reduced
+            n_clusters, score = self.select_k(sample)
+        if self.backend == 'kmeans':
+            model = KMeans(n_clusters=n_clusters, random_state=self.random_state, n_init=self.n_init)
+        else:
+            model = MiniBatchKMeans(n_clusters=n_clusters, random_state=self.random_state,
+                                    batch_size=self.batch_size, n_init=self.n_init)
+        labels = model.fit_predict(reduced)
+        
+        centroids = self._centroids(matrix, labels, n_clusters)
+        return {
+            'doc_ids': list(doc_ids),
+            'labels': labels,
+            'centroids': centroids,
+            'similarities': row_cosine_similarity(matrix, centroids[labels]),
+            'n_clusters': n_clusters,
+            'silhouette_score': score
+        }
+    
+    def fit_stream(self, chunk_source: ChunkSource, n_clusters: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Cluster embeddings streamed in chunks with MiniBatchKMeans.partial_fit.
+        chunk_source is called once per pass; peak memory is one chunk, the
+        sample and the label/similarity arrays. The cluster count is chosen
+        on the sample. Returns the same structure as fit().
+        """
+        # Pass 1: a uniform sample fits the reducer and seeds the centers, so
+        # chunks arriving in document order cannot bias the initialization
+        sample = self._sample(chunk_source)
+        reducer = self._make_reducer(*sample.shape)
+        if reducer is not None:
+            reducer.fit(sample)
+        transform = reducer.transform if reducer is not None else (lambda chunk: chunk)
+        score = None
+        if n_clusters is None:
+            n_clusters, score = self.select_k(transform(sample))
+        seed = KMeans(n_clusters=n_clusters, random_state=self.random_state, n_init=self.n_init).fit(transform(sample))
+        
+        # Refine the centers over every chunk. Chunks are not shuffled, so a
+        # cluster missing from one chunk must not have its center reassigned.
+        model = MiniBatchKMeans(n_clusters=n_clusters, init=seed.cluster_centers_, n_init=1,
+                                random_state=self.random_state, batch_size=self.batch_size,
+                                reassignment_ratio=0.0)
+        for _ in range(self.epochs):
+            # partial_fit needs at least n_clusters rows per call
+            pending = []
+            pending_rows = 0
+            for _, chunk in chunk_source():
+                pending.append(transform(chunk))
+                pending_rows += len(chunk)
+                if pending_rows >= max(n_clusters, self.batch_size):
+                    model.partial_fit(np.vstack(pending))
+                    pending, pending_rows = [], 0
+            if pending_rows >= n_clusters:
+                model.partial_fit(np.vstack(pending))
+        
+        # Assign labels and accumulate original-space centroids
+        doc_ids = []
+        labels = []
+        sums = None
+        counts = np.zeros(n_clusters, dtype=np.int64)
+        for ids, chunk in chunk_source():
+            chunk_labels = model.predict(transform(chunk))
+            chunk_sums = cluster_sums(chunk, chunk_labels, n_clusters)
+            sums = chunk_sums if sums is None else sums + chunk_sums
+            counts += np.bincount(chunk_labels, minlength=n_clusters)
+            doc_ids.extend(ids)
+            labels.append(chunk_labels)
+        labels = np.concatenate(labels) if labels else np.empty(0, dtype=int)
+        centroids = (sums / np.maximum(counts, 1)[:, None]).astype(np.float32) if sums is not None \
+            else np.empty((n_clusters, 0), dtype=np.float32)
+        
+        # Similarity of each document to its centroid
+        similarities = []
+        offset = 0
+        for _, chunk in chunk_source():
+            chunk_labels = labels[offset:offset + len(chunk)]
+            similarities.append(row_cosine_similarity(chunk, centroids[chunk_labels]))
+            offset += len(chunk)
+        
+        return {
+            'doc_ids': doc_ids,
+            'labels': labels,
+            'centroids': centroids,
+            'similarities': np.concatenate(similarities) if similarities else np.empty(0, dtype=np.float32),
+            'n_clusters': n_clusters,
+            'silhouette_score': score
+        }
+    
+    def candidate_counts(self, n_samples: int) -> List[int]:
+        """
+        Cluster counts tried by automatic selection: k_candidates values
+        spaced geometrically from 2 to max_clusters, with clusters averaging
+        at least 3 rows and (for silhouette scoring) fewer clusters than rows
+        """
+        upper = min(self.max_clusters, max(2, n_samples // 3), n_samples - 1)
+        if upper <= 2:
+            return [max(1, min(2, n_samples))]
+        return sorted({int(k) for k in np.geomspace(2, upper, num=self.k_candidates).round()})
+    
+    def select_k(self, sample: np.ndarray) -> Tuple[int, Optional[float]]:
+        """
+        Number of clusters for a collection, from a (reduced) uniform sample
+        of its embeddings. A fixed n_clusters is capped by the sample size;
+        in 'auto' mode each candidate count is fitted on the sample with
+        MiniBatchKMeans and the best silhouette score wins, so the cost
+        depends on sample_size rather than on the collection size.
+        Returns the count and its silhouette score (None when not scored).
+        """
+        if self.n_clusters != 'auto':
+            return max(1, min(self.n_clusters, len(sample))), None
+        candidates = self.candidate_counts(len(sample))
+        if len(candidates) == 1:
+            return candidates[0], None
+        
+        best_k, best_score = candidates[0], None
+        for k in candidates:
+            labels = MiniBatchKMeans(n_clusters=k, random_state=self.random_state, batch_size=self.batch_size,
+                                     n_init=3).fit_predict(sample)
+            if len(np.unique(labels)) < 2:
+                continue
+            score = float(silhouette_score(sample, labels, random_state=self.random_state,
+                                           sample_size=min(len(sample), self.SILHOUETTE_SAMPLE_SIZE)))
+            if best_score is None or score > best_score:
+                best_k, best_score = k, score
+        return best_k, best_score
+    
+    def _reduce_matrix(self, matrix: np.ndarray) -> np.ndarray:
+        reducer = self._make_reducer(*matrix.shape)
+        return reducer.fit_transform(matrix) if reducer is not None else matrix
+    
+    def _make_reducer(self, n_samples: int, n_features: int):
+        n_components = min(self.n_components, n_features)
+        if self.reduction == 'none' or n_components >= n_features:
+            return None
+        if self.reduction == 'pca':
+            return PCA(n_components=min(n_components, n_samples), random_state=self.random_state)
+        return GaussianRandomProjection(n_components=n_components, random_state=self.random_state)
+    
+    def _sample(self, chunk_source: ChunkSource) -> np.ndarray:
+        """Uniform random sample of up to sample_size rows, in one pass"""
+        rng = np.random.default_rng(self.random_state)
+        sample = None
+        keys = None
+        for _, chunk in chunk_source():
+            chunk_keys = rng.random(len(chunk))
+            if sample is None:
+                sample, keys = chunk, chunk_keys
+            else:
+                sample, keys = np.vstack([sample, chunk]), np.concatenate([keys, chunk_keys])
+            if len(sample) > self.sample_size:
+                # Keep the rows with the smallest random keys
+                keep = np.argpartition(keys, self.sample_size)[:self.sample_size]
+                sample, keys = sample[keep], keys[keep]
+        return sample
+    
+    @staticmethod
+    def _centroids(matrix: np.ndarray, labels: np.ndarray, n_clusters: int) -> np.ndarray:
+        sums = cluster_sums(matrix, labels, n_clusters)
+        counts = np.bincount(labels, minlength=n_clusters)
+        return (sums / np.maximum(counts, 1)[:, None]).astype(np.float32)
+
+def cluster_sums(matrix: np.ndarray, labels: np.ndarray, n_clusters: int) -> np.ndarray:
+    """Per-cluster sums of matrix rows, via a sparse one-hot product"""
+    one_hot = sparse.csr_matrix(
+        (np.ones(len(labels), dtype=np.float64), (labels, np.arange(len(labels)))),
+        shape=(n_clusters, len(labels))
+    )
+    return np.asarray(one_hot @ matrix.astype(np.float64))
+
+def row_cosine_similarity(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Cosine similarity between matching rows of two matrices"""
+    norms = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+    return np.einsum('ij,ij->i', a, b) / np.where(norms == 0, 1.0, norms)
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Scale rows to unit length, leaving zero rows as they are"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
@@ -1,12 +1,31 @@
 from typing import Dict, Any, Optional
 from app import db
-from app.models import Collection, DiscoveryJob, JobStatus
+from app.models import Collection, DiscoveryJob, JobStatus, Topic
 from app.services.topic_discovery import TopicDiscoveryService
 from app.services.relationship_service import RelationshipService
 from app.services.insight_service import InsightService
+from app.services.clustering import ClusteringEngine
+from app.services.graph_snapshot import GraphSnapshotStore
+from rq.job import Dependency
 from datetime import datetime
 import traceback
 
+# Pipeline stages in order. Each completed stage is checkpointed on the job,
+# so a failed or killed job resumes after its last completed stage.
+STAGES = ('embed', 'cluster', 'name', 'relate', 'insights', 'rescore')
+
+STAGE_STEPS = {
+    'embed': "Embedding documents",
+    'cluster': "Discovering topics",
+    'name': "Naming topics",
+    'relate': "Building relationships",
+    'insights': "Generating insights",
+    'rescore': "Calculating relevance scores"
+}
+
+# Stages that only depend on 'name' and can run as concurrent RQ jobs
+PARALLEL_STAGES = ('relate', 'insights')
+
 class DiscoveryJobService:
     """Service for running topic discovery as a background job"""
     
@@ -14,12 +33,17 @@ class DiscoveryJobService:
         self.topic_discovery = TopicDiscoveryService()
         self.relationship_service = RelationshipService()
         self.insight_service = InsightService()
+        self.graph_snapshots = GraphSnapshotStore()
     
-    def run_discovery(self, collection_id: int, incremental: bool = False, job_id: Optional[int] = None) -> Dict[str, Any]:
+    def run_discovery(self, collection_id: int, incremental: bool = False, job_id: Optional[int] = None,
+                      queue=None) -> Dict[str, Any]:
         """
-        Run the full discovery pipeline.
+        Run the discovery pipeline, skipping stages the job already completed.
         Updates job status and progress throughout.
+        With an RQ queue, relationships and insights are enqueued as two
+        concurrent jobs followed by a finalize job; otherwise every stage runs here.
         """
+        job = None
         try:
             # Get or create job
             if job_id:
@@ -37,63 +61,189 @@ class DiscoveryJobService:
                 db.session.add(job)
                 db.session.commit()
             
-            # Update job status
-            job.status = JobStatus.RUNNING
-            job.progress = 0.0
-            job.current_step = "Starting discovery"
-            db.session.commit()
-            
-            # Step 1: Discover topics
-            job.current_step = "Discovering topics"
-            job.progress = 0.2
-            db.session.commit()
-            
-            result = self.topic_discovery.discover_topics(collection_id, incremental=incremental)
-            topics = result['topics']
-            
-            # Step 2: Build relationships
-            job.current_step = "Building relationships"
-            job.progress = 0.5
-            db.session.commit()
-            
-            relationships = self.relationship_service.build_relationships(collection_id)
-            
-            # Step 3: Generate insights
-            job.current_step = "Generating insights"
-            job.progress = 0.7
-            db.session.commit()
-            
-            topic_ids = [topic.id for topic in topics]
-            insights = self.insight_service.generate_insights_batch(topic_ids)
-            
-            # Step 4: Recalculate relevance scores
-            job.current_step = "Calculating relevance scores"
-            job.progress = 0.9
-            db.session.commit()
+            # Resolve the clustering backend (job settings, else collection defaults) and record it
+            if job.clustering_params:
+                clustering = ClusteringEngine.from_settings(job.clustering_params)
+            else:
+                clustering = ClusteringEngine.for_collection(Collection.query.get_or_404(collection_id))
+            job.clustering_backend = clustering.backend
+            job.clustering_params = clustering.settings()
             
-            self.topic_discovery.calculate_relevance_scores(collection_id)
+            # A finished job is run again from scratch rather than resumed
+            if job.status == JobStatus.SUCCEEDED:
+                job.checkpoints = None
+                job.completed_at = None
             
-            # Complete
-            job.status = JobStatus.SUCCEEDED
-            job.progress = 1.0
-            job.current_step = "Completed"
-            job.completed_at = datetime.utcnow()
+            # Update job status
+            if not job.checkpoints:
+                job.incremental = incremental
+                job.progress = 0.0
+            job.status = JobStatus.RUNNING
+            job.error_message = None
+            job.current_step = "Resuming discovery" if job.checkpoints else "Starting discovery"
             db.session.commit()
-            
-            return {
-                'status': 'success',
-                'topics_count': len(topics),
-                'relationships_count': len(relationships),
-                'insights_count': len(insights)
-            }
-            
+            job_id = job.id
         except Exception as e:
-            # Update job with error
-            if job:
-                job.status = JobStatus.FAILED
-                job.error_message = str(e)
-                job.current_step = f"Error: {str(e)}"
+            self._fail(job.id if job else None, e)
+            raise Exception(f"Discovery job failed: {str(e)}\n{traceback.format_exc()}")
+        
+        self.run_stages(job_id, ('embed', 'cluster', 'name'))
+        
+        pending = [stage for stage in PARALLEL_STAGES if stage not in self._checkpoints(job_id)]
+        if queue is not None and pending:
+            from app.workers import run_discovery_stage_job, finalize_discovery_job
+            stage_jobs = [queue.enqueue(run_discovery_stage_job, job_id, stage) for stage in pending]
+            # Finalize also runs when a stage job fails, so the job is never left RUNNING
+            finalize_job = queue.enqueue(finalize_discovery_job, job_id,
+                                         depends_on=Dependency(jobs=stage_jobs, allow_failure=True))
+            # Recorded so a resume can tell whether the stages are still queued or running
+            job = DiscoveryJob.query.get(job_id)
+            job.stage_rq_job_ids = dict(
+                {stage: stage_job.id for stage, stage_job in zip(pending, stage_jobs)},
+                finalize=finalize_job.id
+            )
+            db.session.commit()
+            return {'status': 'running', 'job_id': job_id, 'enqueued_stages': pending}
+        
+        self.run_stages(job_id, PARALLEL_STAGES)
+        return self.finalize(job_id)
+    
+    def run_stages(self, job_id: int, stages) -> Dict[str, Any]:
+        """
+        Run pipeline stages in order, skipping checkpointed ones.
+        On failure the job is marked FAILED and keeps its earlier checkpoints.
+        """
+        try:
+            for stage in stages:
+                if stage in self._checkpoints(job_id):
+                    continue
+                job = DiscoveryJob.query.get(job_id)
+                job.current_step = STAGE_STEPS[stage]
                 db.session.commit()
-            
+                
+                results = getattr(self, f'_run_{stage}')(job)
+                self._checkpoint(job_id, stage, results)
+            return self._checkpoints(job_id)
+        except Exception as e:
+            self._fail(job_id, e)
             raise Exception(f"Discovery job failed: {str(e)}\n{traceback.format_exc()}")
-
+    
+    def finalize_stages(self, job_id: int) -> Dict[str, Any]:
+        """
+        Finalize once the enqueued stage jobs have ended. If one of them did
+        not complete its stage (it failed, or its worker died) the job is
+        marked FAILED instead, keeping its checkpoints for a resume.
+        """
+        missing = [stage for stage in PARALLEL_STAGES if stage not in self._checkpoints(job_id)]
+        if not missing:
+            return self.finalize(job_id)
+        
+        job = DiscoveryJob.query.get(job_id)
+        if job.status != JobStatus.FAILED:
+            self._fail(job_id, Exception(f"Stage jobs did not complete: {', '.join(missing)}"))
+        return {'status': 'failed', 'job_id': job_id, 'missing_stages': missing}
+    
+    def finalize(self, job_id: int) -> Dict[str, Any]:
+        """
+        Recalculate relevance scores, mark the job as succeeded and
+        materialize the collection's graph snapshot for the new job version
+        """
+        checkpoints = self.run_stages(job_id, STAGES)
+        
+        # Complete
+        job = DiscoveryJob.query.get(job_id)
+        job.status = JobStatus.SUCCEEDED
+        job.progress = 1.0
+        job.current_step = "Completed"
+        job.completed_at = datetime.utcnow()
+        db.session.commit()
+        
+        # The graph endpoints build a missing snapshot themselves, so a failure here is not fatal
+        try:
+            self.graph_snapshots.materialize(job.collection_id)
+        except Exception as e:
+            print(f"Failed to materialize graph snapshot for collection {job.collection_id}: {str(e)}")
+        
+        return {
+            'status': 'success',
+            'topics_count': checkpoints['cluster'].get('topics', 0),
+            'relationships_count': checkpoints['relate'].get('relationships', 0),
+            'insights_count': checkpoints['insights'].get('insights', 0),
+            'assigned_documents': checkpoints['cluster'].get('assigned_documents'),
+            'n_clusters': checkpoints['cluster'].get('n_clusters'),
+            'silhouette_score': checkpoints['cluster'].get('silhouette_score')
+        }
+    
+    def _run_embed(self, job: DiscoveryJob) -> Dict[str, Any]:
+        embeddings = self.topic_discovery.embedding_store.backfill_collection(job.collection_id)
+        return {'embedded_documents': len(embeddings)}
+    
+    def _run_cluster(self, job: DiscoveryJob) -> Dict[str, Any]:
+        result = self.topic_discovery.cluster_topics(
+            job.collection_id,
+            incremental=bool(job.incremental),
+            clustering=ClusteringEngine.from_settings(job.clustering_params)
+        )
+        results = {
+            'topics': len(result['topics']),
+            'reclustered': result.get('reclustered', True),
+            'assigned_documents': result.get('assigned_documents')
+        }
+        if results['reclustered']:
+            # Cluster count and quality of this run, queryable on the job row
+            job.n_clusters = result.get('n_clusters')
+            job.silhouette_score = result.get('silhouette_score')
+            results.update(n_clusters=job.n_clusters, silhouette_score=job.silhouette_score)
+            db.session.commit()
+        else:
+            # Incremental fast path: new documents joined existing topics, so
+            # topic names and insights are kept (no LLM calls). Centroids moved,
+            # so relationships and relevance scores are still recomputed.
+            for stage in ('name', 'insights'):
+                self._checkpoint(job.id, stage, {'skipped': True})
+        return results
+    
+    def _run_name(self, job: DiscoveryJob) -> Dict[str, Any]:
+        topics = self.topic_discovery.name_topics(self._topic_ids(job.collection_id))
+        return {'topics': len(topics)}
+    
+    def _run_relate(self, job: DiscoveryJob) -> Dict[str, Any]:
+        relationships = self.relationship_service.build_relationships(job.collection_id)
+        return {'relationships': len(relationships)}
+    
+    def _run_insights(self, job: DiscoveryJob) -> Dict[str, Any]:
+        insights = self.insight_service.generate_insights_batch(self._topic_ids(job.collection_id))
+        return {'insights': len(insights)}
+    
+    def _run_rescore(self, job: DiscoveryJob) -> Dict[str, Any]:
+        self.topic_discovery.calculate_relevance_scores(job.collection_id)
+        return {}
+    
+    def _topic_ids(self, collection_id: int):
+        """Top-level topics; sub-topics are named when first expanded"""
+        return [topic_id for (topic_id,) in db.session.query(Topic.id).filter_by(
+            collection_id=collection_id, parent_id=None
+        ).order_by(Topic.id)]
+    
+    def _checkpoints(self, job_id: int) -> Dict[str, Any]:
+        job = DiscoveryJob.query.populate_existing().get(job_id)
+        return dict(job.checkpoints or {})
+    
+    def _checkpoint(self, job_id: int, stage: str, results: Dict[str, Any]):
+        """Record a completed stage; the row lock keeps concurrent stage jobs from losing updates"""
+        job = DiscoveryJob.query.populate_existing().with_for_update().filter_by(id=job_id).one()
+        checkpoints = dict(job.checkpoints or {})
+        checkpoints[stage] = dict(results, completed_at=datetime.utcnow().isoformat())
+        job.checkpoints = checkpoints
+        job.progress = round(len([s for s in STAGES if s in checkpoints]) / (len(STAGES) + 1), 2)
+        db.session.commit()
+    
+    def _fail(self, job_id: Optional[int], error: Exception):
+        """Update job with error"""
+        db.session.rollback()
+        job = DiscoveryJob.query.get(job_id) if job_id else None
+        if job:
+            job.status = JobStatus.FAILED
+            job.error_message = str(error)
+            job.current_step = f"Error: {str(error)}"
+            db.session.commit()
@@ -2,6 +2,9 @@ from typing import List, Dict, Any, Optional
 from app import db
 from app.models import Collection, Document, DocumentEmbedding
 from app.services.genai_service import GenAIService
+from app.services.embedding_cache import EmbeddingCache
+from app.services.embedding_store import EmbeddingStore
+from app.services.near_duplicates import NearDuplicateDetector
 import os
 
 class DocumentService:
@@ -9,6 +12,9 @@ class DocumentService:
     
     def __init__(self):
         self.genai = GenAIService()
+        self.embedding_cache = EmbeddingCache(self.genai)
+        self.embedding_store = EmbeddingStore(self.embedding_cache)
+        self.near_duplicates = NearDuplicateDetector()
     
     def add_document(self, collection_id: int, content: str, title: Optional[str] = None, 
                     file_path: Optional[str] = None, file_type: Optional[str] = None) -> Document:
@@ -30,33 +36,124 @@ class DocumentService:
         db.session.add(document)
         db.session.commit()
         
+        # Near-duplicates of an earlier document are not embedded
+        duplicates = self.near_duplicates.detect(collection_id, [(document.id, content)])
+        db.session.commit()
+        if duplicates:
+            return document
+        
         # Generate embedding
         try:
-            embedding_vec = self.genai.get_embedding(content[:8000])
-            embedding = DocumentEmbedding(
-                document_id=document.id,
-                embedding=embedding_vec,
-                model=self.genai.embedding_model
-            )
-            db.session.add(embedding)
-            db.session.commit()
+            if self.embedding_store.uses_chunks:
+                self.embedding_store.embed_chunked([document.id])
+            else:
+                embedding_vec = self.embedding_cache.get_embedding(content)
+                embedding = DocumentEmbedding(
+                    document_id=document.id,
+                    embedding=embedding_vec,
+                    model=self.genai.embedding_model
+                )
+                db.session.add(embedding)
+                db.session.commit()
         except Exception as e:
             # Document is saved even if embedding fails
             print(f"Failed to generate embedding for document {document.id}: {str(e)}")
         
         return document
     
-    def add_documents_batch(self, collection_id: int, documents: List[Dict[str, Any]]) -> List[Document]:
-        """Add multiple documents to a collection"""
+    def ingest_documents(self, collection_id: int, documents: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Add multiple documents with one bulk insert and batched embedding calls.
+        Returns the added documents and their IDs, 'duplicates' (stored but
+        not embedded near-duplicates, with the document they duplicate), plus
+        per-document failures: 'failed' for documents that could not be
+        stored and 'embedding_failed' for stored documents whose embedding
+        could not be generated.
+        """
+        Collection.query.get_or_404(collection_id)
+        existing_count = Document.query.filter_by(collection_id=collection_id).count()
+        
         added_docs = []
-        for doc_data in documents:
-            doc = self.add_document(
+        failed = []
+        for index, doc_data in enumerate(documents):
+            content = doc_data.get('content') if isinstance(doc_data, dict) else None
+            if not isinstance(content, str):
+                failed.append({'index': index, 'error': 'Document content must be a string'})
+                continue
+            
+            # Extract title from content if not provided
+            title = doc_data.get('title')
+            if not title:
+                title = content[:100].split('\n')[0].strip() or f"Document {existing_count + len(added_docs) + 1}"
+            
+            added_docs.append(Document(
                 collection_id=collection_id,
-                content=doc_data.get('content', ''),
-                title=doc_data.get('title'),
+                title=title,
+                content=content,
                 file_path=doc_data.get('file_path'),
-                file_type=doc_data.get('file_type')
+                file_type=doc_data.get('file_type'),
+                file_mtime=doc_data.get('file_mtime'),
+                file_hash=doc_data.get('file_hash')
+            ))
+        
+        if not added_docs:
+            return {'documents': [], 'document_ids': [], 'duplicates': [], 'failed': failed, 'embedding_failed': []}
+        
+        db.session.add_all(added_docs)
+        db.session.flush()
+        # Capture IDs and texts before commit expires the instances
+        document_ids = [doc.id for doc in added_docs]
+        contents = [doc.content for doc in added_docs]
+        db.session.commit()
+        
+        # Near-duplicates (of the collection or of earlier documents in the batch) are not embedded
+        duplicates = self.near_duplicates.detect(collection_id, list(zip(document_ids, contents)))
+        db.session.commit()
+        to_embed = [(doc_id, content) for doc_id, content in zip(document_ids, contents) if doc_id not in duplicates]
+        
+        # Documents are saved even if embedding fails
+        if self.embedding_store.uses_chunks:
+            _, embedding_failed = self.embedding_store.embed_chunked([doc_id for doc_id, _ in to_embed])
+        else:
+            embeddings, embedding_failed = self._embed_texts(
+                [doc_id for doc_id, _ in to_embed],
+                [content[:self.genai.embedding_max_chars] for _, content in to_embed]
             )
-            added_docs.append(doc)
-        return added_docs
-
+            self.embedding_store.save(embeddings)
+        
+        return {
+            'documents': added_docs,
+            'document_ids': document_ids,
+            'duplicates': [{'document_id': doc_id, 'duplicate_of': original} for doc_id, original in duplicates.items()],
+            'failed': failed,
+            'embedding_failed': embedding_failed
+        }
+    
+    def _embed_texts(self, document_ids: List[int], texts: List[str]):
+        """
+        Embed document texts through the embedding cache, which batches misses
+        by token budget and isolates failures to the documents that caused them.
+        """
+        embeddings = {}
+        embedding_failed = []
+        
+        pending = []
+        for doc_id, text in zip(document_ids, texts):
+            if text.strip():
+                pending.append((doc_id, text))
+            else:
+                embedding_failed.append({'document_id': doc_id, 'error': 'Document content is empty'})
+        
+        vectors, errors = self.embedding_cache.embed_many([text for _, text in pending])
+        for idx, ((doc_id, _), vec) in enumerate(zip(pending, vectors)):
+            if vec is None:
+                print(f"Failed to generate embedding for document {doc_id}: {errors[idx]}")
+                embedding_failed.append({'document_id': doc_id, 'error': errors[idx]})
+            else:
+                embeddings[doc_id] = vec
+        
+        return embeddings, embedding_failed
+    
+    def add_documents_batch(self, collection_id: int, documents: List[Dict[str, Any]]) -> List[Document]:
+        """Add multiple documents to a collection"""
+        return self.ingest_documents(collection_id, documents)['documents']
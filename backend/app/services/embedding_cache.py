@@ -0,0 +1,202 @@
+from typing import List, Dict, Any, Optional, Tuple
+from app import db
+from app.models import EmbeddingCacheEntry
+from app.db_utils import dialect_insert
+from app.services.genai_service import GenAIService
+from sqlalchemy import select, update, delete, func
+from datetime import datetime
+import threading
+import hashlib
+import os
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed embedding cache shared across collections.
+    Entries are keyed by (embedding model, SHA-256 of the truncated text), so
+    re-ingesting text that was already embedded costs no API calls.
+    """
+
+    # Hit/miss counters are process-wide, shared by every instance
+    _stats_lock = threading.Lock()
+    _hits = 0
+    _misses = 0
+    # Entries stored by this process since its last eviction check
+    _stored = 0
+
+    # Maximum number of hashes per IN (...) clause
+    QUERY_CHUNK_SIZE = 1000
+
+    def __init__(self, genai: Optional[GenAIService] = None):
+        self.genai = genai or GenAIService()
+        self.enabled = os.getenv('EMBEDDING_CACHE_ENABLED', 'true').lower() in ('true', '1', 'yes')
+        self.max_entries = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', '500000'))
+
+    def content_hash(self, text: str) -> str:
+        """Hash of the text exactly as it is sent to the embeddings API"""
+        return hashlib.sha256(text[:self.genai.embedding_max_chars].encode('utf-8')).hexdigest()
+
+    def lookup(self, texts: List[str]) -> Dict[str, List[float]]:
+        """Return cached embeddings for texts, keyed by content hash"""
+        hashes = list(dict.fromkeys(self.content_hash(text) for text in texts))
+        if not self.enabled or not hashes:
+            return {}
+
+        found = {}
+        for i in range(0, len(hashes), self.QUERY_CHUNK_SIZE):
+            chunk = hashes[i:i + self.QUERY_CHUNK_SIZE]
+            rows = db.session.query(
+                EmbeddingCacheEntry.content_hash, EmbeddingCacheEntry.embedding
+            ).filter(
+                EmbeddingCacheEntry.model == self.genai.embedding_model,
+                EmbeddingCacheEntry.content_hash.in_(chunk)
+            ).all()
+            found.update({content_hash: embedding for content_hash, embedding in rows})
+
+        if found:
+            # Touch entries so eviction keeps recently used embeddings
+            found_hashes = list(found)
+            now = datetime.utcnow()
+            for i in range(0, len(found_hashes), self.QUERY_CHUNK_SIZE):
+                db.session.execute(
+                    update(EmbeddingCacheEntry).where(
+                        EmbeddingCacheEntry.model == self.genai.embedding_model,
+                        EmbeddingCacheEntry.content_hash.in_(found_hashes[i:i + self.QUERY_CHUNK_SIZE])
+                    ).values(hit_count=EmbeddingCacheEntry.hit_count + 1, last_used_at=now)
+                )
+
+        self._record(hits=len(found), misses=len(hashes) - len(found))
+        return found
+
+    def store(self, embeddings: Dict[str, List[float]]):
+        """
+        Store embeddings keyed by content hash. Like the touches in lookup,
+        the insert joins the caller's transaction. Capacity is only checked
+        once this process has stored as many entries as eviction frees.
+        """
+        if not self.enabled or not embeddings:
+            return
+
+        now = datetime.utcnow()
+        stmt = dialect_insert(EmbeddingCacheEntry).on_conflict_do_nothing(
+            index_elements=['model', 'content_hash']
+        )
+        db.session.execute(stmt, [{
+            'model': self.genai.embedding_model,
+            'content_hash': content_hash,
+            'embedding': embedding,
+            'hit_count': 0,
+            'created_at': now,
+            'last_used_at': now
+        } for content_hash, embedding in embeddings.items()])
+
+        with self._stats_lock:
+            EmbeddingCache._stored += len(embeddings)
+            due = EmbeddingCache._stored >= max(1, self.max_entries - int(self.max_entries * 0.9))
+            if due:
+                EmbeddingCache._stored = 0
+        if due:
+            self.evict(commit=False)
+
+    def evict(self, commit: bool = True) -> int:
+        """
+        Delete least recently used entries once the cache exceeds max_entries.
+        Trims down to 90% of capacity so eviction does not run on every insert.
+        Workers call this after discovery; store() calls it periodically.
+        """
+        count = db.session.query(func.count(EmbeddingCacheEntry.id)).scalar() or 0
+        if count <= self.max_entries:
+            return 0
+
+        excess = count - int(self.max_entries * 0.9)
+        oldest_ids = select(EmbeddingCacheEntry.id).order_by(
+            EmbeddingCacheEntry.last_used_at.asc()
+        ).limit(excess)
+        db.session.execute(
+            delete(EmbeddingCacheEntry).where(EmbeddingCacheEntry.id.in_(oldest_ids)),
+            execution_options={'synchronize_session': False}
+        )
+        if commit:
+            db.session.commit()
+        return excess
+
+    def embed_many(self, texts: List[str]) -> Tuple[List[Optional[List[float]]], Dict[int, str]]:
+        """
+        Embed texts, serving cache hits from the database and sending each
+        distinct miss to the API once, in token-budgeted batches.
+        If a batch request fails, its texts are retried one by one so a single
+        bad input only fails itself. Returns one embedding (or None) per text
+        plus a mapping of failed text index to error message.
+        """
+        hashes = [self.content_hash(text) for text in texts]
+        cached = self.lookup(texts)
+
+        # Embed each distinct uncached text once
+        to_embed = {}
+        for content_hash, text in zip(hashes, texts):
+            if content_hash not in cached and content_hash not in to_embed:
+                to_embed[content_hash] = text[:self.genai.embedding_max_chars]
+
+        computed = {}
+        hash_errors = {}
+        items = list(to_embed.items())
+        for batch in self.genai.batch_by_token_budget([text for _, text in items]):
+            batch_items = [items[i] for i in batch]
+            try:
+                vectors = self.genai.get_embeddings_batch([text for _, text in batch_items])
+                for (content_hash, _), vec in zip(batch_items, vectors):
+                    computed[content_hash] = vec
+            except Exception as batch_error:
+                if len(batch_items) == 1:
+                    hash_errors[batch_items[0][0]] = str(batch_error)
+                    continue
+                print(f"Embedding batch of {len(batch_items)} texts failed, retrying individually: {str(batch_error)}")
+                for content_hash, text in batch_items:
+                    try:
+                        computed[content_hash] = self.genai.get_embedding(text)
+                    except Exception as e:
+                        hash_errors[content_hash] = str(e)
+
+        self.store(computed)
+
+        results = []
+        errors = {}
+        for idx, content_hash in enumerate(hashes):
+            vec = cached.get(content_hash)
+            if vec is None:
+                vec = computed.get(content_hash)
+            if vec is None:
+                errors[idx] = hash_errors.get(content_hash, 'Embedding not generated')
+            results.append(vec)
+        return results, errors
+
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Get embeddings for multiple texts, raising if any of them fails"""
+        results, errors = self.embed_many(texts)
+        if errors:
+            idx, error = next(iter(errors.items()))
+            raise Exception(f"Failed to get embedding for text {idx}: {error}")
+        return results
+
+    def get_embedding(self, text: str) -> List[float]:
+        """Get embedding for a text string"""
+        return self.get_embeddings([text])[0]
+
+    @classmethod
+    def _record(cls, hits: int, misses: int):
+        with cls._stats_lock:
+            cls._hits += hits
+            cls._misses += misses
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for this process plus the persistent entry count"""
+        with self._stats_lock:
+            hits, misses = self._hits, self._misses
+        total = hits + misses
+        return {
+            'enabled': self.enabled,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else 0.0,
+            'entries': db.session.query(func.count(EmbeddingCacheEntry.id)).scalar() or 0,
+            'max_entries': self.max_entries
+        }
@@ -0,0 +1,324 @@
+from typing import List, Dict, Any, Optional, Tuple, Iterator
+from app import db
+from app.models import Document, DocumentEmbedding, DocumentChunk, DocumentTopic, EMBEDDING_DIMENSIONS, Vector, pgvector_enabled
+from app.db_utils import dialect_insert
+from app.services.embedding_cache import EmbeddingCache
+from app.services.chunking import DocumentChunker
+from sqlalchemy import func, literal, text, Float, insert, delete
+import numpy as np
+import os
+
+# 'document' embeds each document's leading text; 'chunks' embeds every chunk
+# and uses the mean chunk vector as the document vector
+EMBEDDING_REPRESENTATIONS = ('document', 'chunks')
+
+class EmbeddingStore:
+    """Bulk reads and writes of document embeddings"""
+    
+    # Maximum number of document IDs per IN (...) clause
+    QUERY_CHUNK_SIZE = 1000
+    
+    # Documents whose full text is chunked and embedded together
+    CHUNK_BATCH_DOCUMENTS = 100
+    
+    def __init__(self, embedding_cache: Optional[EmbeddingCache] = None, representation: Optional[str] = None):
+        self.embedding_cache = embedding_cache or EmbeddingCache()
+        self.genai = self.embedding_cache.genai
+        self.representation = representation or os.getenv('EMBEDDING_REPRESENTATION', 'document')
+        if self.representation not in EMBEDDING_REPRESENTATIONS:
+            raise ValueError(f"Unknown embedding representation '{self.representation}'. Choose from: {', '.join(EMBEDDING_REPRESENTATIONS)}")
+        self.chunker = DocumentChunker()
+        # Filtered ANN queries widen the index scan so enough rows survive the filter
+        self.ef_search = int(os.getenv('EMBEDDING_INDEX_EF_SEARCH', '200'))
+        self.ivfflat_probes = int(os.getenv('EMBEDDING_INDEX_PROBES', '20'))
+    
+    @property
+    def uses_chunks(self) -> bool:
+        """Whether document vectors are built from chunk embeddings"""
+        return self.representation == 'chunks'
+    
+    def load_matrix(self, collection_id: int, backfill: bool = True) -> Tuple[List[int], np.ndarray]:
+        """
+        Load every embedding of a collection (near-duplicates excluded) with a single joined query.
+        Returns document IDs (ascending) and a contiguous float32 matrix whose
+        rows line up with them. Missing embeddings are backfilled in bulk;
+        documents that still have no embedding are left out.
+        """
+        rows = db.session.query(Document.id, DocumentEmbedding.embedding).outerjoin(
+            DocumentEmbedding, DocumentEmbedding.document_id == Document.id
+        ).filter(
+            Document.collection_id == collection_id,
+            Document.duplicate_of_id.is_(None)
+        ).order_by(Document.id).all()
+        
+        embeddings = {doc_id: embedding for doc_id, embedding in rows if embedding is not None}
+        missing = [doc_id for doc_id, embedding in rows if embedding is None]
+        if missing and backfill:
+            embeddings.update(self.backfill(missing))
+        
+        doc_ids = [doc_id for doc_id, _ in rows if doc_id in embeddings]
+        if not doc_ids:
+            return [], np.empty((0, 0), dtype=np.float32)
+        
+        matrix = np.array([embeddings[doc_id] for doc_id in doc_ids], dtype=np.float32)
+        return doc_ids, matrix
+    
+    def iter_chunks(self, collection_id: int, chunk_size: int = 2048) -> Iterator[Tuple[List[int], np.ndarray]]:
+        """
+        Stream a collection's embeddings as (document IDs, float32 matrix)
+        chunks in document ID order, using keyset pagination.
+        """
+        last_id = 0
+        while True:
+            rows = db.session.query(DocumentEmbedding.document_id, DocumentEmbedding.embedding).join(
+                Document, Document.id == DocumentEmbedding.document_id
+            ).filter(
+                Document.collection_id == collection_id,
+                Document.duplicate_of_id.is_(None),
+                DocumentEmbedding.document_id > last_id
+            ).order_by(DocumentEmbedding.document_id).limit(chunk_size).all()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            rows = [(doc_id, embedding) for doc_id, embedding in rows if embedding is not None]
+            if rows:
+                yield [doc_id for doc_id, _ in rows], np.array([embedding for _, embedding in rows], dtype=np.float32)
+    
+    def count_embedded(self, collection_id: int) -> int:
+        """Number of documents in a collection that have an embedding"""
+        return db.session.query(func.count(DocumentEmbedding.id)).join(
+            Document, Document.id == DocumentEmbedding.document_id
+        ).filter(Document.collection_id == collection_id, Document.duplicate_of_id.is_(None)).scalar() or 0
+    
+    def backfill_collection(self, collection_id: int) -> Dict[int, List[float]]:
+        """Embed every document of a collection that has no embedding yet, except near-duplicates"""
+        missing = [doc_id for (doc_id,) in db.session.query(Document.id).outerjoin(
+            DocumentEmbedding, DocumentEmbedding.document_id == Document.id
+        ).filter(
+            Document.collection_id == collection_id,
+            Document.duplicate_of_id.is_(None),
+            DocumentEmbedding.id.is_(None)
+        ).order_by(Document.id)]
+        return self.backfill(missing) if missing else {}
+    
+    def backfill(self, document_ids: List[int]) -> Dict[int, List[float]]:
+        """
+        Embed documents that have no embedding yet: one query for their
+        (truncated) text, batched embedding calls and one bulk insert.
+        With the 'chunks' representation the documents are chunked instead.
+        """
+        if self.uses_chunks:
+            embeddings, _ = self.embed_chunked(document_ids)
+            return embeddings
+        
+        texts = {}
+        for i in range(0, len(document_ids), self.QUERY_CHUNK_SIZE):
+            chunk = document_ids[i:i + self.QUERY_CHUNK_SIZE]
+            rows = db.session.query(
+                Document.id, func.substr(Document.content, 1, self.genai.embedding_max_chars)
+            ).filter(Document.id.in_(chunk)).all()
+            texts.update({doc_id: text or '' for doc_id, text in rows})
+        
+        pending = [(doc_id, text) for doc_id, text in texts.items() if text.strip()]
+        vectors, errors = self.embedding_cache.embed_many([text for _, text in pending])
+        
+        embeddings = {}
+        for idx, ((doc_id, _), vec) in enumerate(zip(pending, vectors)):
+            if vec is None:
+                print(f"Failed to generate embedding for document {doc_id}: {errors[idx]}")
+            else:
+                embeddings[doc_id] = vec
+        
+        self.save(embeddings)
+        return embeddings
+    
+    def embed_chunked(self, document_ids: List[int]) -> Tuple[Dict[int, List[float]], List[Dict[str, Any]]]:
+        """
+        Split documents into overlapping chunks, embed the chunks in batches
+        and store them (replacing earlier chunks of those documents). Each
+        document vector is the token-weighted mean of its normalized chunk
+        vectors and is saved as its embedding. Returns the document vectors
+        plus failures as {'document_id', 'error'}; a document fails if any of
+        its chunks could not be embedded.
+        """
+        embeddings = {}
+        failed = []
+        for i in range(0, len(document_ids), self.CHUNK_BATCH_DOCUMENTS):
+            batch_ids = document_ids[i:i + self.CHUNK_BATCH_DOCUMENTS]
+            rows = db.session.query(Document.id, Document.content).filter(Document.id.in_(batch_ids)).all()
+            
+            chunks = []
+            for doc_id, content in sorted(rows):
+                spans = self.chunker.split(content or '')
+                if not spans:
+                    failed.append({'document_id': doc_id, 'error': 'Document content is empty'})
+                chunks.extend({
+                    'document_id': doc_id,
+                    'chunk_index': chunk_index,
+                    'content': content[start:end],
+                    'start_char': start,
+                    'end_char': end,
+                    'token_count': self.genai.estimate_tokens(content[start:end])
+                } for chunk_index, (start, end) in enumerate(spans))
+            
+            vectors, errors = self.embedding_cache.embed_many([chunk['content'] for chunk in chunks])
+            chunk_errors = {}
+            for idx, (chunk, vec) in enumerate(zip(chunks, vectors)):
+                chunk['embedding'] = vec
+                chunk['model'] = self.genai.embedding_model
+                if vec is None:
+                    chunk_errors.setdefault(chunk['document_id'], errors[idx])
+            
+            db.session.execute(
+                delete(DocumentChunk).where(DocumentChunk.document_id.in_(batch_ids)),
+                execution_options={'synchronize_session': False}
+            )
+            if chunks:
+                db.session.execute(insert(DocumentChunk), chunks)
+            db.session.commit()
+            
+            for doc_id, error in chunk_errors.items():
+                print(f"Failed to generate embedding for document {doc_id}: {error}")
+                failed.append({'document_id': doc_id, 'error': error})
+            
+            by_document = {}
+            for chunk in chunks:
+                if chunk['document_id'] not in chunk_errors:
+                    by_document.setdefault(chunk['document_id'], []).append(chunk)
+            for doc_id, doc_chunks in by_document.items():
+                matrix = np.array([chunk['embedding'] for chunk in doc_chunks], dtype=np.float64)
+                norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                weights = np.array([chunk['token_count'] for chunk in doc_chunks], dtype=np.float64)
+                embeddings[doc_id] = (weights @ (matrix / np.where(norms == 0, 1.0, norms)) / weights.sum()).tolist()
+        
+        self.save(embeddings)
+        return embeddings, failed
+    
+    def load_chunk_vectors(self, document_ids: List[int]) -> Tuple[List[Tuple[int, int]], np.ndarray]:
+        """
+        Load chunk embeddings of specific documents. Returns
+        (document_id, chunk_id) per row and a float32 matrix.
+        """
+        keys = []
+        vectors = []
+        for i in range(0, len(document_ids), self.QUERY_CHUNK_SIZE):
+            chunk = document_ids[i:i + self.QUERY_CHUNK_SIZE]
+            rows = db.session.query(DocumentChunk.document_id, DocumentChunk.id, DocumentChunk.embedding).filter(
+                DocumentChunk.document_id.in_(chunk)
+            ).order_by(DocumentChunk.document_id, DocumentChunk.chunk_index).all()
+            rows = [row for row in rows if row[2] is not None]
+            keys.extend((doc_id, chunk_id) for doc_id, chunk_id, _ in rows)
+            vectors.extend(embedding for _, _, embedding in rows)
+        if not keys:
+            return [], np.empty((0, 0), dtype=np.float32)
+        return keys, np.array(vectors, dtype=np.float32)
+    
+    def save(self, embeddings: Dict[int, List[float]]):
+        """Bulk upsert embeddings keyed by document ID, replacing existing vectors (e.g. after re-chunking)"""
+        if not embeddings:
+            return
+        
+        stmt = dialect_insert(DocumentEmbedding)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['document_id'],
+            set_={'embedding': stmt.excluded.embedding, 'model': stmt.excluded.model}
+        )
+        db.session.execute(stmt, [
+            {'document_id': doc_id, 'embedding': vec, 'model': self.genai.embedding_model}
+            for doc_id, vec in embeddings.items()
+        ])
+        db.session.commit()
+    
+    def load_vectors(self, document_ids: List[int]) -> Tuple[List[int], np.ndarray]:
+        """Load embeddings for specific documents into a float32 matrix (no backfill)"""
+        embeddings = {}
+        for i in range(0, len(document_ids), self.QUERY_CHUNK_SIZE):
+            chunk = document_ids[i:i + self.QUERY_CHUNK_SIZE]
+            rows = db.session.query(DocumentEmbedding.document_id, DocumentEmbedding.embedding).filter(
+                DocumentEmbedding.document_id.in_(chunk)
+            ).all()
+            embeddings.update({doc_id: embedding for doc_id, embedding in rows if embedding is not None})
+        
+        doc_ids = [doc_id for doc_id in document_ids if doc_id in embeddings]
+        if not doc_ids:
+            return [], np.empty((0, 0), dtype=np.float32)
+        return doc_ids, np.array([embeddings[doc_id] for doc_id in doc_ids], dtype=np.float32)
+    
+    def uses_index(self) -> bool:
+        """Whether k-NN queries run against the pgvector ANN index"""
+        return pgvector_enabled(db.engine.dialect)
+    
+    def nearest_documents(self, query_vec: List[float], k: int = 10, collection_id: Optional[int] = None,
+                          document_ids: Optional[List[int]] = None,
+                          topic_id: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Return (document_id, cosine similarity) for the k documents nearest to
+        query_vec, restricted to a collection, a set of documents and/or the
+        members of a topic.
+        Uses the pgvector index when available and brute-force NumPy otherwise.
+        """
+        if collection_id is None and document_ids is None and topic_id is None:
+            raise ValueError("nearest_documents requires collection_id, document_ids or topic_id")
+        
+        if self.uses_index():
+            distance = DocumentEmbedding.embedding.op('<=>', return_type=Float)(
+                literal([float(x) for x in query_vec], type_=Vector(EMBEDDING_DIMENSIONS))
+            )
+            query = db.session.query(DocumentEmbedding.document_id, distance.label('distance'))
+            if collection_id is not None:
+                query = query.join(Document, Document.id == DocumentEmbedding.document_id).filter(
+                    Document.collection_id == collection_id
+                )
+            if document_ids is not None:
+                query = query.filter(DocumentEmbedding.document_id.in_(document_ids))
+            if topic_id is not None:
+                query = query.join(DocumentTopic, DocumentTopic.document_id == DocumentEmbedding.document_id).filter(
+                    DocumentTopic.topic_id == topic_id
+                )
+            query = query.order_by(distance).limit(k)
+            
+            # The index returns its ef_search (HNSW) or probed lists' (IVFFlat)
+            # candidates before the filter applies, so widen both for this transaction
+            db.session.execute(text(f'SET LOCAL hnsw.ef_search = {min(max(self.ef_search, k), 1000)}'))
+            db.session.execute(text(f'SET LOCAL ivfflat.probes = {max(self.ivfflat_probes, 1)}'))
+            rows = query.all()
+            if len(rows) < k:
+                # Too few candidates passed the filter: rank the filtered rows exactly instead
+                db.session.execute(text('SET LOCAL enable_indexscan = off'))
+                rows = query.all()
+                db.session.execute(text('SET LOCAL enable_indexscan = on'))
+            return [(doc_id, 1.0 - float(dist)) for doc_id, dist in rows]
+        
+        if topic_id is not None:
+            members = [doc_id for (doc_id,) in db.session.query(DocumentTopic.document_id).filter(
+                DocumentTopic.topic_id == topic_id
+            ).order_by(DocumentTopic.document_id)]
+            allowed = set(document_ids) if document_ids is not None else None
+            document_ids = [doc_id for doc_id in members if allowed is None or doc_id in allowed]
+        if document_ids is not None:
+            doc_ids, matrix = self.load_vectors(document_ids)
+            if collection_id is not None and doc_ids:
+                allowed = {doc_id for (doc_id,) in db.session.query(Document.id).filter(
+                    Document.collection_id == collection_id, Document.id.in_(doc_ids)
+                )}
+                keep = [i for i, doc_id in enumerate(doc_ids) if doc_id in allowed]
+                doc_ids, matrix = [doc_ids[i] for i in keep], matrix[keep]
+        else:
+            doc_ids, matrix = self.load_matrix(collection_id, backfill=False)
+        if not doc_ids:
+            return []
+        
+        indices, similarities = self.top_k_similar(np.asarray(query_vec, dtype=np.float32), matrix, k)
+        return [(doc_ids[i], float(sim)) for i, sim in zip(indices, similarities)]
+    
+    @staticmethod
+    def top_k_similar(query_vec: np.ndarray, matrix: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Indices and cosine similarities of the k rows of matrix nearest to query_vec"""
+        if matrix.shape[0] == 0:
+            return np.empty(0, dtype=int), np.empty(0, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query_vec) or 1.0)
+        similarities = (matrix @ query_vec) / np.where(norms == 0, 1.0, norms)
+        k = min(k, len(similarities))
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+        return top, similarities[top]
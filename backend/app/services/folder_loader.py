@@ -0,0 +1,211 @@
+"""
+Bulk loading of PDF folders into a collection.
+Text is extracted in a process pool; extracted files stream back through a
+bounded window of in-flight tasks into batched inserts and batched
+embedding calls (DocumentService.ingest_documents), so extraction of the
+next files overlaps with storing and embedding the previous ones.
+"""
+from typing import List, Dict, Any, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from sqlalchemy import update
+from app import db
+from app.models import Document
+from app.services.document_service import DocumentService
+import hashlib
+import time
+import io
+import os
+
+def extract_text_from_pdf(data: bytes) -> Optional[str]:
+    """Extract the text of a PDF (PyPDF2, pdfplumber or pypdf, whichever is installed)"""
+    try:
+        import PyPDF2
+        return "\n".join(page.extract_text() or '' for page in PyPDF2.PdfReader(io.BytesIO(data)).pages)
+    except ImportError:
+        pass
+    
+    try:
+        import pdfplumber
+        with pdfplumber.open(io.BytesIO(data)) as pdf:
+            return "\n".join(text for text in (page.extract_text() for page in pdf.pages) if text)
+    except ImportError:
+        pass
+    
+    try:
+        import pypdf
+        return "\n".join(page.extract_text() or '' for page in pypdf.PdfReader(io.BytesIO(data)).pages)
+    except ImportError:
+        pass
+    
+    raise RuntimeError("No PDF library found. Install PyPDF2, pdfplumber, or pypdf")
+
+def extract_file(path: str) -> Dict[str, Any]:
+    """
+    Hash and extract one file (runs in a pool process).
+    Returns path, file_hash and content, or path and error.
+    """
+    try:
+        with open(path, 'rb') as file:
+            data = file.read()
+        file_hash = hashlib.sha256(data).hexdigest()
+        content = extract_text_from_pdf(data)
+    except Exception as e:
+        return {'path': path, 'error': str(e)}
+    # PostgreSQL text cannot contain null characters
+    return {'path': path, 'file_hash': file_hash, 'content': (content or '').replace('\x00', '')}
+
+class FolderLoader:
+    """Loads every PDF under a folder (recursively) into a collection"""
+    
+    # Documents with less text than this are skipped
+    MIN_CONTENT_CHARS = 10
+    
+    def __init__(self, document_service: Optional[DocumentService] = None,
+                 workers: Optional[int] = None, batch_size: Optional[int] = None):
+        self.document_service = document_service or DocumentService()
+        # 0 workers extracts in this process
+        self.workers = int(workers if workers is not None else os.getenv('LOADER_WORKERS', str(os.cpu_count() or 1)))
+        self.batch_size = int(batch_size or os.getenv('LOADER_BATCH_SIZE', '50'))
+        # In-flight extraction tasks per worker, bounding memory held by finished results
+        self.max_pending = max(1, self.workers) * int(os.getenv('LOADER_QUEUE_PER_WORKER', '4'))
+    
+    @staticmethod
+    def find_files(folder: str) -> List[Tuple[str, float]]:
+        """(path, mtime) of the PDFs under a folder, in path order"""
+        files = []
+        for root, dirs, filenames in os.walk(folder):
+            dirs.sort()
+            for filename in sorted(filenames):
+                if filename.lower().endswith('.pdf'):
+                    path = os.path.join(root, filename)
+                    files.append((path, os.path.getmtime(path)))
+        return files
+    
+    @staticmethod
+    def title_for(path: str) -> str:
+        """Title from the file name, without its extension"""
+        return os.path.splitext(os.path.basename(path))[0].replace('_', ' ').replace('-', ' ')
+    
+    def load(self, collection_id: int, folder: str) -> Dict[str, Any]:
+        """
+        Load new and changed PDFs under folder into a collection.
+        A file is skipped when its path and mtime are already loaded, or
+        (after hashing) when a document with the same file hash exists;
+        a changed file replaces the document previously loaded from its path.
+        Returns counts and throughput.
+        """
+        started = time.monotonic()
+        stats = {'found': 0, 'loaded': 0, 'unchanged': 0, 'replaced': 0, 'duplicates': 0, 'failed': 0,
+                 'embedding_failed': 0, 'extracted_chars': 0}
+        
+        loaded = {}
+        hashes = set()
+        for doc_id, path, mtime, file_hash in db.session.query(
+            Document.id, Document.file_path, Document.file_mtime, Document.file_hash
+        ).filter(Document.collection_id == collection_id, Document.file_path.isnot(None)):
+            loaded[path] = (doc_id, mtime)
+            if file_hash:
+                hashes.add(file_hash)
+        
+        files = self.find_files(folder)
+        stats['found'] = len(files)
+        mtimes = {}
+        pending_paths = []
+        for path, mtime in files:
+            if path in loaded and loaded[path][1] == mtime:
+                stats['unchanged'] += 1
+            else:
+                mtimes[path] = mtime
+                pending_paths.append(path)
+        print(f"Found {len(files)} PDF files, {len(pending_paths)} new or changed")
+        
+        batch = []
+        touched = []
+        for result in self._extract_all(pending_paths):
+            path = result['path']
+            if 'error' in result:
+                print(f"Failed to load {path}: {result['error']}")
+                stats['failed'] += 1
+                continue
+            if result['file_hash'] in hashes:
+                # Touched but unchanged: record the new mtime so the next load skips it without hashing
+                if path in loaded:
+                    touched.append({'id': loaded[path][0], 'file_mtime': mtimes[path]})
+                stats['unchanged'] += 1
+                continue
+            if len(result['content'].strip()) < self.MIN_CONTENT_CHARS:
+                print(f"Skipping {path}: No text extracted or too short")
+                stats['failed'] += 1
+                continue
+            
+            hashes.add(result['file_hash'])
+            stats['extracted_chars'] += len(result['content'])
+            batch.append({
+                'content': result['content'],
+                'title': self.title_for(path),
+                'file_path': path,
+                'file_type': 'application/pdf',
+                'file_mtime': mtimes[path],
+                'file_hash': result['file_hash']
+            })
+            if len(batch) >= self.batch_size:
+                self._ingest(collection_id, batch, loaded, stats, started)
+                batch = []
+        if batch:
+            self._ingest(collection_id, batch, loaded, stats, started)
+        if touched:
+            db.session.execute(update(Document), touched)
+            db.session.commit()
+        
+        stats['seconds'] = round(time.monotonic() - started, 2)
+        stats['files_per_second'] = round(stats['loaded'] / stats['seconds'], 2) if stats['seconds'] else 0.0
+        return stats
+    
+    def _extract_all(self, paths: List[str]):
+        """Extraction results as they complete, with at most max_pending tasks in flight"""
+        if self.workers <= 0:
+            for path in paths:
+                yield extract_file(path)
+            return
+        
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            remaining = iter(paths)
+            pending: 'set[Future]' = set()
+            while True:
+                for path in remaining:
+                    pending.add(pool.submit(extract_file, path))
+                    if len(pending) >= self.max_pending:
+                        break
+                if not pending:
+                    return
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+    
+    def _ingest(self, collection_id: int, batch: List[Dict[str, Any]], loaded: Dict[str, Tuple[int, float]],
+                stats: Dict[str, Any], started: float):
+        """
+        Replace documents of changed files, then insert and embed the batch.
+        The deletes are left pending so they commit together with the
+        replacement documents: a failed insert keeps the old versions.
+        """
+        replaced_ids = [loaded[doc['file_path']][0] for doc in batch if doc['file_path'] in loaded]
+        if replaced_ids:
+            for document in Document.query.filter(Document.id.in_(replaced_ids)):
+                db.session.delete(document)
+        
+        try:
+            result = self.document_service.ingest_documents(collection_id, batch)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        stats['replaced'] += len(replaced_ids)
+        stats['loaded'] += len(result['document_ids'])
+        stats['duplicates'] += len(result['duplicates'])
+        stats['failed'] += len(result['failed'])
+        stats['embedding_failed'] += len(result['embedding_failed'])
+        
+        elapsed = time.monotonic() - started
+        print(f"Loaded {stats['loaded']} documents ({stats['loaded'] / elapsed:.1f} files/s, "
+              f"{stats['extracted_chars'] / elapsed / 1e6:.2f} M chars/s)...")
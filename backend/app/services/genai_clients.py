@@ -0,0 +1,154 @@
+"""
+Process-wide registry of OpenAI clients.
+Every GenAIService shares one client per (API key, base URL), so HTTP
+keep-alive connections are pooled across services, routes and jobs.
+"""
+from typing import Dict, Any, Optional, Tuple
+from openai import OpenAI
+import threading
+import httpx
+import os
+
+class _RequestStats:
+    """Thread-safe counters for in-flight HTTP requests"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.saturated_requests = 0
+        self.pool_timeouts = 0
+    
+    def started(self, max_connections: int):
+        with self.lock:
+            self.requests += 1
+            if self.in_flight >= max_connections:
+                # Every pooled connection is busy: this request waits for one
+                self.saturated_requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+    
+    def finished(self):
+        with self.lock:
+            self.in_flight -= 1
+    
+    def pool_timeout(self):
+        with self.lock:
+            self.pool_timeouts += 1
+
+class _TrackedStream(httpx.SyncByteStream):
+    """Response body that marks its request finished once the body is closed"""
+    
+    def __init__(self, stream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+        self._closed = False
+    
+    def __iter__(self):
+        yield from self._stream
+    
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if not self._closed:
+                self._closed = True
+                self._on_close()
+
+class _InstrumentedTransport(httpx.HTTPTransport):
+    """HTTP transport that counts requests holding a pooled connection"""
+    
+    def __init__(self, stats: _RequestStats, max_connections: int, **kwargs):
+        super().__init__(**kwargs)
+        self._stats = stats
+        self._max_connections = max_connections
+    
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self._stats.started(self._max_connections)
+        try:
+            response = super().handle_request(request)
+        except httpx.PoolTimeout:
+            self._stats.pool_timeout()
+            self._stats.finished()
+            raise
+        except Exception:
+            self._stats.finished()
+            raise
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_TrackedStream(response.stream, self._stats.finished),
+            extensions=response.extensions
+        )
+
+class GenAIClientRegistry:
+    """Shared, lazily created OpenAI clients with a bounded keep-alive pool"""
+    
+    _lock = threading.Lock()
+    _clients: Dict[Tuple[Optional[str], Optional[str]], OpenAI] = {}
+    _stats: Dict[Tuple[Optional[str], Optional[str]], _RequestStats] = {}
+    
+    max_connections = int(os.getenv('GENAI_HTTP_MAX_CONNECTIONS', '20'))
+    max_keepalive_connections = int(os.getenv('GENAI_HTTP_MAX_KEEPALIVE', '10'))
+    keepalive_expiry = float(os.getenv('GENAI_HTTP_KEEPALIVE_EXPIRY', '30'))
+    timeout = float(os.getenv('GENAI_HTTP_TIMEOUT', '60'))
+    connect_timeout = float(os.getenv('GENAI_HTTP_CONNECT_TIMEOUT', '10'))
+    pool_timeout = float(os.getenv('GENAI_HTTP_POOL_TIMEOUT', '30'))
+    
+    @classmethod
+    def get_client(cls, api_key: Optional[str] = None, base_url: Optional[str] = None) -> OpenAI:
+        """The shared client for an API key and base URL, created on first use"""
+        key = (api_key, base_url)
+        with cls._lock:
+            client = cls._clients.get(key)
+            if client is None:
+                cls._stats[key] = _RequestStats()
+                # Retries are left to GenAIService so they pass through the shared rate limiter
+                client_kwargs = {'http_client': cls._http_client(cls._stats[key]), 'max_retries': 0}
+                if api_key:
+                    client_kwargs['api_key'] = api_key
+                if base_url:
+                    client_kwargs['base_url'] = base_url
+                client = OpenAI(**client_kwargs)
+                cls._clients[key] = client
+            return client
+    
+    @classmethod
+    def _http_client(cls, stats: _RequestStats) -> httpx.Client:
+        limits = httpx.Limits(
+            max_connections=cls.max_connections,
+            max_keepalive_connections=cls.max_keepalive_connections,
+            keepalive_expiry=cls.keepalive_expiry
+        )
+        timeout = httpx.Timeout(cls.timeout, connect=cls.connect_timeout, pool=cls.pool_timeout)
+        transport = _InstrumentedTransport(stats, cls.max_connections, limits=limits)
+        return httpx.Client(transport=transport, timeout=timeout, limits=limits)
+    
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        """
+        In-flight requests and pool saturation for this process, summed over
+        clients. pool_saturation is the busiest client's share of its pool;
+        saturated_requests counts requests that had to wait for a connection.
+        """
+        with cls._lock:
+            all_stats = list(cls._stats.values())
+        
+        totals = {'in_flight': 0, 'peak_in_flight': 0, 'requests': 0, 'saturated_requests': 0, 'pool_timeouts': 0}
+        saturation = 0.0
+        for client_stats in all_stats:
+            with client_stats.lock:
+                totals['in_flight'] += client_stats.in_flight
+                totals['peak_in_flight'] += client_stats.peak_in_flight
+                totals['requests'] += client_stats.requests
+                totals['saturated_requests'] += client_stats.saturated_requests
+                totals['pool_timeouts'] += client_stats.pool_timeouts
+                saturation = max(saturation, client_stats.in_flight / cls.max_connections)
+        
+        totals.update({
+            'clients': len(all_stats),
+            'max_connections': cls.max_connections,
+            'pool_saturation': saturation
+        })
+        return totals
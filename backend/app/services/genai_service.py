@@ -1,8 +1,26 @@
 import os
-from typing import List, Dict, Any, Optional
-from openai import OpenAI
+from typing import List, Dict, Any, Optional, Union, Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from openai import APIConnectionError, APITimeoutError, APIStatusError
+from app.services.genai_clients import GenAIClientRegistry
+from app.services.rate_limiter import RateLimiter, parse_reset
 import numpy as np
-from functools import lru_cache
+import random
+import time
+
+# HTTP statuses worth retrying: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUSES = {408, 409, 429}
+
+class GenAIError(Exception):
+    """A GenAI call failed; retryable tells whether trying again later may succeed"""
+    
+    def __init__(self, message: str, retryable: bool = False, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.status_code = status_code
+
+class GenAIRateLimitError(GenAIError):
+    """The provider kept rejecting calls for exceeding its rate limits"""
 
 class GenAIService:
     """Abstraction layer for GenAI calls (LLM and embeddings)"""
@@ -13,58 +31,172 @@ class GenAIService:
         self.embedding_model = os.getenv('EMBEDDING_MODEL', 'text-embedding-3-small')
         self.temperature = float(os.getenv('LLM_TEMPERATURE', '0.7'))
         self.max_tokens = int(os.getenv('LLM_MAX_TOKENS', '2000'))
+        self.embedding_max_chars = int(os.getenv('EMBEDDING_MAX_CHARS', '8000'))
+        self.embedding_batch_max_tokens = int(os.getenv('EMBEDDING_BATCH_MAX_TOKENS', '250000'))
+        self.embedding_batch_max_inputs = int(os.getenv('EMBEDDING_BATCH_MAX_INPUTS', '2048'))
+        self.llm_concurrency = max(1, int(os.getenv('LLM_CONCURRENCY', '8')))
+        self.max_retries = int(os.getenv('GENAI_MAX_RETRIES', '5'))
+        self.backoff_base = float(os.getenv('GENAI_BACKOFF_BASE', '1.0'))
+        self.backoff_max = float(os.getenv('GENAI_BACKOFF_MAX', '60'))
+        self.rate_limiter = RateLimiter()
     
     @property
     def client(self):
-        """Lazy initialization of OpenAI client"""
+        """Shared OpenAI client for this process (see GenAIClientRegistry)"""
         if self._client is None:
             api_key = os.getenv('OPENAI_API_KEY')
             base_url = os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1')
-            
-            # Initialize client with only valid parameters
-            client_kwargs = {}
-            if api_key:
-                client_kwargs['api_key'] = api_key
-            if base_url:
-                client_kwargs['base_url'] = base_url
-            
-            self._client = OpenAI(**client_kwargs)
+            self._client = GenAIClientRegistry.get_client(api_key, base_url)
         return self._client
     
     def get_embedding(self, text: str) -> List[float]:
         """Get embedding for a text string"""
-        try:
-            response = self.client.embeddings.create(
+        response = self._request(
+            'embedding', self.estimate_tokens(text), "Failed to get embedding",
+            lambda: self.client.embeddings.with_raw_response.create(
                 model=self.embedding_model,
                 input=text
             )
-            return response.data[0].embedding
-        except Exception as e:
-            raise Exception(f"Failed to get embedding: {str(e)}")
+        )
+        return response.data[0].embedding
     
     def get_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
         """Get embeddings for multiple texts"""
-        try:
-            response = self.client.embeddings.create(
+        response = self._request(
+            'embedding', sum(self.estimate_tokens(text) for text in texts), "Failed to get embeddings batch",
+            lambda: self.client.embeddings.with_raw_response.create(
                 model=self.embedding_model,
                 input=texts
             )
-            return [item.embedding for item in response.data]
-        except Exception as e:
-            raise Exception(f"Failed to get embeddings batch: {str(e)}")
+        )
+        return [item.embedding for item in response.data]
+    
+    def estimate_tokens(self, text: str) -> int:
+        """Rough token estimate (~4 characters per token)"""
+        return max(1, len(text) // 4)
+    
+    def batch_by_token_budget(self, texts: List[str]) -> List[List[int]]:
+        """
+        Split texts into batches that fit a single embeddings request.
+        Returns lists of indices into texts, bounded by both the token
+        budget and the maximum number of inputs per request.
+        """
+        batches = []
+        current = []
+        current_tokens = 0
+        for idx, text in enumerate(texts):
+            tokens = self.estimate_tokens(text)
+            if current and (current_tokens + tokens > self.embedding_batch_max_tokens or
+                            len(current) >= self.embedding_batch_max_inputs):
+                batches.append(current)
+                current = []
+                current_tokens = 0
+            current.append(idx)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
     
     def chat_completion(self, messages: List[Dict[str, str]], **kwargs) -> str:
         """Make a chat completion call"""
-        try:
-            response = self.client.chat.completions.create(
+        max_tokens = kwargs.get('max_tokens', self.max_tokens)
+        # Providers count the completion budget against tokens/min up front
+        tokens = sum(self.estimate_tokens(message.get('content') or '') for message in messages) + max_tokens
+        response = self._request(
+            'llm', tokens, "Failed to get chat completion",
+            lambda: self.client.chat.completions.with_raw_response.create(
+                model=self.llm_model,
+                messages=messages,
+                temperature=kwargs.get('temperature', self.temperature),
+                max_tokens=max_tokens
+            )
+        )
+        return response.choices[0].message.content
+    
+    def chat_completion_stream(self, messages: List[Dict[str, str]], **kwargs) -> Iterator[str]:
+        """
+        Stream a chat completion, yielding text deltas as they arrive.
+        Opening the stream is rate limited and retried like chat_completion;
+        a failure after the first delta raises GenAIError.
+        """
+        max_tokens = kwargs.get('max_tokens', self.max_tokens)
+        tokens = sum(self.estimate_tokens(message.get('content') or '') for message in messages) + max_tokens
+        stream = self._request(
+            'llm', tokens, "Failed to get chat completion",
+            lambda: self.client.chat.completions.with_raw_response.create(
                 model=self.llm_model,
                 messages=messages,
                 temperature=kwargs.get('temperature', self.temperature),
-                max_tokens=kwargs.get('max_tokens', self.max_tokens)
+                max_tokens=max_tokens,
+                stream=True
             )
-            return response.choices[0].message.content
+        )
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
         except Exception as e:
-            raise Exception(f"Failed to get chat completion: {str(e)}")
+            raise GenAIError(f"Chat completion stream interrupted: {str(e)}", retryable=True) from e
+        finally:
+            # Releases the pooled connection if the client stops reading early
+            stream.close()
+    
+    def chat_completions(self, conversations: List[List[Dict[str, str]]], **kwargs) -> List[Union[str, Exception]]:
+        """
+        Make several chat completion calls concurrently, at most
+        llm_concurrency at a time. Returns one result per conversation, in
+        order: the response text, or the exception if that call failed.
+        """
+        def complete(messages):
+            try:
+                return self.chat_completion(messages, **kwargs)
+            except Exception as e:
+                return e
+        
+        if self.llm_concurrency == 1 or len(conversations) <= 1:
+            return [complete(messages) for messages in conversations]
+        with ThreadPoolExecutor(max_workers=min(self.llm_concurrency, len(conversations))) as pool:
+            return list(pool.map(complete, conversations))
+    
+    def _request(self, kind: str, tokens: int, error_message: str, call: Callable[[], Any]) -> Any:
+        """
+        Make one raw-response API call under the shared rate limiter.
+        Rate-limit headers adapt the limiter; retryable failures (429, 5xx,
+        timeouts, connection errors) are retried with jittered exponential
+        backoff, others raise GenAIError immediately.
+        """
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire(kind, tokens)
+            try:
+                raw = call()
+                self.rate_limiter.observe(kind, raw.headers)
+                return raw.parse()
+            except Exception as e:
+                status_code = getattr(e, 'status_code', None)
+                headers = e.response.headers if isinstance(e, APIStatusError) else None
+                retryable = isinstance(e, (APIConnectionError, APITimeoutError)) or \
+                    status_code in RETRYABLE_STATUSES or (status_code is not None and status_code >= 500)
+                if status_code == 429:
+                    self.rate_limiter.observe(kind, headers, throttled=True)
+                
+                if not retryable or attempt >= self.max_retries:
+                    error_class = GenAIRateLimitError if status_code == 429 else GenAIError
+                    raise error_class(f"{error_message}: {str(e)}", retryable=retryable,
+                                      status_code=status_code) from e
+                
+                time.sleep(self._backoff(attempt, headers))
+                attempt += 1
+    
+    def _backoff(self, attempt: int, headers=None) -> float:
+        """Jittered exponential backoff, never shorter than the provider's retry-after"""
+        delay = random.uniform(0.5, 1.0) * min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        if headers:
+            retry_after = parse_reset(headers.get('retry-after-ms'))
+            retry_after = retry_after / 1000 if retry_after is not None else parse_reset(headers.get('retry-after'))
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
     
     def cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
         """Calculate cosine similarity between two vectors"""
@@ -0,0 +1,227 @@
+"""
+Precomputed topic graph snapshots, shared by every API process through Redis.
+A collection's graph only changes when a discovery job completes, so the
+top-level node/edge JSON is built once per completed job, gzipped, and
+stored under the collection and job version together with its ETag.
+Sub-topic levels are stored the same way, one level at a time, under the
+job version, the parent topic and the time that level was expanded.
+"""
+from typing import Dict, Any, Optional, Tuple
+from collections import OrderedDict
+from app import db
+from app.models import Collection, Topic, TopicRelationship, DiscoveryJob, JobStatus
+from app.queue import get_redis, redis_failed
+from app.services.topic_hierarchy import TopicHierarchyService
+import threading
+import hashlib
+import gzip
+import json
+import time
+import os
+
+class GraphSnapshot:
+    """A serialized graph: its job version, ETag and gzipped JSON body"""
+    
+    def __init__(self, version: Optional[str], etag: str, body_gz: bytes):
+        self.version = version
+        self.etag = etag
+        self.body_gz = body_gz
+    
+    @classmethod
+    def from_graph(cls, version: Optional[str], graph: Dict[str, Any]) -> 'GraphSnapshot':
+        body = json.dumps(graph, separators=(',', ':')).encode('utf-8')
+        # mtime=0 keeps the compressed bytes identical for identical graphs
+        return cls(version, hashlib.sha256(body).hexdigest()[:32], gzip.compress(body, mtime=0))
+    
+    @property
+    def body(self) -> bytes:
+        return gzip.decompress(self.body_gz)
+    
+    @property
+    def graph(self) -> Dict[str, Any]:
+        return json.loads(self.body)
+
+class GraphSnapshotStore:
+    """Materializes and serves topic graph snapshots by collection and job version"""
+    
+    # Fallback store for when Redis is unreachable, process-wide
+    _lock = threading.Lock()
+    _local: 'OrderedDict[str, Tuple[float, GraphSnapshot]]' = OrderedDict()
+    
+    def __init__(self):
+        self.enabled = os.getenv('GRAPH_SNAPSHOT_ENABLED', 'true').lower() in ('true', '1', 'yes')
+        self.ttl = int(os.getenv('GRAPH_SNAPSHOT_TTL', '604800'))
+        self.local_max_entries = int(os.getenv('GRAPH_SNAPSHOT_LOCAL_MAX_ENTRIES', '100'))
+        self.key_prefix = os.getenv('GRAPH_SNAPSHOT_PREFIX', 'graph')
+        self.hierarchy = TopicHierarchyService()
+    
+    def build_graph(self, collection_id: int, parent_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Node/edge JSON of one level of a collection's topic graph, read from
+        the database: the top-level topics, or the sub-topics of parent_id
+        """
+        topics = db.session.query(
+            Topic.id, Topic.name, Topic.size_score, Topic.document_count, Topic.avg_confidence, Topic.color,
+            Topic.level
+        ).filter(Topic.collection_id == collection_id, Topic.parent_id == parent_id).order_by(Topic.id).all()
+        relationships = db.session.query(
+            TopicRelationship.source_topic_id, TopicRelationship.target_topic_id,
+            TopicRelationship.similarity_score, TopicRelationship.relationship_type
+        ).join(
+            Topic, TopicRelationship.source_topic_id == Topic.id
+        ).filter(
+            Topic.collection_id == collection_id, Topic.parent_id == parent_id
+        ).order_by(TopicRelationship.id).all()
+        
+        nodes = []
+        for topic in topics:
+            nodes.append({
+                'id': f't{topic.id}',
+                'label': topic.name,
+                'size_score': topic.size_score,
+                'document_count': topic.document_count,
+                'avg_confidence': topic.avg_confidence,
+                'color': topic.color or '#3498db',
+                'level': topic.level or 0,
+                'expandable': self.hierarchy.can_expand(topic.level, topic.document_count)
+            })
+        
+        edges = []
+        for rel in relationships:
+            edges.append({
+                'source': f't{rel.source_topic_id}',
+                'target': f't{rel.target_topic_id}',
+                'weight': rel.similarity_score,
+                'type': rel.relationship_type
+            })
+        
+        return {'nodes': nodes, 'edges': edges}
+    
+    def build_subgraph(self, topic: Topic) -> Dict[str, Any]:
+        """
+        Sub-topic level of the graph below a topic, read from the database.
+        A topic that is not expanded yet has no sub-topics; see
+        TopicHierarchyService.enqueue_expand.
+        """
+        graph = self.build_graph(topic.collection_id, parent_id=topic.id)
+        graph['parent'] = self._parent(topic)
+        return graph
+    
+    def pending_subgraph(self, topic: Topic) -> Dict[str, Any]:
+        """Placeholder level for a topic whose expansion job has not finished"""
+        return {'nodes': [], 'edges': [], 'parent': self._parent(topic), 'status': 'pending'}
+    
+    @staticmethod
+    def _parent(topic: Topic) -> Dict[str, Any]:
+        return {
+            'id': f't{topic.id}',
+            'label': topic.name,
+            'level': topic.level or 0,
+            'parent': f't{topic.parent_id}' if topic.parent_id else None
+        }
+    
+    @staticmethod
+    def current_version(collection_id: int) -> Optional[str]:
+        """The collection's graph version: its latest succeeded discovery job, or None before the first"""
+        job = db.session.query(DiscoveryJob.id, DiscoveryJob.completed_at).filter(
+            DiscoveryJob.collection_id == collection_id,
+            DiscoveryJob.status == JobStatus.SUCCEEDED
+        ).order_by(DiscoveryJob.completed_at.desc(), DiscoveryJob.id.desc()).first()
+        if job is None:
+            return None
+        completed_at = job.completed_at.strftime('%Y%m%d%H%M%S%f') if job.completed_at else '0'
+        return f'{job.id}-{completed_at}'
+    
+    def get(self, collection_id: int) -> Optional[GraphSnapshot]:
+        """
+        The snapshot for the collection's current version, materialized on a
+        miss. Before the first completed job the graph is built without being
+        stored. Returns None if the collection does not exist.
+        """
+        version = self.current_version(collection_id)
+        if version is None:
+            if Collection.query.get(collection_id) is None:
+                return None
+            return GraphSnapshot.from_graph(None, self.build_graph(collection_id))
+        
+        if self.enabled:
+            snapshot = self._get(self._key(collection_id, version), version)
+            if snapshot is not None:
+                return snapshot
+        return self.materialize(collection_id, version)
+    
+    def get_level(self, topic: Topic) -> GraphSnapshot:
+        """
+        The snapshot of the sub-topic level below a topic, materialized on a
+        miss. Expanding the topic again (after it was re-clustered) or a new
+        discovery job changes the key, so stale levels are never served.
+        """
+        version = self.current_version(topic.collection_id)
+        expanded = topic.expanded_at.strftime('%Y%m%d%H%M%S%f') if topic.expanded_at else '0'
+        key = self._key(topic.collection_id, version or '0', f'{topic.id}-{expanded}')
+        if self.enabled:
+            snapshot = self._get(key, version)
+            if snapshot is not None:
+                return snapshot
+        snapshot = GraphSnapshot.from_graph(version, self.build_subgraph(topic))
+        if self.enabled:
+            self._set(key, snapshot)
+        return snapshot
+    
+    def materialize(self, collection_id: int, version: Optional[str] = None) -> GraphSnapshot:
+        """Build and store the snapshot of a collection's graph for its current (or the given) version"""
+        version = version or self.current_version(collection_id)
+        snapshot = GraphSnapshot.from_graph(version, self.build_graph(collection_id))
+        if self.enabled and version is not None:
+            self._set(self._key(collection_id, version), snapshot)
+        return snapshot
+    
+    def _key(self, collection_id: int, version: str, level: Optional[str] = None) -> str:
+        key = f'{self.key_prefix}:{collection_id}:{version}'
+        return f'{key}:{level}' if level else key
+    
+    def _get(self, key: str, version: Optional[str] = None) -> Optional[GraphSnapshot]:
+        redis_conn = get_redis()
+        if redis_conn is not None:
+            try:
+                etag, body_gz = redis_conn.hmget(key, 'etag', 'body')
+                if etag is None or body_gz is None:
+                    return None
+                return GraphSnapshot(version, etag.decode(), body_gz)
+            except Exception as e:
+                print(f"Graph snapshots falling back to local entries: {str(e)}")
+                redis_failed()
+        return self._local_get(key)
+    
+    def _set(self, key: str, snapshot: GraphSnapshot):
+        redis_conn = get_redis()
+        if redis_conn is not None:
+            try:
+                pipe = redis_conn.pipeline()
+                pipe.hset(key, mapping={'etag': snapshot.etag, 'body': snapshot.body_gz})
+                pipe.expire(key, self.ttl)
+                pipe.execute()
+                return
+            except Exception as e:
+                print(f"Graph snapshots falling back to local entries: {str(e)}")
+                redis_failed()
+        self._local_set(key, snapshot)
+    
+    def _local_get(self, key: str) -> Optional[GraphSnapshot]:
+        with self._lock:
+            item = self._local.get(key)
+            if item is None:
+                return None
+            expires_at, snapshot = item
+            if expires_at < time.monotonic():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return snapshot
+    
+    def _local_set(self, key: str, snapshot: GraphSnapshot):
+        with self._lock:
+            self._local[key] = (time.monotonic() + self.ttl, snapshot)
+            self._local.move_to_end(key)
+            while len(self._local) > self.local_max_entries:
+                self._local.popitem(last=False)
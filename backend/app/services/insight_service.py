@@ -2,6 +2,7 @@ from typing import List, Dict, Any
 from app import db
 from app.models import Topic, TopicInsight, DocumentTopic, Document
 from app.services.genai_service import GenAIService
+from app.services.qa_cache import QACache
 import json
 
 class InsightService:
@@ -13,9 +14,16 @@ class InsightService:
     def generate_insights(self, topic_id: int) -> TopicInsight:
         """Generate insights for a topic"""
         topic = Topic.query.get_or_404(topic_id)
-        
+        try:
+            response = self.genai.chat_completion(self._insight_messages(topic))
+        except Exception as e:
+            response = e
+        return self._save_insights(topic, response)
+    
+    def _insight_messages(self, topic: Topic) -> List[Dict[str, str]]:
+        """Chat messages asking for insights on a topic's most relevant documents"""
         # Get documents for this topic
-        assignments = DocumentTopic.query.filter_by(topic_id=topic_id).order_by(
+        assignments = DocumentTopic.query.filter_by(topic_id=topic.id).order_by(
             DocumentTopic.relevance_score.desc()
         ).limit(10).all()
         
@@ -40,11 +48,17 @@ Provide a JSON response with the following structure:
 
 Return only valid JSON, no other text:"""
         
+        return [
+            {'role': 'system', 'content': 'You are a helpful assistant that analyzes documents and provides structured insights in JSON format.'},
+            {'role': 'user', 'content': prompt}
+        ]
+    
+    def _save_insights(self, topic: Topic, response) -> TopicInsight:
+        """Store an insights response for a topic, or a fallback insight if the call or parsing failed"""
+        topic_id = topic.id
         try:
-            response = self.genai.chat_completion([
-                {'role': 'system', 'content': 'You are a helpful assistant that analyzes documents and provides structured insights in JSON format.'},
-                {'role': 'user', 'content': prompt}
-            ])
+            if isinstance(response, Exception):
+                raise response
             
             # Parse JSON response
             insights_data = json.loads(response)
@@ -59,6 +73,7 @@ Return only valid JSON, no other text:"""
             insight.themes = insights_data.get('themes', [])[:5]
             insight.common_questions = insights_data.get('common_questions', [])[:5]
             insight.related_concepts = insights_data.get('related_concepts', [])[:5]
+            QACache.invalidate([topic_id])
             
             db.session.commit()
             return insight
@@ -75,19 +90,35 @@ Return only valid JSON, no other text:"""
                     related_concepts=[]
                 )
                 db.session.add(insight)
+                QACache.invalidate([topic_id])
                 db.session.commit()
             return insight
     
     def generate_insights_batch(self, topic_ids: List[int]) -> List[TopicInsight]:
-        """Generate insights for multiple topics"""
-        insights = []
+        """
+        Generate insights for multiple topics.
+        Prompts are built and results saved on this session; only the LLM
+        calls run concurrently (see GenAIService.chat_completions).
+        """
+        prepared = []
         for topic_id in topic_ids:
             try:
-                insight = self.generate_insights(topic_id)
-                insights.append(insight)
+                topic = Topic.query.get_or_404(topic_id)
+                prepared.append((topic, self._insight_messages(topic)))
+            except Exception as e:
+                # Continue with other topics even if one fails
+                print(f"Failed to generate insights for topic {topic_id}: {str(e)}")
+        
+        responses = self.genai.chat_completions([messages for _, messages in prepared])
+        
+        insights = []
+        for (topic, _), response in zip(prepared, responses):
+            topic_id = topic.id
+            try:
+                insights.append(self._save_insights(topic, response))
             except Exception as e:
                 # Continue with other topics even if one fails
+                db.session.rollback()
                 print(f"Failed to generate insights for topic {topic_id}: {str(e)}")
-                continue
         return insights
 
@@ -0,0 +1,143 @@
+"""
+Near-duplicate detection for documents within a collection.
+Each document's word shingles are summarized by a MinHash signature, whose
+bands are hashed into LSH buckets stored in the database. A new document is
+only compared with documents sharing one of its buckets (an indexed lookup),
+and is a near-duplicate when the estimated Jaccard similarity of their
+shingle sets reaches the threshold.
+"""
+from typing import List, Dict, Optional, Tuple
+from sqlalchemy import insert, update
+from app import db
+from app.models import Document, DocumentLSHBucket
+import numpy as np
+import hashlib
+import zlib
+import re
+import os
+
+# Modulus of the MinHash permutations (a Mersenne prime above every shingle hash)
+PRIME = (1 << 61) - 1
+
+class NearDuplicateDetector:
+    """Flags near-duplicate documents with MinHash/LSH"""
+    
+    # Maximum number of buckets per IN (...) clause
+    QUERY_CHUNK_SIZE = 1000
+    
+    def __init__(self):
+        self.enabled = os.getenv('DEDUP_ENABLED', 'true').lower() in ('true', '1', 'yes')
+        self.threshold = float(os.getenv('DEDUP_THRESHOLD', '0.8'))
+        self.num_perm = int(os.getenv('DEDUP_NUM_PERM', '128'))
+        self.bands = int(os.getenv('DEDUP_LSH_BANDS', '32'))
+        self.shingle_size = int(os.getenv('DEDUP_SHINGLE_WORDS', '5'))
+        self.max_chars = int(os.getenv('DEDUP_MAX_CHARS', '100000'))
+        
+        if self.num_perm % self.bands:
+            raise ValueError("DEDUP_NUM_PERM must be a multiple of DEDUP_LSH_BANDS")
+        self.rows = self.num_perm // self.bands
+        # Fixed seed: signatures stored by one process are compared in others
+        rng = np.random.RandomState(1)
+        self._a = rng.randint(1, 1 << 31, size=self.num_perm).astype(np.uint64)
+        self._b = rng.randint(0, 1 << 31, size=self.num_perm).astype(np.uint64)
+    
+    def shingles(self, text: str) -> np.ndarray:
+        """32-bit hashes of the text's overlapping word n-grams (case and punctuation ignored)"""
+        words = re.findall(r'\w+', text[:self.max_chars].lower())
+        if not words:
+            return np.zeros(0, dtype=np.uint64)
+        n = min(self.shingle_size, len(words))
+        hashes = {zlib.crc32(' '.join(words[i:i + n]).encode('utf-8')) for i in range(len(words) - n + 1)}
+        return np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+    
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """MinHash signature (num_perm uint32 values), or None for text without words"""
+        shingles = self.shingles(text)
+        if not len(shingles):
+            return None
+        signature = np.full(self.num_perm, PRIME, dtype=np.uint64)
+        # a * x stays below 2**63 for 31-bit a and 32-bit x
+        for start in range(0, len(shingles), 4096):
+            block = shingles[start:start + 4096]
+            hashed = (self._a[:, None] * block[None, :] + self._b[:, None]) % PRIME
+            np.minimum(signature, hashed.min(axis=1), out=signature)
+        return (signature & 0xFFFFFFFF).astype(np.uint32)
+    
+    def buckets(self, signature: np.ndarray) -> List[int]:
+        """Signed 64-bit hash of each band (band index included, so buckets never collide across bands)"""
+        buckets = []
+        for band in range(self.bands):
+            rows = signature[band * self.rows:(band + 1) * self.rows]
+            digest = hashlib.blake2b(band.to_bytes(2, 'big') + rows.tobytes(), digest_size=8).digest()
+            buckets.append(int.from_bytes(digest, 'big', signed=True))
+        return buckets
+    
+    @staticmethod
+    def similarity(a: np.ndarray, b: np.ndarray) -> float:
+        """Estimated Jaccard similarity of two signatures"""
+        return float(np.mean(a == b)) if a.shape == b.shape else 0.0
+    
+    def detect(self, collection_id: int, documents: List[Tuple[int, str]]) -> Dict[int, int]:
+        """
+        Check new (document_id, content) pairs, in order, against the
+        collection and each other. Stores each document's signature, flags
+        near-duplicates with duplicate_of_id (the original they duplicate)
+        and indexes the others' buckets. Runs in the caller's transaction.
+        Returns {duplicate document_id: original document_id}.
+        """
+        if not self.enabled or not documents:
+            return {}
+        
+        signatures = {}
+        doc_buckets = {}
+        for doc_id, content in documents:
+            signature = self.signature(content or '')
+            if signature is not None:
+                signatures[doc_id] = signature
+                doc_buckets[doc_id] = self.buckets(signature)
+        
+        # Originals already in the collection that share a bucket with a new document
+        all_buckets = list({bucket for buckets in doc_buckets.values() for bucket in buckets})
+        bucket_docs: Dict[int, List[int]] = {}
+        for start in range(0, len(all_buckets), self.QUERY_CHUNK_SIZE):
+            for bucket, doc_id in db.session.query(DocumentLSHBucket.bucket, DocumentLSHBucket.document_id).filter(
+                DocumentLSHBucket.collection_id == collection_id,
+                DocumentLSHBucket.bucket.in_(all_buckets[start:start + self.QUERY_CHUNK_SIZE])
+            ):
+                bucket_docs.setdefault(bucket, []).append(doc_id)
+        candidate_ids = {doc_id for doc_ids in bucket_docs.values() for doc_id in doc_ids}
+        candidates = {doc_id: np.frombuffer(minhash, dtype=np.uint32) for doc_id, minhash in db.session.query(
+            Document.id, Document.minhash
+        ).filter(Document.id.in_(candidate_ids), Document.minhash.isnot(None))} if candidate_ids else {}
+        
+        duplicates = {}
+        new_buckets = []
+        for doc_id, _ in documents:
+            if doc_id not in signatures:
+                continue
+            signature = signatures[doc_id]
+            original, best = None, self.threshold
+            for candidate_id in dict.fromkeys(c for bucket in doc_buckets[doc_id] for c in bucket_docs.get(bucket, [])):
+                if candidate_id == doc_id or candidate_id not in candidates:
+                    continue
+                similarity = self.similarity(signature, candidates[candidate_id])
+                if similarity >= best:
+                    original, best = candidate_id, similarity
+            if original is not None:
+                duplicates[doc_id] = original
+                continue
+            
+            # An original: later documents in the batch are compared with it too
+            candidates[doc_id] = signature
+            for bucket in doc_buckets[doc_id]:
+                bucket_docs.setdefault(bucket, []).append(doc_id)
+                new_buckets.append({'collection_id': collection_id, 'document_id': doc_id, 'bucket': bucket})
+        
+        if signatures:
+            db.session.execute(update(Document), [
+                {'id': doc_id, 'minhash': signature.tobytes(), 'duplicate_of_id': duplicates.get(doc_id)}
+                for doc_id, signature in signatures.items()
+            ])
+        if new_buckets:
+            db.session.execute(insert(DocumentLSHBucket), new_buckets)
+        return duplicates
@@ -0,0 +1,211 @@
+"""
+Answer cache for topic Q&A, shared by every API process through Redis.
+Entries are keyed by (topic, topic version, normalized question); a question
+whose embedding is close enough to a cached question of the same topic
+version is a near-hit. Changing a topic's assignments, name or insights
+bumps its version, so stale answers are never served and simply expire.
+"""
+from typing import Dict, Any, Optional, Callable, List, Tuple
+from collections import OrderedDict
+from sqlalchemy import update
+from app import db
+from app.models import Topic
+from app.queue import get_redis, redis_failed
+import numpy as np
+import threading
+import hashlib
+import json
+import time
+import re
+import os
+
+class QACache:
+    """Exact and semantic answer cache for topic Q&A"""
+    
+    # Hit/miss counters and the fallback store are process-wide
+    _lock = threading.Lock()
+    _exact_hits = 0
+    _semantic_hits = 0
+    _misses = 0
+    _local: 'OrderedDict[str, Tuple[float, Any]]' = OrderedDict()
+    
+    def __init__(self):
+        self.enabled = os.getenv('QA_CACHE_ENABLED', 'true').lower() in ('true', '1', 'yes')
+        self.ttl = int(os.getenv('QA_CACHE_TTL', '86400'))
+        self.similarity_threshold = float(os.getenv('QA_CACHE_SIMILARITY_THRESHOLD', '0.95'))
+        self.max_questions = int(os.getenv('QA_CACHE_MAX_QUESTIONS', '200'))
+        self.local_max_entries = int(os.getenv('QA_CACHE_LOCAL_MAX_ENTRIES', '1000'))
+        self.key_prefix = os.getenv('QA_CACHE_PREFIX', 'qa')
+    
+    @staticmethod
+    def normalize(question: str) -> str:
+        """Case, whitespace and trailing punctuation do not change a question"""
+        return re.sub(r'\s+', ' ', question).strip().lower().rstrip('?!. ')
+    
+    def lookup(self, topic: Topic, question: str,
+               embed: Callable[[], Optional[List[float]]]) -> Optional[Tuple[Dict[str, Any], str]]:
+        """
+        Return (cached answer, 'exact' or 'semantic') for a question, or None.
+        embed is only called when the topic has cached questions to compare with.
+        """
+        if not self.enabled:
+            return None
+        
+        prefix = self._topic_prefix(topic)
+        entry = self._get(f'{prefix}:{self._question_hash(question)}')
+        if entry is not None:
+            self._record('exact')
+            return entry, 'exact'
+        
+        index = self._get_index(prefix)
+        if index:
+            embedding = embed()
+            query = np.asarray(embedding, dtype=np.float32) if embedding is not None else None
+            # Questions embedded with another model cannot be compared
+            question_hashes = [question_hash for question_hash, vec in index.items()
+                               if query is not None and vec.shape == query.shape]
+            if question_hashes:
+                matrix = np.stack([index[question_hash] for question_hash in question_hashes])
+                norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+                similarities = matrix @ query / np.where(norms == 0, 1.0, norms)
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    entry = self._get(f'{prefix}:{question_hashes[best]}')
+                    if entry is not None:
+                        self._record('semantic')
+                        return entry, 'semantic'
+        
+        self._record('miss')
+        return None
+    
+    def store(self, topic: Topic, question: str, answer: Dict[str, Any],
+              embed: Callable[[], Optional[List[float]]]):
+        """Cache an answer, and the question's embedding for near-hits"""
+        if not self.enabled:
+            return
+        
+        prefix = self._topic_prefix(topic)
+        question_hash = self._question_hash(question)
+        self._set(f'{prefix}:{question_hash}', answer)
+        embedding = embed()
+        if embedding is not None:
+            self._add_to_index(prefix, question_hash, np.asarray(embedding, dtype=np.float32))
+    
+    @staticmethod
+    def invalidate(topic_ids: List[int]):
+        """
+        Bump the version of topics whose answers may have changed.
+        Runs in the caller's transaction; cached answers for older versions
+        are no longer looked up and expire on their own.
+        """
+        topic_ids = list(topic_ids)
+        if not topic_ids:
+            return
+        db.session.execute(
+            update(Topic).where(Topic.id.in_(topic_ids)).values(version=Topic.version + 1),
+            execution_options={'synchronize_session': False}
+        )
+    
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for this process"""
+        with self._lock:
+            exact, semantic, misses = self._exact_hits, self._semantic_hits, self._misses
+        total = exact + semantic + misses
+        return {
+            'enabled': self.enabled,
+            'exact_hits': exact,
+            'semantic_hits': semantic,
+            'misses': misses,
+            'hit_rate': (exact + semantic) / total if total else 0.0,
+            'backend': 'redis' if get_redis() is not None else 'local'
+        }
+    
+    def _topic_prefix(self, topic: Topic) -> str:
+        return f'{self.key_prefix}:{topic.id}:{topic.version or 1}'
+    
+    def _question_hash(self, question: str) -> str:
+        return hashlib.sha256(self.normalize(question).encode('utf-8')).hexdigest()
+    
+    @classmethod
+    def _record(cls, outcome: str):
+        with cls._lock:
+            if outcome == 'exact':
+                cls._exact_hits += 1
+            elif outcome == 'semantic':
+                cls._semantic_hits += 1
+            else:
+                cls._misses += 1
+    
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        redis_conn = get_redis()
+        if redis_conn is not None:
+            try:
+                value = redis_conn.get(key)
+                return json.loads(value) if value is not None else None
+            except Exception as e:
+                print(f"Q&A cache falling back to local entries: {str(e)}")
+                redis_failed()
+        return self._local_get(key)
+    
+    def _set(self, key: str, value: Dict[str, Any]):
+        redis_conn = get_redis()
+        if redis_conn is not None:
+            try:
+                redis_conn.set(key, json.dumps(value), ex=self.ttl)
+                return
+            except Exception as e:
+                print(f"Q&A cache falling back to local entries: {str(e)}")
+                redis_failed()
+        self._local_set(key, value)
+    
+    def _get_index(self, prefix: str) -> Dict[str, np.ndarray]:
+        """Embeddings of the cached questions of a topic version, by question hash"""
+        redis_conn = get_redis()
+        if redis_conn is not None:
+            try:
+                index = redis_conn.hgetall(f'{prefix}:index')
+                return {question_hash.decode(): np.frombuffer(vec, dtype=np.float32)
+                        for question_hash, vec in index.items()}
+            except Exception as e:
+                print(f"Q&A cache falling back to local entries: {str(e)}")
+                redis_failed()
+        return dict(self._local_get(f'{prefix}:index') or {})
+    
+    def _add_to_index(self, prefix: str, question_hash: str, embedding: np.ndarray):
+        """Add a question embedding, unless the topic version already has max_questions"""
+        key = f'{prefix}:index'
+        redis_conn = get_redis()
+        if redis_conn is not None:
+            try:
+                if redis_conn.hlen(key) < self.max_questions:
+                    pipe = redis_conn.pipeline()
+                    pipe.hset(key, question_hash, embedding.tobytes())
+                    pipe.expire(key, self.ttl)
+                    pipe.execute()
+                return
+            except Exception as e:
+                print(f"Q&A cache falling back to local entries: {str(e)}")
+                redis_failed()
+        index = dict(self._local_get(key) or {})
+        if len(index) < self.max_questions:
+            index[question_hash] = embedding
+            self._local_set(key, index)
+    
+    def _local_get(self, key: str) -> Any:
+        with self._lock:
+            item = self._local.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return value
+    
+    def _local_set(self, key: str, value: Any):
+        with self._lock:
+            self._local[key] = (time.monotonic() + self.ttl, value)
+            self._local.move_to_end(key)
+            while len(self._local) > self.local_max_entries:
+                self._local.popitem(last=False)
@@ -0,0 +1,213 @@
+from typing import List, Dict, Any, Optional, Callable, Tuple, Iterator
+from app import db
+from app.models import Topic, DocumentTopic, Document, DocumentChunk
+from app.services.genai_service import GenAIService
+from app.services.qa_cache import QACache
+from app.services.topic_index import TopicVectorIndex
+import re
+import os
+
+class QAService:
+    """Topic-scoped question answering with citations, served through the answer cache"""
+    
+    def __init__(self):
+        self.genai = GenAIService()
+        self.cache = QACache()
+        self.index = TopicVectorIndex()
+        self.retrieval_k = int(os.getenv('QA_RETRIEVAL_K', '10'))
+        self.context_max_tokens = int(os.getenv('QA_CONTEXT_MAX_TOKENS', '3000'))
+        self.passage_max_tokens = int(os.getenv('QA_PASSAGE_MAX_TOKENS', '750'))
+    
+    def answer(self, topic: Topic, question: str) -> Dict[str, Any]:
+        """
+        Answer a question about a topic from the passages most similar to it.
+        Returns answer, citations, topic_id, topic_name and cached
+        ('exact', 'semantic' or None when the LLM was called).
+        """
+        embed = self._question_embedder(question)
+        cached = self.cache.lookup(topic, question, embed)
+        if cached is not None:
+            result, kind = cached
+            return dict(result, cached=kind)
+        
+        passages = self._context_passages(topic, embed)
+        answer = self.genai.chat_completion(self._qa_messages(topic, question, passages))
+        result = self._result(topic, answer, passages)
+        self.cache.store(topic, question, result, embed)
+        return dict(result, cached=None)
+    
+    def answer_stream(self, topic: Topic, question: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Answer a question as a stream of (event, data) pairs:
+        'token' ({'text'}) for each piece of the answer, 'citation' (a
+        citation) as soon as a new [DocN] marker is complete, then 'done'
+        (the same result as answer()) or 'error' ({'error'}).
+        A cached answer is sent as a single token.
+        """
+        try:
+            embed = self._question_embedder(question)
+            cached = self.cache.lookup(topic, question, embed)
+            if cached is not None:
+                result, kind = cached
+                yield 'token', {'text': result['answer']}
+                for citation in result['citations']:
+                    yield 'citation', citation
+                yield 'done', dict(result, cached=kind)
+                return
+            
+            passages = self._context_passages(topic, embed)
+            answer = ''
+            cited = set()
+            for text in self.genai.chat_completion_stream(self._qa_messages(topic, question, passages)):
+                # A marker can be split across deltas, so the tail of the answer so far is rescanned
+                scan_from = max(0, len(answer) - 10)
+                answer += text
+                yield 'token', {'text': text}
+                for match in re.finditer(r'\[Doc(\d+)\]', answer[scan_from:]):
+                    citation = self._citation(passages, int(match.group(1)))
+                    if citation is not None and citation['doc'] not in cited:
+                        cited.add(citation['doc'])
+                        yield 'citation', citation
+            
+            result = self._result(topic, answer, passages)
+            self.cache.store(topic, question, result, embed)
+            yield 'done', dict(result, cached=None)
+        except Exception as e:
+            yield 'error', {'error': f'Failed to generate answer: {str(e)}'}
+    
+    def _question_embedder(self, question: str) -> Callable[[], Optional[List[float]]]:
+        """Embeds the question at most once, for near-hit lookups and retrieval"""
+        embedding = {}
+        
+        def embed() -> Optional[List[float]]:
+            if 'vector' not in embedding:
+                try:
+                    embedding['vector'] = self.genai.get_embedding(question)
+                except Exception as e:
+                    print(f"Failed to embed question for Q&A cache: {str(e)}")
+                    embedding['vector'] = None
+            return embedding['vector']
+        return embed
+    
+    def _result(self, topic: Topic, answer: str, passages: List[Tuple[Any, str]]) -> Dict[str, Any]:
+        return {
+            'answer': answer,
+            'citations': self._citations(answer, passages),
+            'topic_id': topic.id,
+            'topic_name': topic.name
+        }
+    
+    def _context_passages(self, topic: Topic, embed: Callable[[], Optional[List[float]]]) -> List[Tuple[Any, str]]:
+        """
+        (document, passage) pairs for the prompt: the topic's chunks (or
+        documents, if it has no chunks) nearest to the question in its vector
+        index, packed best first into the context token budget. Falls back to
+        the most relevant documents when the question cannot be embedded.
+        """
+        query_vec = embed()
+        hits = self.index.search(topic, query_vec, self.retrieval_k) if query_vec is not None else []
+        if hits and hits[0][1] is not None:
+            return self._chunk_passages([chunk_id for _, chunk_id, _ in hits])
+        
+        if hits:
+            ranked_ids = [doc_id for doc_id, _, _ in hits]
+            documents = {document.id: document for document in Document.query.filter(Document.id.in_(ranked_ids))}
+            documents = [documents[doc_id] for doc_id in ranked_ids if doc_id in documents]
+        else:
+            assignments = DocumentTopic.query.filter_by(topic_id=topic.id).order_by(
+                DocumentTopic.relevance_score.desc()
+            ).limit(5).all()
+            documents = [assignment.document for assignment in assignments]
+        return self._pack_passages(documents)
+    
+    def _chunk_passages(self, chunk_ids: List[int]) -> List[Tuple[Any, str]]:
+        """
+        Ranked chunks packed into the token budget, then grouped into one
+        passage per document (ordered by its best chunk, chunks in reading
+        order). Only chunk text and document titles are loaded.
+        """
+        chunks = {chunk.id: chunk for chunk in db.session.query(
+            DocumentChunk.id, DocumentChunk.document_id, DocumentChunk.chunk_index, DocumentChunk.content
+        ).filter(DocumentChunk.id.in_(chunk_ids))}
+        
+        selected = []
+        budget = self.context_max_tokens
+        for chunk_id in chunk_ids:
+            chunk = chunks.get(chunk_id)
+            if chunk is None:
+                continue
+            text = chunk.content[:min(self.passage_max_tokens, budget) * 4].strip()
+            if not text:
+                continue
+            selected.append((chunk, text))
+            budget -= self.genai.estimate_tokens(text)
+            if budget <= 0:
+                break
+        
+        doc_ids = list(dict.fromkeys(chunk.document_id for chunk, _ in selected))
+        documents = {document.id: document for document in db.session.query(
+            Document.id, Document.title
+        ).filter(Document.id.in_(doc_ids))}
+        passages = []
+        for doc_id in doc_ids:
+            doc_chunks = sorted((item for item in selected if item[0].document_id == doc_id),
+                                key=lambda item: item[0].chunk_index)
+            passages.append((documents[doc_id], "\n...\n".join(text for _, text in doc_chunks)))
+        return passages
+    
+    def _pack_passages(self, documents: List[Document]) -> List[Tuple[Document, str]]:
+        """Leading passage of each document, in order, until the token budget is spent"""
+        passages = []
+        budget = self.context_max_tokens
+        for document in documents:
+            # ~4 characters per token, as in GenAIService.estimate_tokens
+            passage = (document.content or '')[:min(self.passage_max_tokens, budget) * 4].strip()
+            if not passage:
+                continue
+            passages.append((document, passage))
+            budget -= self.genai.estimate_tokens(passage)
+            if budget <= 0:
+                break
+        return passages
+    
+    def _qa_messages(self, topic: Topic, question: str, passages: List[Tuple[Any, str]]) -> List[Dict[str, str]]:
+        doc_texts = [f"Document {i+1}:\n{passage}" for i, (_, passage) in enumerate(passages)]
+        context = "\n\n".join(doc_texts)
+        
+        # Generate answer with citations
+        prompt = f"""You are answering a question about the topic "{topic.name}".
+
+Context from relevant documents:
+{context}
+
+Question: {question}
+
+Provide a comprehensive answer with inline citations. Format citations as [Doc1], [Doc2], etc. where Doc1 refers to the first document, Doc2 to the second, etc.
+
+Answer:"""
+        
+        return [
+            {'role': 'system', 'content': 'You are a helpful assistant that provides detailed answers with citations.'},
+            {'role': 'user', 'content': prompt}
+        ]
+    
+    def _citations(self, answer: str, passages: List[Tuple[Any, str]]) -> List[Dict[str, Any]]:
+        """Map [DocN] citations in an answer to the cited documents, in order of first citation"""
+        citations = []
+        for n in dict.fromkeys(int(c) for c in re.findall(r'\[Doc(\d+)\]', answer)):
+            citation = self._citation(passages, n)
+            if citation is not None:
+                citations.append(citation)
+        return citations
+    
+    def _citation(self, passages: List[Tuple[Any, str]], n: int) -> Optional[Dict[str, Any]]:
+        """The document cited as [DocN], previewing the passage used, or None if out of range"""
+        if not 1 <= n <= len(passages):
+            return None
+        document, passage = passages[n - 1]
+        return {
+            'doc': n,
+            'document_id': document.id,
+            'title': document.title,
+            'preview': passage[:200]
+        }
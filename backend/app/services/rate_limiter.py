@@ -0,0 +1,224 @@
+"""
+Token-bucket rate limiting for GenAI calls, shared by every worker via Redis.
+Each call kind ('llm', 'embedding') has a requests/min and a tokens/min
+bucket. Capacities start from configuration and adapt to the provider's
+x-ratelimit-* response headers, so the whole fleet stays under quota.
+Without Redis the buckets fall back to this process only.
+"""
+from typing import Dict, Any, Optional, Tuple, Mapping
+from redis import Redis
+from app.queue import get_redis, redis_failed
+import threading
+import random
+import time
+import re
+import os
+
+# Atomically refill and take from both buckets of a kind, or report the wait.
+# KEYS: request bucket, token bucket. ARGV: default request capacity, default
+# token capacity, requested tokens. Capacities are per minute; a capacity
+# stored in the bucket (learned from response headers) wins over the default.
+TAKE_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local requested = {1, tonumber(ARGV[3])}
+local state = {}
+local wait = 0
+for i = 1, 2 do
+    local data = redis.call('HMGET', KEYS[i], 'level', 'ts', 'capacity')
+    local capacity = tonumber(data[3]) or tonumber(ARGV[i])
+    local rate = capacity / 60
+    local level = tonumber(data[1]) or capacity
+    local ts = tonumber(data[2]) or now
+    level = math.min(capacity, level + math.max(0, now - ts) * rate)
+    local amount = math.min(requested[i], capacity)
+    if level < amount then
+        wait = math.max(wait, (amount - level) / rate)
+    end
+    state[i] = {level, amount}
+end
+for i = 1, 2 do
+    local level = state[i][1]
+    if wait == 0 then
+        level = level - state[i][2]
+    end
+    redis.call('HSET', KEYS[i], 'level', level, 'ts', now)
+    redis.call('EXPIRE', KEYS[i], 600)
+end
+return tostring(wait)
+"""
+
+# Sets the level and/or capacity of a bucket from response headers.
+# KEYS: bucket. ARGV: level ('' to keep), capacity ('' to keep).
+OBSERVE_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+if ARGV[2] ~= '' then
+    redis.call('HSET', KEYS[1], 'capacity', ARGV[2])
+end
+if ARGV[1] ~= '' then
+    local level = tonumber(redis.call('HGET', KEYS[1], 'level'))
+    local observed = tonumber(ARGV[1])
+    if level == nil or observed < level then
+        redis.call('HSET', KEYS[1], 'level', observed, 'ts', now)
+    end
+end
+redis.call('EXPIRE', KEYS[1], 600)
+return 1
+"""
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """Parse reset durations such as '1s', '6m0s', '20ms' or '0.5' into seconds"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    units = {'h': 3600.0, 'm': 60.0, 's': 1.0, 'ms': 0.001}
+    parts = re.findall(r'([\d.]+)(ms|h|m|s)', value)
+    if not parts:
+        return None
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+class RateLimiter:
+    """Shared requests/min and tokens/min buckets per GenAI call kind"""
+    
+    # Process-wide state shared by every instance
+    _lock = threading.Lock()
+    _local_buckets: Dict[str, Dict[str, float]] = {}
+    _waits = 0
+    _wait_seconds = 0.0
+    _throttled = 0
+    
+    def __init__(self):
+        self.enabled = os.getenv('GENAI_RATE_LIMIT_ENABLED', 'true').lower() in ('true', '1', 'yes')
+        self.key_prefix = os.getenv('GENAI_RATE_LIMIT_PREFIX', 'genai:ratelimit')
+        self.limits = {
+            'llm': (
+                float(os.getenv('LLM_REQUESTS_PER_MINUTE', '500')),
+                float(os.getenv('LLM_TOKENS_PER_MINUTE', '200000'))
+            ),
+            'embedding': (
+                float(os.getenv('EMBEDDING_REQUESTS_PER_MINUTE', '3000')),
+                float(os.getenv('EMBEDDING_TOKENS_PER_MINUTE', '1000000'))
+            )
+        }
+    
+    def acquire(self, kind: str, tokens: int):
+        """Block until one request and `tokens` tokens of `kind` are available"""
+        if not self.enabled:
+            return
+        while True:
+            wait = self._take(kind, tokens)
+            if wait <= 0:
+                return
+            # Sleep in short jittered steps so freed capacity is picked up quickly
+            delay = min(wait, 1.0) * random.uniform(1.0, 1.2)
+            with self._lock:
+                RateLimiter._waits += 1
+                RateLimiter._wait_seconds += delay
+            time.sleep(delay)
+    
+    def observe(self, kind: str, headers: Optional[Mapping[str, str]], throttled: bool = False):
+        """
+        Adapt the buckets of `kind` to x-ratelimit-* response headers.
+        A throttled (429) response empties the buckets it names.
+        """
+        if not self.enabled:
+            return
+        if throttled:
+            with self._lock:
+                RateLimiter._throttled += 1
+        headers = headers or {}
+        for bucket in ('requests', 'tokens'):
+            limit = self._header_float(headers, f'x-ratelimit-limit-{bucket}')
+            remaining = self._header_float(headers, f'x-ratelimit-remaining-{bucket}')
+            if limit is not None and limit <= 0:
+                # A capacity of 0 has no refill rate; keep the bucket's current one
+                limit = None
+            if throttled and remaining is None:
+                remaining = 0.0
+            if limit is None and remaining is None:
+                continue
+            self._set(kind, bucket, remaining, limit)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Throttling counters for this process"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'backend': 'redis' if self._get_redis() is not None else 'local',
+                'waits': RateLimiter._waits,
+                'wait_seconds': round(RateLimiter._wait_seconds, 3),
+                'throttled_responses': RateLimiter._throttled
+            }
+    
+    def _keys(self, kind: str) -> Tuple[str, str]:
+        return f'{self.key_prefix}:{kind}:requests', f'{self.key_prefix}:{kind}:tokens'
+    
+    def _take(self, kind: str, tokens: int) -> float:
+        request_limit, token_limit = self.limits[kind]
+        redis_conn = self._get_redis()
+        if redis_conn is not None:
+            try:
+                return float(redis_conn.eval(TAKE_SCRIPT, 2, *self._keys(kind), request_limit, token_limit, tokens))
+            except Exception as e:
+                print(f"Rate limiter falling back to local buckets: {str(e)}")
+                self._drop_redis()
+        
+        now = time.monotonic()
+        with self._lock:
+            buckets = []
+            wait = 0.0
+            for key, default_capacity, amount in zip(self._keys(kind), (request_limit, token_limit), (1, tokens)):
+                bucket = self._local_buckets.setdefault(key, {'capacity': default_capacity, 'level': None, 'ts': now})
+                capacity = bucket['capacity']
+                rate = capacity / 60
+                level = capacity if bucket['level'] is None else bucket['level']
+                level = min(capacity, level + max(0.0, now - bucket['ts']) * rate)
+                amount = min(amount, capacity)
+                if level < amount:
+                    wait = max(wait, (amount - level) / rate)
+                buckets.append((bucket, level, amount))
+            for bucket, level, amount in buckets:
+                bucket['level'] = level if wait > 0 else level - amount
+                bucket['ts'] = now
+            return wait
+    
+    def _set(self, kind: str, bucket_name: str, level: Optional[float], capacity: Optional[float]):
+        key = self._keys(kind)[0 if bucket_name == 'requests' else 1]
+        redis_conn = self._get_redis()
+        if redis_conn is not None:
+            try:
+                redis_conn.eval(OBSERVE_SCRIPT, 1, key,
+                                '' if level is None else level, '' if capacity is None else capacity)
+                return
+            except Exception as e:
+                print(f"Rate limiter falling back to local buckets: {str(e)}")
+                self._drop_redis()
+        
+        with self._lock:
+            default_capacity = self.limits[kind][0 if bucket_name == 'requests' else 1]
+            bucket = self._local_buckets.setdefault(key, {'capacity': default_capacity, 'level': None, 'ts': time.monotonic()})
+            if capacity is not None:
+                bucket['capacity'] = capacity
+            if level is not None and (bucket['level'] is None or level < bucket['level']):
+                bucket['level'] = level
+                bucket['ts'] = time.monotonic()
+    
+    @staticmethod
+    def _header_float(headers: Mapping[str, str], name: str) -> Optional[float]:
+        value = headers.get(name)
+        try:
+            return float(value) if value is not None else None
+        except (TypeError, ValueError):
+            return None
+    
+    @staticmethod
+    def _get_redis() -> Optional[Redis]:
+        return get_redis()
+    
+    @staticmethod
+    def _drop_redis():
+        redis_failed()
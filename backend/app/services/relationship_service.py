@@ -1,98 +1,159 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple, Optional
 from app import db
 from app.models import Collection, Topic, TopicRelationship, DocumentTopic
+from app.db_utils import dialect_insert
 from app.services.genai_service import GenAIService
+from app.services.embedding_store import EmbeddingStore
+from app.services.clustering import normalize_rows
+from sqlalchemy import delete
+from scipy import sparse
 import numpy as np
 
 class RelationshipService:
     """Service for building topic relationships"""
     
+    # Minimum centroid cosine similarity for two topics to be related
+    SIMILARITY_THRESHOLD = 0.3
+    
     def __init__(self):
         self.genai = GenAIService()
+        self.embedding_store = EmbeddingStore()
     
-    def build_relationships(self, collection_id: int) -> List[TopicRelationship]:
-        """Build relationships between topics in a collection"""
-        topics = Topic.query.filter_by(collection_id=collection_id).all()
+    def build_relationships(self, collection_id: int, parent_id: Optional[int] = None) -> List[TopicRelationship]:
+        """
+        Build relationships between topics in a collection: the top-level
+        topics, or the sub-topics of parent_id.
+        Loads all assignments in one query, computes every pairwise centroid
+        similarity with one matrix product and shared-document counts from a
+        sparse topic/document incidence matrix, then upserts all relationships
+        (source = lower topic ID) in a single bulk statement. Relationships
+        of pairs that are no longer related are deleted in the same transaction.
+        """
+        topics = Topic.query.filter_by(collection_id=collection_id, parent_id=parent_id).order_by(Topic.id).all()
         
         if len(topics) < 2:
             return []
         
-        relationships = []
+        topic_index = {topic.id: i for i, topic in enumerate(topics)}
+        assignments = db.session.query(DocumentTopic.topic_id, DocumentTopic.document_id).filter(
+            DocumentTopic.topic_id.in_(list(topic_index))
+        ).all()
         
-        # Get topic embeddings (average of document embeddings in each topic)
-        topic_embeddings = {}
-        for topic in topics:
-            assignments = DocumentTopic.query.filter_by(topic_id=topic.id).all()
-            if not assignments:
-                continue
-            
-            doc_embeddings = []
-            for assignment in assignments:
-                from app.models import DocumentEmbedding
-                embedding = DocumentEmbedding.query.filter_by(document_id=assignment.document_id).first()
-                if embedding:
-                    doc_embeddings.append(embedding.embedding)
-            
-            if doc_embeddings:
-                topic_embeddings[topic.id] = np.mean(doc_embeddings, axis=0).tolist()
+        # Topic x document incidence matrix
+        doc_index = {}
+        rows = np.array([topic_index[topic_id] for topic_id, _ in assignments], dtype=np.int64)
+        cols = np.array([doc_index.setdefault(doc_id, len(doc_index)) for _, doc_id in assignments], dtype=np.int64)
+        incidence = sparse.csr_matrix(
+            (np.ones(len(assignments), dtype=np.float64), (rows, cols)),
+            shape=(len(topics), len(doc_index))
+        )
+        incidence.data[:] = 1.0  # Count duplicate assignments once
+        common_counts = (incidence @ incidence.T).toarray()
         
-        # Calculate relationships
-        topic_list = list(topics)
-        for i, topic1 in enumerate(topic_list):
-            if topic1.id not in topic_embeddings:
-                continue
-            
-            for topic2 in topic_list[i+1:]:
-                if topic2.id not in topic_embeddings:
-                    continue
-                
-                # Calculate similarity
-                similarity = self.genai.cosine_similarity(
-                    topic_embeddings[topic1.id],
-                    topic_embeddings[topic2.id]
-                )
-                
-                # Count common documents
-                doc_ids_1 = {dt.document_id for dt in DocumentTopic.query.filter_by(topic_id=topic1.id).all()}
-                doc_ids_2 = {dt.document_id for dt in DocumentTopic.query.filter_by(topic_id=topic2.id).all()}
-                common_count = len(doc_ids_1 & doc_ids_2)
-                
-                # Only create relationship if similarity is above threshold
-                if similarity > 0.3:  # Threshold for relationships
-                    # Check if relationship exists
-                    existing = TopicRelationship.query.filter(
-                        ((TopicRelationship.source_topic_id == topic1.id) & 
-                         (TopicRelationship.target_topic_id == topic2.id)) |
-                        ((TopicRelationship.source_topic_id == topic2.id) & 
-                         (TopicRelationship.target_topic_id == topic1.id))
-                    ).first()
-                    
-                    if existing:
-                        existing.similarity_score = similarity
-                        existing.common_document_count = common_count
-                        existing.relationship_type = self._determine_relationship_type(similarity, common_count)
-                    else:
-                        relationship = TopicRelationship(
-                            source_topic_id=topic1.id,
-                            target_topic_id=topic2.id,
-                            similarity_score=similarity,
-                            relationship_type=self._determine_relationship_type(similarity, common_count),
-                            common_document_count=common_count
-                        )
-                        db.session.add(relationship)
-                        relationships.append(relationship)
+        # Pairwise cosine similarity of topic centroids; topics without documents are skipped
+        centroids, has_centroid = self._topic_centroids(collection_id, topics, incidence, doc_index)
+        has_documents = has_centroid & (np.asarray(incidence.sum(axis=1)).ravel() > 0)
+        normalized = normalize_rows(centroids)
+        similarities = normalized @ normalized.T
+        
+        related = np.triu(similarities > self.SIMILARITY_THRESHOLD, k=1)
+        related &= np.outer(has_documents, has_documents)
+        sources, targets = np.nonzero(related)
+        pairs = {(topics[i].id, topics[j].id) for i, j in zip(sources, targets)}
+        self._delete_stale(list(topic_index), pairs)
+        if len(sources) == 0:
+            db.session.commit()
+            return []
         
+        pair_similarities = similarities[sources, targets]
+        pair_counts = common_counts[sources, targets]
+        types = self._relationship_types(pair_similarities, pair_counts)
+        
+        stmt = dialect_insert(TopicRelationship)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['source_topic_id', 'target_topic_id'],
+            set_={
+                'similarity_score': stmt.excluded.similarity_score,
+                'relationship_type': stmt.excluded.relationship_type,
+                'common_document_count': stmt.excluded.common_document_count
+            }
+        )
+        db.session.execute(stmt, [{
+            'source_topic_id': topics[i].id,
+            'target_topic_id': topics[j].id,
+            'similarity_score': float(similarity),
+            'relationship_type': relationship_type,
+            'common_document_count': int(count)
+        } for i, j, similarity, count, relationship_type in zip(sources, targets, pair_similarities, pair_counts, types)])
         db.session.commit()
-        return relationships
+        
+        return [
+            relationship for relationship in TopicRelationship.query.filter(
+                TopicRelationship.source_topic_id.in_(list(topic_index))
+            ).order_by(TopicRelationship.id)
+            if (relationship.source_topic_id, relationship.target_topic_id) in pairs
+        ]
     
-    def _determine_relationship_type(self, similarity: float, common_count: int) -> str:
-        """Determine the type of relationship based on similarity and common documents"""
-        if similarity > 0.7:
-            return "STRONGLY_RELATED"
-        elif similarity > 0.5:
-            return "RELATED"
-        elif common_count > 0:
-            return "SHARED_DOCUMENTS"
-        else:
-            return "SIMILAR"
-
+    def _delete_stale(self, topic_ids: List[int], pairs: set):
+        """Delete relationships between these topics whose pair is not in pairs"""
+        stale_ids = [
+            relationship_id for relationship_id, source_id, target_id in db.session.query(
+                TopicRelationship.id, TopicRelationship.source_topic_id, TopicRelationship.target_topic_id
+            ).filter(TopicRelationship.source_topic_id.in_(topic_ids))
+            if (source_id, target_id) not in pairs
+        ]
+        if stale_ids:
+            db.session.execute(
+                delete(TopicRelationship).where(TopicRelationship.id.in_(stale_ids)),
+                execution_options={'synchronize_session': False}
+            )
+    
+    def _topic_centroids(self, collection_id: int, topics: List[Topic], incidence: sparse.csr_matrix,
+                         doc_index: Dict[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Centroid matrix (one row per topic) and a mask of topics that have one.
+        Uses the centroids persisted by discovery; topics without one get the
+        mean of their documents' embeddings, accumulated chunk by chunk.
+        """
+        missing = [i for i, topic in enumerate(topics) if topic.centroid is None]
+        known = [i for i, topic in enumerate(topics) if topic.centroid is not None]
+        dimensions = len(topics[known[0]].centroid) if known else None
+        
+        sums = None
+        if missing and incidence.shape[1]:
+            counts = np.zeros(len(topics), dtype=np.float64)
+            member_incidence = incidence[missing]
+            for ids, chunk in self.embedding_store.iter_chunks(collection_id):
+                columns = [doc_index[doc_id] for doc_id in ids if doc_id in doc_index]
+                if not columns:
+                    continue
+                rows = [i for i, doc_id in enumerate(ids) if doc_id in doc_index]
+                chunk_incidence = member_incidence[:, columns]
+                chunk_sums = np.asarray(chunk_incidence @ chunk[rows].astype(np.float64))
+                sums = chunk_sums if sums is None else sums + chunk_sums
+                counts[missing] += np.asarray(chunk_incidence.sum(axis=1)).ravel()
+            if sums is not None:
+                dimensions = dimensions or sums.shape[1]
+        
+        if dimensions is None:
+            return np.zeros((len(topics), 1), dtype=np.float32), np.zeros(len(topics), dtype=bool)
+        
+        centroids = np.zeros((len(topics), dimensions), dtype=np.float32)
+        has_centroid = np.zeros(len(topics), dtype=bool)
+        if known:
+            centroids[known] = np.array([topics[i].centroid for i in known], dtype=np.float32)
+            has_centroid[known] = True
+        if sums is not None:
+            found = counts[missing] > 0
+            missing = np.array(missing)
+            centroids[missing[found]] = (sums[found] / counts[missing[found]][:, None]).astype(np.float32)
+            has_centroid[missing[found]] = True
+        return centroids, has_centroid
+    
+    def _relationship_types(self, similarities: np.ndarray, common_counts: np.ndarray) -> List[str]:
+        """Relationship type per pair, from its centroid similarity and shared document count"""
+        return np.select(
+            [similarities > 0.7, similarities > 0.5, common_counts > 0],
+            ["STRONGLY_RELATED", "RELATED", "SHARED_DOCUMENTS"],
+            default="SIMILAR"
+        ).tolist()
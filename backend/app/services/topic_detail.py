@@ -0,0 +1,100 @@
+from typing import List, Dict, Any, Optional, Tuple
+from sqlalchemy import case, func
+from app import db
+from app.models import Topic, TopicRelationship, DocumentTopic, TopicInsight, Document
+from app.services.topic_hierarchy import TopicHierarchyService
+import os
+
+# Characters of document content shown in topic drill-downs
+PREVIEW_CHARS = 200
+
+class TopicDetailService:
+    """
+    Topic drill-down views built from a few projected queries: documents are
+    paged by relevance with a SQL-side preview (content is never loaded),
+    and related topics come from one join.
+    """
+    
+    MAX_PAGE_SIZE = 200
+    
+    def __init__(self):
+        self.page_size = int(os.getenv('TOPIC_DOCUMENTS_PAGE_SIZE', '50'))
+        self.hierarchy = TopicHierarchyService()
+    
+    def page_args(self, page: Optional[int], per_page: Optional[int]) -> Tuple[int, int]:
+        """Clamp 1-based page and page size request arguments"""
+        page = max(1, page or 1)
+        per_page = min(max(1, per_page or self.page_size), self.MAX_PAGE_SIZE)
+        return page, per_page
+    
+    def get_topic_detail(self, topic: Topic, page: int = 1, per_page: Optional[int] = None) -> Dict[str, Any]:
+        """Topic, insights, one page of its documents and its related topics"""
+        insight = TopicInsight.query.filter_by(topic_id=topic.id).first()
+        page, per_page = self.page_args(page, per_page)
+        documents, has_more = self.get_documents(topic.id, page, per_page)
+        
+        return {
+            'id': topic.id,
+            'name': topic.name,
+            'document_count': topic.document_count,
+            'size_score': topic.size_score,
+            'parent_id': topic.parent_id,
+            'level': topic.level or 0,
+            'expandable': self.hierarchy.can_expand(topic.level, topic.document_count),
+            'insights': {
+                'summary': insight.summary if insight else None,
+                'themes': insight.themes if insight else [],
+                'common_questions': insight.common_questions if insight else [],
+                'related_concepts': insight.related_concepts if insight else []
+            } if insight else None,
+            'documents': documents,
+            'documents_page': {'page': page, 'per_page': per_page, 'has_more': has_more},
+            'related_topics': self.get_related_topics(topic.id)
+        }
+    
+    def get_documents(self, topic_id: int, page: int, per_page: int) -> Tuple[List[Dict[str, Any]], bool]:
+        """One page of a topic's documents ranked by relevance, and whether more follow"""
+        rows = db.session.query(
+            Document.id, Document.title,
+            func.substr(Document.content, 1, PREVIEW_CHARS).label('content_preview'),
+            DocumentTopic.relevance_score, DocumentTopic.is_primary
+        ).join(
+            DocumentTopic, DocumentTopic.document_id == Document.id
+        ).filter(
+            DocumentTopic.topic_id == topic_id
+        ).order_by(
+            DocumentTopic.relevance_score.desc(), Document.id
+        ).offset((page - 1) * per_page).limit(per_page + 1).all()
+        
+        documents = [{
+            'id': row.id,
+            'title': row.title,
+            'content_preview': row.content_preview or '',
+            'relevance_score': row.relevance_score,
+            'is_primary': row.is_primary
+        } for row in rows[:per_page]]
+        return documents, len(rows) > per_page
+    
+    def get_related_topics(self, topic_id: int) -> List[Dict[str, Any]]:
+        """Topics related to a topic in either direction, most similar first"""
+        related_id = case(
+            (TopicRelationship.source_topic_id == topic_id, TopicRelationship.target_topic_id),
+            else_=TopicRelationship.source_topic_id
+        )
+        rows = db.session.query(
+            Topic.id, Topic.name, TopicRelationship.similarity_score, TopicRelationship.relationship_type,
+            TopicRelationship.common_document_count
+        ).join(
+            Topic, Topic.id == related_id
+        ).filter(
+            (TopicRelationship.source_topic_id == topic_id) |
+            (TopicRelationship.target_topic_id == topic_id)
+        ).order_by(TopicRelationship.similarity_score.desc()).all()
+        
+        return [{
+            'id': row.id,
+            'name': row.name,
+            'similarity_score': row.similarity_score,
+            'relationship_type': row.relationship_type,
+            'common_document_count': row.common_document_count or 0
+        } for row in rows]
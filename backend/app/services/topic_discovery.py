@@ -1,124 +1,336 @@
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional
 from app import db
-from app.models import Collection, Document, Topic, DocumentTopic, DocumentEmbedding
+from app.models import Collection, Document, Topic, DocumentTopic, TopicRelationship, TopicInsight
 from app.services.genai_service import GenAIService
-from sklearn.cluster import KMeans
-from sklearn.metrics.pairwise import cosine_similarity
+from app.services.embedding_cache import EmbeddingCache
+from app.services.embedding_store import EmbeddingStore
+from app.services.clustering import ClusteringEngine, cluster_sums, normalize_rows, row_cosine_similarity
+from app.services.qa_cache import QACache
+from sqlalchemy import insert, update, delete, or_
+from scipy import sparse
 import numpy as np
-import json
+import os
 
 class TopicDiscoveryService:
     """Service for discovering topics from documents"""
     
     def __init__(self):
         self.genai = GenAIService()
+        self.embedding_cache = EmbeddingCache(self.genai)
+        self.embedding_store = EmbeddingStore(self.embedding_cache)
+        # Incremental discovery re-clusters once a topic grows by this fraction
+        # since its last clustering, or its new members are this much less similar
+        self.max_topic_growth = float(os.getenv('INCREMENTAL_MAX_TOPIC_GROWTH', '0.5'))
+        self.drift_threshold = float(os.getenv('INCREMENTAL_DRIFT_THRESHOLD', '0.1'))
+        # Soft assignment: besides its own cluster, a document joins up to
+        # soft_top_k - 1 other topics whose centroid is at least this similar
+        self.soft_top_k = int(os.getenv('SOFT_ASSIGNMENT_TOP_K', '3'))
+        self.soft_min_similarity = float(os.getenv('SOFT_ASSIGNMENT_MIN_SIMILARITY', '0.6'))
     
-    def discover_topics(self, collection_id: int, incremental: bool = False) -> Dict[str, Any]:
+    def discover_topics(self, collection_id: int, incremental: bool = False,
+                        clustering: Optional[ClusteringEngine] = None) -> Dict[str, Any]:
         """
-        Discover topics for a collection.
-        If incremental=True, only process new documents and update existing topics.
+        Discover topics for a collection: cluster, then name new clusters.
+        If incremental=True, new documents are assigned to the persisted topic
+        centroids; the collection is only re-clustered when a drift or size
+        threshold is exceeded. Otherwise topics are rebuilt from scratch.
+        clustering selects the clustering backend; defaults to the collection's settings.
+        """
+        result = self.cluster_topics(collection_id, incremental=incremental, clustering=clustering)
+        if result.get('reclustered'):
+            self.name_topics([topic.id for topic in result['topics']])
+        return result
+    
+    def cluster_topics(self, collection_id: int, incremental: bool = False,
+                       clustering: Optional[ClusteringEngine] = None) -> Dict[str, Any]:
+        """
+        Clustering half of discover_topics: stores topics with their centroids
+        and document assignments, but leaves naming to name_topics. New topics
+        get a placeholder name; re-used topics keep theirs until renamed.
+        The result includes the cluster count and, when it was chosen
+        automatically, its silhouette score.
         """
         collection = Collection.query.get_or_404(collection_id)
-        documents = Document.query.filter_by(collection_id=collection_id).all()
-        
-        if not documents:
-            return {'topics': [], 'relationships': []}
-        
-        # Get or create embeddings
-        embeddings_list = []
-        doc_ids = []
-        for doc in documents:
-            embedding = DocumentEmbedding.query.filter_by(document_id=doc.id).first()
-            if not embedding:
-                # Generate embedding
-                embedding_vec = self.genai.get_embedding(doc.content[:8000])  # Limit content length
-                embedding = DocumentEmbedding(
-                    document_id=doc.id,
-                    embedding=embedding_vec,
-                    model=self.genai.embedding_model
-                )
-                db.session.add(embedding)
-                db.session.commit()
-            embeddings_list.append(embedding.embedding)
-            doc_ids.append(doc.id)
-        
-        embeddings_matrix = np.array(embeddings_list)
-        
-        # Determine number of clusters (topics)
-        n_docs = len(documents)
-        n_clusters = max(2, min(10, n_docs // 3))  # Adaptive clustering
-        
-        # Perform clustering
-        kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
-        cluster_labels = kmeans.fit_predict(embeddings_matrix)
+        clustering = clustering or ClusteringEngine.for_collection(collection)
+        
+        if incremental:
+            result = self.assign_new_documents(collection_id)
+            if result is not None:
+                return result
+        
+        if clustering.streaming:
+            # Stream embedding chunks from the database instead of loading one matrix
+            self.embedding_store.backfill_collection(collection_id)
+            n_docs = self.embedding_store.count_embedded(collection_id)
+            if not n_docs:
+                return {'topics': [], 'relationships': []}
+            result = clustering.fit_stream(
+                lambda: self.embedding_store.iter_chunks(collection_id, clustering.batch_size)
+            )
+        else:
+            # Load all embeddings in one query, backfilling missing ones in bulk
+            doc_ids, embeddings_matrix = self.embedding_store.load_matrix(collection_id)
+            if not doc_ids:
+                return {'topics': [], 'relationships': []}
+            n_docs = len(doc_ids)
+            result = clustering.fit(doc_ids, embeddings_matrix)
+        
+        n_clusters = result['n_clusters']
+        doc_ids = result['doc_ids']
+        cluster_labels = result['labels']
+        centroids = result['centroids']
+        similarities = result['similarities']
+        
+        # Cluster labels are not stable between runs, so every assignment is rebuilt.
+        # Incremental re-clustering keeps topic rows (and their IDs) by cluster_id.
+        existing_topics = {}
+        if incremental:
+            existing_topics = {topic.cluster_id: topic for topic in Topic.query.filter_by(collection_id=collection_id, parent_id=None)}
+            # Sub-topics split the old assignments, so they are materialized again on demand
+            self._delete_subtopics([topic.id for topic in existing_topics.values()])
+            self._delete_assignments([topic.id for topic in existing_topics.values()])
+            QACache.invalidate([topic.id for topic in existing_topics.values()])
+        else:
+            self._delete_topics([topic_id for (topic_id,) in db.session.query(Topic.id).filter_by(collection_id=collection_id)])
         
         # Generate topics from clusters
         topics = []
+        cluster_topic_ids: List[Optional[int]] = [None] * n_clusters
+        assignments = []
         for cluster_id in range(n_clusters):
-            cluster_docs = [documents[i] for i in range(len(documents)) if cluster_labels[i] == cluster_id]
-            if not cluster_docs:
+            member_indices = np.flatnonzero(cluster_labels == cluster_id)
+            if len(member_indices) == 0:
                 continue
             
-            # Generate topic name and details using LLM
-            topic_name = self._generate_topic_name(cluster_docs)
-            
-            # Check if topic already exists (for incremental updates)
-            existing_topic = None
-            if incremental:
-                existing_topic = Topic.query.filter_by(
-                    collection_id=collection_id,
-                    cluster_id=cluster_id
-                ).first()
-            
-            if existing_topic:
-                topic = existing_topic
-                topic.name = topic_name
-            else:
-                topic = Topic(
-                    collection_id=collection_id,
-                    name=topic_name,
-                    cluster_id=cluster_id,
-                    document_count=len(cluster_docs),
-                    size_score=len(cluster_docs) / n_docs
-                )
+            topic = existing_topics.pop(cluster_id, None)
+            if topic is None:
+                topic = Topic(collection_id=collection_id, cluster_id=cluster_id, name=f"Topic {cluster_id + 1}")
                 db.session.add(topic)
-                db.session.flush()
+            topic.document_count = len(member_indices)
+            topic.clustered_document_count = len(member_indices)
+            topic.size_score = len(member_indices) / n_docs
+            topic.centroid = centroids[cluster_id].tolist()
+            topic.avg_confidence = float(similarities[member_indices].mean())
+            db.session.flush()
             
-            # Assign documents to topic
-            for doc_idx, doc in enumerate(cluster_docs):
-                if doc.id in doc_ids:
-                    doc_idx_in_list = doc_ids.index(doc.id)
-                    # Calculate relevance score (distance from cluster center)
-                    cluster_center = kmeans.cluster_centers_[cluster_id]
-                    doc_embedding = embeddings_matrix[doc_idx_in_list]
-                    similarity = self.genai.cosine_similarity(cluster_center.tolist(), doc_embedding.tolist())
-                    
-                    # Check if assignment exists
-                    assignment = DocumentTopic.query.filter_by(
-                        document_id=doc.id,
-                        topic_id=topic.id
-                    ).first()
-                    
-                    if assignment:
-                        assignment.relevance_score = similarity
-                        assignment.is_primary = (cluster_labels[doc_idx_in_list] == cluster_id)
-                    else:
-                        assignment = DocumentTopic(
-                            document_id=doc.id,
-                            topic_id=topic.id,
-                            relevance_score=similarity,
-                            is_primary=(cluster_labels[doc_idx_in_list] == cluster_id)
-                        )
-                        db.session.add(assignment)
+            # Assign documents to topic (relevance = similarity to cluster centroid)
+            assignments.extend({
+                'document_id': doc_ids[i],
+                'topic_id': topic.id,
+                'relevance_score': float(similarities[i]),
+                'is_primary': True
+            } for i in member_indices)
             
             topics.append(topic)
+            cluster_topic_ids[cluster_id] = topic.id
         
+        # Secondary memberships in the other nearest topics, block by block
+        normalized_centroids = normalize_rows(centroids)
+        if clustering.streaming:
+            positions = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+            for ids, chunk in self.embedding_store.iter_chunks(collection_id, clustering.batch_size):
+                rows = [i for i, doc_id in enumerate(ids) if doc_id in positions]
+                if rows:
+                    assignments.extend(self._secondary_assignments(
+                        [ids[i] for i in rows],
+                        normalize_rows(chunk[rows]) @ normalized_centroids.T,
+                        cluster_labels[[positions[ids[i]] for i in rows]],
+                        cluster_topic_ids
+                    ))
+        else:
+            assignments.extend(self._secondary_assignments(
+                doc_ids, normalize_rows(embeddings_matrix) @ normalized_centroids.T, cluster_labels, cluster_topic_ids
+            ))
+        
+        # Topics whose cluster came out empty this time
+        self._delete_topics([topic.id for topic in existing_topics.values()])
+        self._insert_assignments(assignments)
         db.session.commit()
         
-        return {'topics': topics, 'cluster_labels': cluster_labels.tolist()}
+        return {
+            'topics': topics,
+            'cluster_labels': cluster_labels.tolist(),
+            'clustering': clustering.settings(),
+            'n_clusters': n_clusters,
+            'silhouette_score': result['silhouette_score'],
+            'reclustered': True
+        }
+    
+    def assign_new_documents(self, collection_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Incremental fast path: assign documents that have no topic yet to the
+        nearest persisted centroid and fold them into the centroids as running
+        means. Makes no clustering or LLM calls.
+        Returns None when the collection needs a full re-clustering instead:
+        a topic has no centroid, a topic grew by more than max_topic_growth
+        since it was clustered, or its new members are on average more than
+        drift_threshold less similar to it than its existing members.
+        """
+        topics = Topic.query.filter_by(collection_id=collection_id, parent_id=None).order_by(Topic.id).all()
+        if not topics or any(topic.centroid is None for topic in topics):
+            return None
+        
+        new_ids = [doc_id for (doc_id,) in db.session.query(Document.id).outerjoin(
+            DocumentTopic, DocumentTopic.document_id == Document.id
+        ).filter(
+            Document.collection_id == collection_id,
+            Document.duplicate_of_id.is_(None),
+            DocumentTopic.id.is_(None)
+        ).order_by(Document.id)]
+        
+        doc_ids, matrix = self.embedding_store.load_vectors(new_ids)
+        if len(doc_ids) < len(new_ids):
+            embedded = set(doc_ids)
+            self.embedding_store.backfill([doc_id for doc_id in new_ids if doc_id not in embedded])
+            doc_ids, matrix = self.embedding_store.load_vectors(new_ids)
+        
+        result = {'topics': topics, 'reclustered': False, 'assigned_documents': len(doc_ids)}
+        if not doc_ids:
+            return result
+        
+        # Nearest centroid by cosine similarity, for all new documents at once
+        centroids = np.array([topic.centroid for topic in topics], dtype=np.float32)
+        similarities = normalize_rows(matrix) @ normalize_rows(centroids).T
+        labels = similarities.argmax(axis=1)
+        best = similarities[np.arange(len(labels)), labels]
+        
+        n_topics = len(topics)
+        new_counts = np.bincount(labels, minlength=n_topics)
+        new_similarity = np.bincount(labels, weights=best, minlength=n_topics)
+        counts = np.array([topic.document_count or 0 for topic in topics], dtype=np.float64)
+        clustered = np.array([topic.clustered_document_count or topic.document_count or 0 for topic in topics], dtype=np.float64)
+        avg_confidence = np.array([topic.avg_confidence or 0.0 for topic in topics], dtype=np.float64)
+        
+        grown = counts + new_counts > np.maximum(clustered, 1) * (1 + self.max_topic_growth)
+        drift = avg_confidence - new_similarity / np.maximum(new_counts, 1)
+        drifted = (new_counts > 0) & (counts > 0) & (drift > self.drift_threshold)
+        if grown.any() or drifted.any():
+            return None
+        
+        # Running means: centroid and average relevance of each topic
+        totals = counts + new_counts
+        sums = cluster_sums(matrix, labels, n_topics)
+        n_docs = totals.sum()
+        for idx in np.flatnonzero(new_counts):
+            topic = topics[idx]
+            topic.centroid = ((centroids[idx] * counts[idx] + sums[idx]) / totals[idx]).astype(np.float32).tolist()
+            topic.avg_confidence = float((avg_confidence[idx] * counts[idx] + new_similarity[idx]) / totals[idx])
+            topic.document_count = int(totals[idx])
+        for idx, topic in enumerate(topics):
+            topic.size_score = float(totals[idx] / n_docs)
+        
+        topic_ids = [topic.id for topic in topics]
+        QACache.invalidate([topic_ids[idx] for idx in np.flatnonzero(new_counts)])
+        self._delete_subtopics([topic_ids[idx] for idx in np.flatnonzero(new_counts)])
+        self._insert_assignments([{
+            'document_id': doc_id,
+            'topic_id': topic_ids[label],
+            'relevance_score': float(similarity),
+            'is_primary': True
+        } for doc_id, label, similarity in zip(doc_ids, labels, best)])
+        self._insert_assignments(self._secondary_assignments(doc_ids, similarities, labels, topic_ids))
+        db.session.commit()
+        
+        return result
+    
+    def _secondary_assignments(self, doc_ids: List[int], similarities: np.ndarray, labels: np.ndarray,
+                               topic_ids: List[Optional[int]]) -> List[Dict[str, Any]]:
+        """
+        Non-primary assignment rows for a block of documents, from their
+        cosine similarity to every centroid (documents x topics): the
+        soft_top_k - 1 nearest topics other than the document's own, kept
+        when at least soft_min_similarity. topic_ids maps centroid columns to
+        topics; None marks a column without a topic.
+        """
+        k = min(self.soft_top_k - 1, len(topic_ids) - 1)
+        if k < 1 or not len(doc_ids):
+            return []
+        
+        similarities = similarities.copy()
+        similarities[:, [i for i, topic_id in enumerate(topic_ids) if topic_id is None]] = -np.inf
+        similarities[np.arange(len(labels)), labels] = -np.inf
+        nearest = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        nearest_similarities = np.take_along_axis(similarities, nearest, axis=1)
+        rows, columns = np.nonzero(nearest_similarities >= self.soft_min_similarity)
+        return [{
+            'document_id': doc_ids[row],
+            'topic_id': topic_ids[nearest[row, column]],
+            'relevance_score': float(nearest_similarities[row, column]),
+            'is_primary': False
+        } for row, column in zip(rows, columns)]
     
-    def _generate_topic_name(self, documents: List[Document]) -> str:
-        """Generate a topic name from a cluster of documents"""
+    def _insert_assignments(self, assignments: List[Dict[str, Any]]):
+        """Bulk insert document-topic assignment rows"""
+        if assignments:
+            db.session.execute(insert(DocumentTopic), assignments)
+    
+    def _delete_assignments(self, topic_ids: List[int]):
+        """Bulk delete every document assignment of the given topics"""
+        if topic_ids:
+            db.session.execute(
+                delete(DocumentTopic).where(DocumentTopic.topic_id.in_(topic_ids)),
+                execution_options={'synchronize_session': False}
+            )
+    
+    def _descendant_ids(self, topic_ids: List[int]) -> List[int]:
+        """IDs of every sub-topic below the given topics, one query per level"""
+        descendants = []
+        level = list(topic_ids)
+        while level:
+            level = [topic_id for (topic_id,) in db.session.query(Topic.id).filter(Topic.parent_id.in_(level))]
+            descendants.extend(level)
+        return descendants
+    
+    def _delete_subtopics(self, topic_ids: List[int]):
+        """Drop the materialized sub-topics of the given topics so they are split again on next expansion"""
+        if not topic_ids:
+            return
+        self._delete_topics(self._descendant_ids(topic_ids))
+        db.session.execute(
+            update(Topic).where(Topic.id.in_(topic_ids)).values(expanded_at=None),
+            execution_options={'synchronize_session': False}
+        )
+    
+    def _delete_topics(self, topic_ids: List[int]):
+        """Bulk delete topics and their sub-topics with their assignments, relationships and insights"""
+        if not topic_ids:
+            return
+        topic_ids = list(topic_ids) + self._descendant_ids(topic_ids)
+        self._delete_assignments(topic_ids)
+        for stmt in (
+            delete(TopicRelationship).where(or_(
+                TopicRelationship.source_topic_id.in_(topic_ids),
+                TopicRelationship.target_topic_id.in_(topic_ids)
+            )),
+            delete(TopicInsight).where(TopicInsight.topic_id.in_(topic_ids)),
+            delete(Topic).where(Topic.id.in_(topic_ids))
+        ):
+            db.session.execute(stmt, execution_options={'synchronize_session': False})
+    
+    def name_topics(self, topic_ids: List[int]) -> List[Topic]:
+        """
+        Name topics with the LLM from a sample of their documents.
+        Prompts are built here, the LLM calls run concurrently and a failed
+        call only falls back to a generic name for its own topic.
+        """
+        topics = Topic.query.filter(Topic.id.in_(topic_ids)).order_by(Topic.id).all()
+        conversations = [self._topic_name_messages(self._sample_documents(topic.id)) for topic in topics]
+        responses = self.genai.chat_completions(conversations)
+        for topic, response in zip(topics, responses):
+            topic.name = self._parse_topic_name(response, topic.document_count or 0)
+        QACache.invalidate([topic.id for topic in topics])
+        db.session.commit()
+        return topics
+    
+    def _sample_documents(self, topic_id: int, limit: int = 5) -> List[Document]:
+        """Load the first few primary documents of a topic for topic naming"""
+        return Document.query.join(DocumentTopic, DocumentTopic.document_id == Document.id).filter(
+            DocumentTopic.topic_id == topic_id,
+            DocumentTopic.is_primary.is_(True)
+        ).order_by(Document.id).limit(limit).all()
+    
+    def _topic_name_messages(self, documents: List[Document]) -> List[Dict[str, str]]:
+        """Chat messages asking for a name for a cluster of documents"""
         # Sample documents for topic naming
         sample_texts = [doc.content[:500] for doc in documents[:5]]
         combined_text = "\n\n".join(sample_texts)
@@ -130,45 +342,100 @@ Documents:
 
 Generate only the topic name, nothing else:"""
         
-        try:
-            topic_name = self.genai.chat_completion([
-                {'role': 'system', 'content': 'You are a helpful assistant that generates concise topic names.'},
-                {'role': 'user', 'content': prompt}
-            ])
-            return topic_name.strip().strip('"').strip("'")
-        except Exception as e:
+        return [
+            {'role': 'system', 'content': 'You are a helpful assistant that generates concise topic names.'},
+            {'role': 'user', 'content': prompt}
+        ]
+    
+    def _parse_topic_name(self, response, document_count: int) -> str:
+        """Clean up a topic name response, falling back to a generic name on failure"""
+        if isinstance(response, Exception) or not response:
             # Fallback to generic name
-            return f"Topic {len(documents)}"
+            return f"Topic {document_count}"
+        return response.strip().strip('"').strip("'")
     
     def calculate_relevance_scores(self, collection_id: int):
-        """Recalculate relevance scores for all document-topic assignments"""
-        topics = Topic.query.filter_by(collection_id=collection_id).all()
+        """
+        Recalculate relevance scores for all document-topic assignments.
+        Relevance is the cosine similarity of a document to the mean embedding
+        of its topic's primary members. Embeddings are streamed twice in chunks (centroid sums,
+        then similarities), and scores are written with one bulk UPDATE.
+        Topic avg_confidence is refreshed to the mean score.
+        """
+        topic_ids = [topic_id for (topic_id,) in db.session.query(Topic.id).filter_by(
+            collection_id=collection_id
+        ).order_by(Topic.id)]
+        if not topic_ids:
+            return
         
-        for topic in topics:
-            assignments = DocumentTopic.query.filter_by(topic_id=topic.id).all()
-            topic_embeddings = []
-            doc_ids = []
-            
-            for assignment in assignments:
-                doc = assignment.document
-                embedding = DocumentEmbedding.query.filter_by(document_id=doc.id).first()
-                if embedding:
-                    topic_embeddings.append(embedding.embedding)
-                    doc_ids.append(doc.id)
-            
-            if not topic_embeddings:
-                continue
-            
-            # Calculate centroid
-            centroid = np.mean(topic_embeddings, axis=0)
-            
-            # Update relevance scores
-            for assignment in assignments:
-                if assignment.document.id in doc_ids:
-                    idx = doc_ids.index(assignment.document.id)
-                    similarity = self.genai.cosine_similarity(
-                        centroid.tolist(),
-                        topic_embeddings[idx]
-                    )
-                    assignment.relevance_score = similarity
-
+        assignments = db.session.query(
+            DocumentTopic.id, DocumentTopic.topic_id, DocumentTopic.document_id, DocumentTopic.is_primary
+        ).filter(
+            DocumentTopic.topic_id.in_(topic_ids)
+        ).all()
+        if not assignments:
+            return
+        
+        topic_index = {topic_id: i for i, topic_id in enumerate(topic_ids)}
+        doc_index = {}
+        assignment_ids = np.array([assignment_id for assignment_id, _, _, _ in assignments], dtype=np.int64)
+        assignment_topics = np.array([topic_index[topic_id] for _, topic_id, _, _ in assignments], dtype=np.int64)
+        assignment_docs = np.array([doc_index.setdefault(doc_id, len(doc_index)) for _, _, doc_id, _ in assignments], dtype=np.int64)
+        # Centroids are the mean of primary members (all members for a topic without any),
+        # so secondary memberships do not pull topics towards each other
+        primary = np.array([bool(is_primary) for _, _, _, is_primary in assignments])
+        has_primary = np.bincount(assignment_topics[primary], minlength=len(topic_ids)) > 0
+        incidence = sparse.csr_matrix(
+            ((primary | ~has_primary[assignment_topics]).astype(np.float64), (assignment_topics, assignment_docs)),
+            shape=(len(topic_ids), len(doc_index))
+        )
+        
+        def assigned_chunks():
+            # Chunks restricted to assigned documents, with their incidence columns
+            for ids, chunk in self.embedding_store.iter_chunks(collection_id):
+                rows = [i for i, doc_id in enumerate(ids) if doc_id in doc_index]
+                if rows:
+                    yield np.array([doc_index[ids[i]] for i in rows], dtype=np.int64), chunk[rows]
+        
+        # Pass 1: per-topic sums and counts of member embeddings
+        sums = None
+        counts = np.zeros(len(topic_ids), dtype=np.float64)
+        for columns, chunk in assigned_chunks():
+            chunk_incidence = incidence[:, columns]
+            chunk_sums = np.asarray(chunk_incidence @ chunk.astype(np.float64))
+            sums = chunk_sums if sums is None else sums + chunk_sums
+            counts += np.asarray(chunk_incidence.sum(axis=1)).ravel()
+        if sums is None:
+            return
+        centroids = (sums / np.maximum(counts, 1)[:, None]).astype(np.float32)
+        
+        # Pass 2: similarity of every assigned document to each of its topics;
+        # assignments are grouped by document so a chunk finds its own quickly
+        order = np.argsort(assignment_docs, kind='stable')
+        starts = np.searchsorted(assignment_docs[order], np.arange(len(doc_index) + 1))
+        scores = np.full(len(assignments), np.nan, dtype=np.float64)
+        for columns, chunk in assigned_chunks():
+            chunk_row = np.full(len(doc_index), -1, dtype=np.int64)
+            chunk_row[columns] = np.arange(len(columns))
+            positions = np.concatenate([order[starts[col]:starts[col + 1]] for col in columns])
+            scores[positions] = row_cosine_similarity(
+                chunk[chunk_row[assignment_docs[positions]]],
+                centroids[assignment_topics[positions]]
+            )
+        
+        scored = ~np.isnan(scores)
+        db.session.execute(update(DocumentTopic), [
+            {'id': int(assignment_id), 'relevance_score': float(score)}
+            for assignment_id, score in zip(assignment_ids[scored], scores[scored])
+        ])
+        
+        # Mean relevance of each topic's members that define its centroid
+        members = scored & (primary | ~has_primary[assignment_topics])
+        score_sums = np.bincount(assignment_topics[members], weights=scores[members], minlength=len(topic_ids))
+        score_counts = np.bincount(assignment_topics[members], minlength=len(topic_ids))
+        db.session.execute(update(Topic), [
+            {'id': topic_id, 'avg_confidence': float(score_sums[i] / score_counts[i])}
+            for i, topic_id in enumerate(topic_ids) if score_counts[i]
+        ])
+        QACache.invalidate(topic_ids)
+        db.session.commit()
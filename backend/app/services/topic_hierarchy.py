@@ -0,0 +1,134 @@
+"""
+Hierarchical topics, materialized one level at a time.
+Discovery only builds the top level. The first time a topic is opened its
+expansion is enqueued as a background job, which re-clusters the topic's
+own documents into sub-topics, stores them as child topics (with their
+assignments and sibling relationships) and names them with the LLM, so
+clustering and naming costs are only paid for levels users open.
+"""
+from typing import List, Optional
+from sqlalchemy import insert
+from app import db
+from app.models import Collection, Topic, DocumentTopic
+from app.services.topic_discovery import TopicDiscoveryService
+from app.services.relationship_service import RelationshipService
+from app.services.clustering import ClusteringEngine
+from app.queue import ACTIVE_JOB_STATUSES
+from datetime import datetime
+import numpy as np
+import os
+
+class TopicHierarchyService:
+    """Lazily splits topics into sub-topics"""
+    
+    def __init__(self, topic_discovery: Optional[TopicDiscoveryService] = None,
+                 relationship_service: Optional[RelationshipService] = None):
+        self.topic_discovery = topic_discovery or TopicDiscoveryService()
+        self.relationship_service = relationship_service or RelationshipService()
+        # Topics smaller than this, or at the maximum depth, have no sub-topics
+        self.min_documents = int(os.getenv('SUBTOPIC_MIN_DOCUMENTS', '20'))
+        self.max_depth = int(os.getenv('SUBTOPIC_MAX_DEPTH', '3'))
+        self.max_subtopics = int(os.getenv('SUBTOPIC_MAX_CLUSTERS', '10'))
+    
+    def can_expand(self, level: int, document_count: int) -> bool:
+        """Whether a topic at this level and size is split into sub-topics"""
+        return (level or 0) < self.max_depth and (document_count or 0) >= self.min_documents
+    
+    def is_materialized(self, topic: Topic) -> bool:
+        """Whether the topic's sub-topic level can be read without expanding it first"""
+        return topic.expanded_at is not None or not self.can_expand(topic.level, topic.document_count)
+    
+    def enqueue_expand(self, topic: Topic, queue) -> str:
+        """
+        Enqueue the topic's expansion on an RQ queue unless a job for it is
+        already waiting or running. Returns the RQ job id, which is derived
+        from the topic so concurrent requests share one job.
+        """
+        from app.workers import expand_topic_job
+        rq_job_id = f'expand-topic-{topic.id}'
+        rq_job = queue.fetch_job(rq_job_id)
+        if rq_job is None or rq_job.get_status(refresh=False) not in ACTIVE_JOB_STATUSES:
+            queue.enqueue(expand_topic_job, topic.id, job_id=rq_job_id)
+        return rq_job_id
+    
+    def children(self, topic_id: int) -> List[Topic]:
+        return Topic.query.filter_by(parent_id=topic_id).order_by(Topic.id).all()
+    
+    def expand(self, topic: Topic) -> List[Topic]:
+        """
+        The topic's sub-topics, materialized on first expansion by the
+        expand_topic_job worker. The topic row is locked while its documents
+        are clustered, so concurrent jobs expand it once. A topic whose
+        documents form a single cluster is marked expanded without children.
+        """
+        topic = Topic.query.populate_existing().with_for_update().filter_by(id=topic.id).one()
+        if topic.expanded_at is not None or not self.can_expand(topic.level, topic.document_count):
+            db.session.commit()
+            return self.children(topic.id)
+        
+        # Secondary members stay with the topic whose branch they are primary in
+        doc_ids = [doc_id for (doc_id,) in db.session.query(DocumentTopic.document_id).filter(
+            DocumentTopic.topic_id == topic.id,
+            DocumentTopic.is_primary.is_(True)
+        ).order_by(DocumentTopic.document_id)]
+        
+        # Cluster only this topic's members, choosing the number of sub-topics automatically
+        clustering = ClusteringEngine.for_collection(Collection.query.get(topic.collection_id), {
+            'n_clusters': 'auto',
+            'max_clusters': self.max_subtopics
+        })
+        store = self.topic_discovery.embedding_store
+        if clustering.streaming:
+            batch_size = clustering.batch_size
+            result = clustering.fit_stream(lambda: (
+                (ids, chunk) for ids, chunk in (
+                    store.load_vectors(doc_ids[i:i + batch_size]) for i in range(0, len(doc_ids), batch_size)
+                ) if ids
+            ))
+        else:
+            ids, matrix = store.load_vectors(doc_ids)
+            result = clustering.fit(ids, matrix) if ids else None
+        
+        children = []
+        if result is not None and result['n_clusters'] > 1:
+            labels = result['labels']
+            similarities = result['similarities']
+            assignments = []
+            for cluster_id in range(result['n_clusters']):
+                member_indices = np.flatnonzero(labels == cluster_id)
+                if len(member_indices) == 0:
+                    continue
+                child = Topic(
+                    collection_id=topic.collection_id,
+                    parent_id=topic.id,
+                    level=topic.level + 1,
+                    cluster_id=cluster_id,
+                    name=f"{topic.name} {cluster_id + 1}",
+                    color=topic.color,
+                    document_count=len(member_indices),
+                    clustered_document_count=len(member_indices),
+                    size_score=len(member_indices) / len(labels),
+                    centroid=result['centroids'][cluster_id].tolist(),
+                    avg_confidence=float(similarities[member_indices].mean())
+                )
+                db.session.add(child)
+                db.session.flush()
+                assignments.extend({
+                    'document_id': result['doc_ids'][i],
+                    'topic_id': child.id,
+                    'relevance_score': float(similarities[i]),
+                    'is_primary': True
+                } for i in member_indices)
+                children.append(child)
+            if assignments:
+                db.session.execute(insert(DocumentTopic), assignments)
+        topic.expanded_at = datetime.utcnow()
+        db.session.commit()
+        
+        if children:
+            self.topic_discovery.name_topics([child.id for child in children])
+            self.relationship_service.build_relationships(topic.collection_id, parent_id=topic.id)
+            # Stamp the finished level, so graph snapshots taken before naming are not reused
+            topic.expanded_at = datetime.utcnow()
+            db.session.commit()
+        return self.children(topic.id)
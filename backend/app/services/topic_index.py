@@ -0,0 +1,75 @@
+"""
+Per-topic vector indexes for question-aware retrieval.
+A topic's index is one normalized matrix of its documents' chunk embeddings
+(or document embeddings when the topic has no chunks), built once per topic
+version and kept in a process-wide LRU, so a question costs a single
+matrix-vector product instead of a database scan. With pgvector storage,
+document vectors are searched with the database ANN index instead.
+"""
+from typing import List, Optional, Tuple
+from collections import OrderedDict
+from app import db
+from app.models import Topic, DocumentTopic
+from app.services.embedding_store import EmbeddingStore
+from app.services.clustering import normalize_rows
+import numpy as np
+import threading
+import os
+
+# (document_id, chunk_id) per index row; chunk_id is None for document vectors
+IndexKeys = List[Tuple[int, Optional[int]]]
+
+class TopicVectorIndex:
+    """Nearest chunks (or documents) of a topic to a query embedding"""
+    
+    # Built indexes are shared by every instance in the process
+    _lock = threading.Lock()
+    _indexes: 'OrderedDict[Tuple[int, int], Tuple[IndexKeys, np.ndarray]]' = OrderedDict()
+    
+    def __init__(self, embedding_store: Optional[EmbeddingStore] = None):
+        self.embedding_store = embedding_store or EmbeddingStore()
+        self.max_vectors = int(os.getenv('QA_INDEX_MAX_VECTORS', '50000'))
+    
+    def search(self, topic: Topic, query_vec: List[float], k: int) -> List[Tuple[int, Optional[int], float]]:
+        """
+        (document_id, chunk_id, cosine similarity) of the k index rows nearest
+        to query_vec. Document vectors are searched with the pgvector ANN
+        index when it is enabled; chunk vectors are not indexed there.
+        """
+        if self.embedding_store.uses_index() and not self.embedding_store.uses_chunks:
+            return [(doc_id, None, similarity) for doc_id, similarity in self.embedding_store.nearest_documents(
+                query_vec, k=k, topic_id=topic.id
+            )]
+        
+        keys, matrix = self.get(topic)
+        query = np.asarray(query_vec, dtype=np.float32)
+        if not keys or matrix.shape[1] != query.shape[0]:
+            return []
+        indices, similarities = EmbeddingStore.top_k_similar(query, matrix, k)
+        return [(keys[i][0], keys[i][1], float(sim)) for i, sim in zip(indices, similarities)]
+    
+    def get(self, topic: Topic) -> Tuple[IndexKeys, np.ndarray]:
+        """The index for the topic's current version, built on first use"""
+        key = (topic.id, topic.version or 1)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                return index
+        
+        document_ids = [doc_id for (doc_id,) in db.session.query(DocumentTopic.document_id).filter(
+            DocumentTopic.topic_id == topic.id
+        ).order_by(DocumentTopic.document_id)]
+        keys, matrix = self.embedding_store.load_chunk_vectors(document_ids)
+        if not keys:
+            doc_ids, matrix = self.embedding_store.load_vectors(document_ids)
+            keys = [(doc_id, None) for doc_id in doc_ids]
+        index = (keys, normalize_rows(matrix) if keys else matrix)
+        
+        with self._lock:
+            self._indexes[key] = index
+            self._indexes.move_to_end(key)
+            # Bound memory by the number of indexed vectors, always keeping the newest index
+            while len(self._indexes) > 1 and sum(len(keys) for keys, _ in self._indexes.values()) > self.max_vectors:
+                self._indexes.popitem(last=False)
+        return index
@@ -0,0 +1,13 @@
+"""Server-Sent Events formatting"""
+from typing import Any
+import json
+
+# Keep proxies from buffering or caching event streams
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+def sse_event(event: str, data: Any) -> str:
+    """One SSE message; non-string data is sent as JSON, multi-line data as several data lines"""
+    if not isinstance(data, str):
+        data = json.dumps(data)
+    lines = ''.join(f'data: {line}\n' for line in data.split('\n'))
+    return f'event: {event}\n{lines}\n'
@@ -1,21 +1,116 @@
 """Background worker functions for RQ"""
 from app import create_app, db
 from app.services.discovery_job import DiscoveryJobService
+from app.services.embedding_cache import EmbeddingCache
+from app.queue import get_queue
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
+# Per-process app and services, reused by every job this process runs
+_app = None
+_app_pid = None
+_discovery_service = None
+
+def get_app():
+    """
+    The worker's Flask app, created once per process.
+    In a forked work horse the inherited DB pool is replaced (without
+    closing the parent's connections) so connections are never shared.
+    """
+    global _app, _app_pid
+    if _app is None:
+        _app = create_app()
+    elif _app_pid != os.getpid():
+        with _app.app_context():
+            db.engine.dispose(close=False)
+    _app_pid = os.getpid()
+    return _app
+
+def get_discovery_service() -> DiscoveryJobService:
+    """Discovery service (and its GenAI clients), created once per process"""
+    global _discovery_service
+    if _discovery_service is None:
+        _discovery_service = DiscoveryJobService()
+    return _discovery_service
+
+def preload():
+    """
+    Warm up a worker process before it takes jobs: create the app, open a
+    pooled DB connection and build the services with their HTTP clients.
+    Forked work horses inherit all of it.
+    """
+    app = get_app()
+    with app.app_context():
+        with db.engine.connect():
+            pass
+        service = get_discovery_service()
+        for genai in (service.topic_discovery.genai, service.relationship_service.genai, service.insight_service.genai):
+            try:
+                genai.client  # Lazily built OpenAI client
+            except Exception as e:
+                logger.warning(f"Could not create GenAI client during preload: {str(e)}")
+    get_queue()
+    logger.info(f"Worker preloaded: pid={os.getpid()}")
+
 def run_discovery_job(collection_id: int, incremental: bool = False, job_id: int = None):
     """RQ worker function for running discovery jobs"""
-    app = create_app()
-    with app.app_context():
+    with get_app().app_context():
         try:
             logger.info(f"Starting discovery job: collection_id={collection_id}, incremental={incremental}, job_id={job_id}")
-            service = DiscoveryJobService()
-            result = service.run_discovery(collection_id, incremental=incremental, job_id=job_id)
-            logger.info(f"Discovery job completed: collection_id={collection_id}, job_id={job_id}")
+            service = get_discovery_service()
+            result = service.run_discovery(collection_id, incremental=incremental, job_id=job_id, queue=get_queue())
+            logger.info(f"Discovery job stages enqueued or completed: collection_id={collection_id}, job_id={job_id}")
             return result
         except Exception as e:
             logger.error(f"Discovery job failed: collection_id={collection_id}, job_id={job_id}, error={str(e)}")
             raise
 
+def run_discovery_stage_job(job_id: int, stage: str):
+    """RQ worker function for one independent discovery stage (relate or insights)"""
+    with get_app().app_context():
+        try:
+            logger.info(f"Starting discovery stage: job_id={job_id}, stage={stage}")
+            return get_discovery_service().run_stages(job_id, [stage])
+        except Exception as e:
+            logger.error(f"Discovery stage failed: job_id={job_id}, stage={stage}, error={str(e)}")
+            raise
+
+def finalize_discovery_job(job_id: int):
+    """RQ worker function run once the concurrent stages have ended, successfully or not"""
+    with get_app().app_context():
+        try:
+            result = get_discovery_service().finalize_stages(job_id)
+            if result['status'] != 'success':
+                logger.error(f"Discovery job failed: job_id={job_id}, missing stages={result['missing_stages']}")
+                return result
+            logger.info(f"Discovery job completed: job_id={job_id}")
+            try:
+                evicted = EmbeddingCache().evict()
+                if evicted:
+                    logger.info(f"Evicted {evicted} embedding cache entries")
+            except Exception as e:
+                logger.warning(f"Embedding cache eviction failed: {str(e)}")
+            return result
+        except Exception as e:
+            logger.error(f"Discovery job failed: job_id={job_id}, error={str(e)}")
+            raise
+
+def expand_topic_job(topic_id: int):
+    """RQ worker function that materializes the sub-topic level below a topic"""
+    with get_app().app_context():
+        from app.models import Topic
+        from app.services.topic_hierarchy import TopicHierarchyService
+        try:
+            topic = Topic.query.get(topic_id)
+            if topic is None:
+                logger.info(f"Topic expansion skipped, topic no longer exists: topic_id={topic_id}")
+                return []
+            service = get_discovery_service()
+            children = TopicHierarchyService(service.topic_discovery, service.relationship_service).expand(topic)
+            logger.info(f"Topic expanded: topic_id={topic_id}, subtopics={len(children)}")
+            return [child.id for child in children]
+        except Exception as e:
+            logger.error(f"Topic expansion failed: topic_id={topic_id}, error={str(e)}")
+            raise
@@ -0,0 +1,49 @@
+"""Add document chunks with per-chunk embeddings
+
+Revision ID: 2724230232d6
+Revises: 7c964726e1cb
+Create Date: 2026-10-17 17:21:05.472913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import os
+
+
+# revision identifiers, used by Alembic.
+revision = '2724230232d6'
+down_revision = '7c964726e1cb'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('document_chunks',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('document_id', sa.Integer(), nullable=False),
+    sa.Column('chunk_index', sa.Integer(), nullable=False),
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.Column('start_char', sa.Integer(), nullable=True),
+    sa.Column('end_char', sa.Integer(), nullable=True),
+    sa.Column('token_count', sa.Integer(), nullable=True),
+    sa.Column('embedding', sa.ARRAY(sa.Float()), nullable=True),
+    sa.Column('model', sa.String(length=100), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['document_id'], ['documents.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('document_id', 'chunk_index', name='_document_chunk_uc')
+    )
+    op.create_index(op.f('ix_document_chunks_document_id'), 'document_chunks', ['document_id'], unique=False)
+    
+    # Match the document embedding column type in pgvector mode
+    if os.getenv('EMBEDDING_STORAGE', 'array') == 'pgvector' and op.get_bind().dialect.name == 'postgresql':
+        dimensions = int(os.getenv('EMBEDDING_DIMENSIONS', '1536'))
+        op.execute(
+            f'ALTER TABLE document_chunks ALTER COLUMN embedding TYPE vector({dimensions}) '
+            f'USING embedding::real[]::vector({dimensions})'
+        )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_document_chunks_document_id'), table_name='document_chunks')
+    op.drop_table('document_chunks')
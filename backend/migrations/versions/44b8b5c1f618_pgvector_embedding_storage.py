@@ -0,0 +1,65 @@
+"""pgvector embedding storage
+
+Converts embedding columns from float8[] to vector(EMBEDDING_DIMENSIONS) and
+builds an ANN index on document embeddings. Only runs when
+EMBEDDING_STORAGE=pgvector, which must match the setting the app runs with.
+EMBEDDING_INDEX selects the index type: hnsw (default) or ivfflat.
+
+Revision ID: 44b8b5c1f618
+Revises: 7b17c978e873
+Create Date: 2026-10-17 11:02:17.450913
+
+"""
+from alembic import op
+import os
+
+
+# revision identifiers, used by Alembic.
+revision = '44b8b5c1f618'
+down_revision = '7b17c978e873'
+branch_labels = None
+depends_on = None
+
+EMBEDDING_TABLES = ['document_embeddings', 'embedding_cache']
+INDEX_NAME = 'ix_document_embeddings_embedding_ann'
+
+
+def _pgvector_mode() -> bool:
+    return os.getenv('EMBEDDING_STORAGE', 'array') == 'pgvector' and op.get_bind().dialect.name == 'postgresql'
+
+
+def upgrade() -> None:
+    if not _pgvector_mode():
+        return
+    
+    dimensions = int(os.getenv('EMBEDDING_DIMENSIONS', '1536'))
+    op.execute('CREATE EXTENSION IF NOT EXISTS vector')
+    for table in EMBEDDING_TABLES:
+        op.execute(
+            f'ALTER TABLE {table} ALTER COLUMN embedding TYPE vector({dimensions}) '
+            f'USING embedding::real[]::vector({dimensions})'
+        )
+    
+    if os.getenv('EMBEDDING_INDEX', 'hnsw') == 'ivfflat':
+        lists = int(os.getenv('EMBEDDING_IVF_LISTS', '100'))
+        op.execute(
+            f'CREATE INDEX {INDEX_NAME} ON document_embeddings '
+            f'USING ivfflat (embedding vector_cosine_ops) WITH (lists = {lists})'
+        )
+    else:
+        op.execute(
+            f'CREATE INDEX {INDEX_NAME} ON document_embeddings '
+            f'USING hnsw (embedding vector_cosine_ops)'
+        )
+
+
+def downgrade() -> None:
+    if not _pgvector_mode():
+        return
+    
+    op.execute(f'DROP INDEX IF EXISTS {INDEX_NAME}')
+    for table in EMBEDDING_TABLES:
+        op.execute(
+            f'ALTER TABLE {table} ALTER COLUMN embedding TYPE double precision[] '
+            f'USING embedding::real[]::double precision[]'
+        )
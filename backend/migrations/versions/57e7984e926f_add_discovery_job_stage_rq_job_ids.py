@@ -0,0 +1,24 @@
+"""Record the RQ jobs enqueued for a discovery job's stages
+
+Revision ID: 57e7984e926f
+Revises: a57a9b81fddf
+Create Date: 2026-10-18 09:14:37.602918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '57e7984e926f'
+down_revision = 'a57a9b81fddf'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('discovery_jobs', sa.Column('stage_rq_job_ids', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('discovery_jobs', 'stage_rq_job_ids')
@@ -0,0 +1,36 @@
+"""Add embedding cache
+
+Revision ID: 7b17c978e873
+Revises: c6e1f6ba155e
+Create Date: 2026-10-17 09:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b17c978e873'
+down_revision = 'c6e1f6ba155e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('embedding_cache',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('model', sa.String(length=100), nullable=False),
+    sa.Column('content_hash', sa.String(length=64), nullable=False),
+    sa.Column('embedding', sa.ARRAY(sa.Float()), nullable=True),
+    sa.Column('hit_count', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('last_used_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('model', 'content_hash', name='_embedding_cache_uc')
+    )
+    op.create_index(op.f('ix_embedding_cache_last_used_at'), 'embedding_cache', ['last_used_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_embedding_cache_last_used_at'), table_name='embedding_cache')
+    op.drop_table('embedding_cache')
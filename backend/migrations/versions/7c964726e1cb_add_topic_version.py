@@ -0,0 +1,24 @@
+"""Add a content version to topics
+
+Revision ID: 7c964726e1cb
+Revises: 8934cfccb18d
+Create Date: 2026-10-17 16:02:41.118530
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c964726e1cb'
+down_revision = '8934cfccb18d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('topics', sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade() -> None:
+    op.drop_column('topics', 'version')
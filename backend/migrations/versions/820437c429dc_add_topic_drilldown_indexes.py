@@ -0,0 +1,25 @@
+"""Index topic assignments by topic and relationships by target topic
+
+Revision ID: 820437c429dc
+Revises: 2724230232d6
+Create Date: 2026-10-17 18:41:07.503112
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '820437c429dc'
+down_revision = '2724230232d6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_document_topics_topic_id_relevance', 'document_topics', ['topic_id', 'relevance_score'], unique=False)
+    op.create_index(op.f('ix_topic_relationships_target_topic_id'), 'topic_relationships', ['target_topic_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_topic_relationships_target_topic_id'), table_name='topic_relationships')
+    op.drop_index('ix_document_topics_topic_id_relevance', table_name='document_topics')
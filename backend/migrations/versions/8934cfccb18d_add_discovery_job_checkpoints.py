@@ -0,0 +1,26 @@
+"""Add stage checkpoints to discovery jobs
+
+Revision ID: 8934cfccb18d
+Revises: 8b9facd67eb2
+Create Date: 2026-10-17 15:12:09.534871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8934cfccb18d'
+down_revision = '8b9facd67eb2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('discovery_jobs', sa.Column('incremental', sa.Boolean(), nullable=True))
+    op.add_column('discovery_jobs', sa.Column('checkpoints', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('discovery_jobs', 'checkpoints')
+    op.drop_column('discovery_jobs', 'incremental')
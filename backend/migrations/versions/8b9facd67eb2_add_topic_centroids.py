@@ -0,0 +1,35 @@
+"""Add persisted centroids to topics for incremental discovery
+
+Revision ID: 8b9facd67eb2
+Revises: c433c0dab3c1
+Create Date: 2026-10-17 14:02:41.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import os
+
+
+# revision identifiers, used by Alembic.
+revision = '8b9facd67eb2'
+down_revision = 'c433c0dab3c1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('topics', sa.Column('centroid', sa.ARRAY(sa.Float()), nullable=True))
+    op.add_column('topics', sa.Column('clustered_document_count', sa.Integer(), nullable=True))
+    
+    # Match the document embedding column type in pgvector mode
+    if os.getenv('EMBEDDING_STORAGE', 'array') == 'pgvector' and op.get_bind().dialect.name == 'postgresql':
+        dimensions = int(os.getenv('EMBEDDING_DIMENSIONS', '1536'))
+        op.execute(
+            f'ALTER TABLE topics ALTER COLUMN centroid TYPE vector({dimensions}) '
+            f'USING centroid::real[]::vector({dimensions})'
+        )
+
+
+def downgrade() -> None:
+    op.drop_column('topics', 'clustered_document_count')
+    op.drop_column('topics', 'centroid')
@@ -0,0 +1,23 @@
+"""Index documents by collection and ID for keyset pagination
+
+Revision ID: 9b6678b5e7d3
+Revises: 820437c429dc
+Create Date: 2026-10-17 19:12:53.274190
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9b6678b5e7d3'
+down_revision = '820437c429dc'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_documents_collection_id_id', 'documents', ['collection_id', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_documents_collection_id_id', table_name='documents')
@@ -0,0 +1,28 @@
+"""Record source file modification time and hash on documents
+
+Revision ID: a1a53f97b581
+Revises: 9b6678b5e7d3
+Create Date: 2026-10-17 19:40:22.861307
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1a53f97b581'
+down_revision = '9b6678b5e7d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('documents', sa.Column('file_mtime', sa.Float(), nullable=True))
+    op.add_column('documents', sa.Column('file_hash', sa.String(length=64), nullable=True))
+    op.create_index('ix_documents_collection_id_file_hash', 'documents', ['collection_id', 'file_hash'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_documents_collection_id_file_hash', table_name='documents')
+    op.drop_column('documents', 'file_hash')
+    op.drop_column('documents', 'file_mtime')
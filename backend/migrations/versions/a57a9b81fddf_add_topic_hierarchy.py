@@ -0,0 +1,32 @@
+"""Add parent topics, levels and expansion times for hierarchical topics
+
+Revision ID: a57a9b81fddf
+Revises: ed25d69eeec3
+Create Date: 2026-10-17 21:48:53.207164
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a57a9b81fddf'
+down_revision = 'ed25d69eeec3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('topics', sa.Column('parent_id', sa.Integer(), nullable=True))
+    op.add_column('topics', sa.Column('level', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('topics', sa.Column('expanded_at', sa.DateTime(), nullable=True))
+    op.create_foreign_key('fk_topics_parent_id', 'topics', 'topics', ['parent_id'], ['id'])
+    op.create_index(op.f('ix_topics_parent_id'), 'topics', ['parent_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_topics_parent_id'), table_name='topics')
+    op.drop_constraint('fk_topics_parent_id', 'topics', type_='foreignkey')
+    op.drop_column('topics', 'expanded_at')
+    op.drop_column('topics', 'level')
+    op.drop_column('topics', 'parent_id')
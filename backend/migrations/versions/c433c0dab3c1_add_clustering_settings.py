@@ -0,0 +1,30 @@
+"""Add clustering settings to collections and discovery jobs
+
+Revision ID: c433c0dab3c1
+Revises: 44b8b5c1f618
+Create Date: 2026-10-17 13:26:05.871342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c433c0dab3c1'
+down_revision = '44b8b5c1f618'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('collections', sa.Column('clustering_backend', sa.String(length=50), nullable=True))
+    op.add_column('collections', sa.Column('clustering_params', sa.JSON(), nullable=True))
+    op.add_column('discovery_jobs', sa.Column('clustering_backend', sa.String(length=50), nullable=True))
+    op.add_column('discovery_jobs', sa.Column('clustering_params', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('discovery_jobs', 'clustering_params')
+    op.drop_column('discovery_jobs', 'clustering_backend')
+    op.drop_column('collections', 'clustering_params')
+    op.drop_column('collections', 'clustering_backend')
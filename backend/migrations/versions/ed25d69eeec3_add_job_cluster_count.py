@@ -0,0 +1,26 @@
+"""Record the cluster count and silhouette score on discovery jobs
+
+Revision ID: ed25d69eeec3
+Revises: f5e24bd3a4a6
+Create Date: 2026-10-17 21:02:11.518304
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ed25d69eeec3'
+down_revision = 'f5e24bd3a4a6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('discovery_jobs', sa.Column('n_clusters', sa.Integer(), nullable=True))
+    op.add_column('discovery_jobs', sa.Column('silhouette_score', sa.Float(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('discovery_jobs', 'silhouette_score')
+    op.drop_column('discovery_jobs', 'n_clusters')
@@ -0,0 +1,44 @@
+"""Add MinHash signatures, LSH buckets and duplicate links for near-duplicate documents
+
+Revision ID: f5e24bd3a4a6
+Revises: a1a53f97b581
+Create Date: 2026-10-17 20:14:36.402718
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f5e24bd3a4a6'
+down_revision = 'a1a53f97b581'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('documents', sa.Column('minhash', sa.LargeBinary(), nullable=True))
+    op.add_column('documents', sa.Column('duplicate_of_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('fk_documents_duplicate_of_id', 'documents', 'documents', ['duplicate_of_id'], ['id'], ondelete='SET NULL')
+    op.create_index(op.f('ix_documents_duplicate_of_id'), 'documents', ['duplicate_of_id'], unique=False)
+    op.create_table('document_lsh_buckets',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('collection_id', sa.Integer(), nullable=False),
+    sa.Column('document_id', sa.Integer(), nullable=False),
+    sa.Column('bucket', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['collection_id'], ['collections.id'], ),
+    sa.ForeignKeyConstraint(['document_id'], ['documents.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_document_lsh_buckets_document_id'), 'document_lsh_buckets', ['document_id'], unique=False)
+    op.create_index('ix_document_lsh_buckets_collection_id_bucket', 'document_lsh_buckets', ['collection_id', 'bucket'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_document_lsh_buckets_collection_id_bucket', table_name='document_lsh_buckets')
+    op.drop_index(op.f('ix_document_lsh_buckets_document_id'), table_name='document_lsh_buckets')
+    op.drop_table('document_lsh_buckets')
+    op.drop_index(op.f('ix_documents_duplicate_of_id'), table_name='documents')
+    op.drop_constraint('fk_documents_duplicate_of_id', 'documents', type_='foreignkey')
+    op.drop_column('documents', 'duplicate_of_id')
+    op.drop_column('documents', 'minhash')
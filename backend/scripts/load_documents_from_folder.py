@@ -5,56 +5,10 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app import create_app, db
 from app.models import Collection
-from app.services.document_service import DocumentService
+from app.services.folder_loader import FolderLoader
 
-def extract_text_from_pdf(pdf_path):
-    """Extract text from PDF file"""
-    try:
-        # Try PyPDF2 first
-        try:
-            import PyPDF2
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-                return text
-        except ImportError:
-            pass
-        
-        # Try pdfplumber
-        try:
-            import pdfplumber
-            text = ""
-            with pdfplumber.open(pdf_path) as pdf:
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n"
-            return text
-        except ImportError:
-            pass
-        
-        # Fallback: try pypdf (newer name for PyPDF2)
-        try:
-            import pypdf
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = pypdf.PdfReader(file)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-                return text
-        except ImportError:
-            pass
-        
-        print(f"Warning: No PDF library found. Install PyPDF2, pdfplumber, or pypdf")
-        return None
-    except Exception as e:
-        print(f"Error extracting text from {pdf_path}: {str(e)}")
-        return None
-
-def load_documents_from_folder(collection_id=None, folder_path="/documents"):
-    """Load documents from the documents folder"""
+def load_documents_from_folder(collection_id=None, folder_path="/documents", workers=None):
+    """Load new and changed PDFs under the documents folder (recursively)"""
     app = create_app()
     with app.app_context():
         # Get or create collection
@@ -98,50 +52,17 @@ def load_documents_from_folder(collection_id=None, folder_path="/documents"):
         
         print(f"Loading documents from: {abs_folder_path}")
         
-        doc_service = DocumentService()
-        loaded_count = 0
-        failed_count = 0
-        
-        # Get all PDF files
-        pdf_files = [f for f in os.listdir(abs_folder_path) if f.lower().endswith('.pdf')]
-        print(f"Found {len(pdf_files)} PDF files")
-        
-        for filename in pdf_files:
-            file_path = os.path.join(abs_folder_path, filename)
-            try:
-                # Extract text from PDF
-                content = extract_text_from_pdf(file_path)
-                if not content or len(content.strip()) < 10:
-                    print(f"Skipping {filename}: No text extracted or too short")
-                    failed_count += 1
-                    continue
-                
-                # Remove null characters (PostgreSQL doesn't allow them)
-                content = content.replace('\x00', '').replace('\0', '')
-                
-                # Use filename as title (remove .pdf extension)
-                title = filename.replace('.pdf', '').replace('_', ' ').replace('-', ' ')
-                
-                # Add document
-                doc = doc_service.add_document(
-                    collection_id=collection.id,
-                    content=content,
-                    title=title,
-                    file_path=file_path,
-                    file_type='application/pdf'
-                )
-                loaded_count += 1
-                if loaded_count % 10 == 0:
-                    print(f"Loaded {loaded_count} documents...")
-                    
-            except Exception as e:
-                print(f"Failed to load {filename}: {str(e)}")
-                failed_count += 1
-                continue
+        loader = FolderLoader(workers=workers)
+        stats = loader.load(collection.id, abs_folder_path)
         
         print(f"\nCompleted!")
-        print(f"Successfully loaded: {loaded_count} documents")
-        print(f"Failed: {failed_count} documents")
+        print(f"Successfully loaded: {stats['loaded']} documents ({stats['replaced']} replacing changed files)")
+        print(f"Skipped (already loaded): {stats['unchanged']} documents")
+        print(f"Near-duplicates (stored, not embedded or clustered): {stats['duplicates']} documents")
+        print(f"Failed: {stats['failed']} documents, embedding failed: {stats['embedding_failed']}")
+        print(f"Throughput: {stats['files_per_second']} files/s over {stats['seconds']}s")
+        cache_stats = loader.document_service.embedding_cache.stats()
+        print(f"Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
         print(f"Collection ID: {collection.id}")
         return collection.id
 
@@ -150,7 +71,8 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Load documents from folder')
     parser.add_argument('--collection-id', type=int, help='Collection ID to add documents to (creates new if not provided)')
     parser.add_argument('--folder', default='../documents', help='Path to documents folder')
+    parser.add_argument('--workers', type=int, help='PDF extraction processes (default: LOADER_WORKERS or CPU count)')
     args = parser.parse_args()
     
-    load_documents_from_folder(args.collection_id, args.folder)
+    load_documents_from_folder(args.collection_id, args.folder, args.workers)
 
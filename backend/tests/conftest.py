@@ -5,7 +5,7 @@ from app.models import Collection, Document, Topic, DocumentTopic, TopicRelation
 @pytest.fixture
 def app():
     """Create application for testing"""
-    app = create_app()
+    app = create_app('testing')
     app.config['TESTING'] = True
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
     app.config['SECRET_KEY'] = 'test-secret-key'
@@ -40,6 +40,30 @@ def test_list_documents(client, sample_collection, sample_documents):
     assert response.status_code == 200
     assert len(response.json) >= len(sample_documents)
 
+def test_list_documents_paginates_with_cursor(client, sample_collection, sample_documents, sample_topics):
+    """Test document listing pages by ID with X-Next-Cursor, and collection counts come from SQL"""
+    url = f'/collections/{sample_collection.id}/documents'
+    ids = []
+    response = client.get(f'{url}?limit=2')
+    pages = 1
+    while True:
+        assert response.status_code == 200
+        ids += [doc['id'] for doc in response.json]
+        cursor = response.headers.get('X-Next-Cursor')
+        if cursor is None:
+            break
+        response = client.get(f'{url}?limit=2&cursor={cursor}')
+        pages += 1
+    assert ids == [doc.id for doc in sample_documents]
+    assert pages == 3
+    assert client.get(f'{url}?cursor=abc').status_code == 400
+    
+    response = client.get(f'/collections/{sample_collection.id}')
+    assert response.json['document_count'] == len(sample_documents)
+    assert response.json['topic_count'] == len(sample_topics)
+    listed = {c['id']: c for c in client.get('/collections').json}
+    assert listed[sample_collection.id]['document_count'] == len(sample_documents)
+
 def test_get_topic_graph(client, sample_collection, sample_topics):
     """Test getting topic graph"""
     # Create a relationship
@@ -67,6 +91,37 @@ def test_get_topic_detail(client, sample_topics):
     assert response.json['id'] == sample_topics[0].id
     assert 'documents' in response.json
 
+def test_get_topic_detail_pages_documents(client, sample_documents, sample_topics):
+    """Test topic drill-down pages documents by relevance with previews and finds related topics in both directions"""
+    from app import db
+    from app.models import TopicRelationship
+    topic = sample_topics[1]
+    for i, doc in enumerate(sample_documents):
+        db.session.add(DocumentTopic(document_id=doc.id, topic_id=topic.id, relevance_score=i / 10, is_primary=True))
+    db.session.add(TopicRelationship(source_topic_id=sample_topics[0].id, target_topic_id=topic.id,
+                                     similarity_score=0.3, relationship_type='RELATED'))
+    db.session.add(TopicRelationship(source_topic_id=topic.id, target_topic_id=sample_topics[2].id,
+                                     similarity_score=0.6, relationship_type='SIMILAR'))
+    db.session.commit()
+    
+    response = client.get(f'/topics/{topic.id}?per_page=2')
+    assert response.status_code == 200
+    assert [doc['id'] for doc in response.json['documents']] == [sample_documents[4].id, sample_documents[3].id]
+    assert response.json['documents'][0]['content_preview'] == sample_documents[4].content[:200]
+    assert response.json['documents_page'] == {'page': 1, 'per_page': 2, 'has_more': True}
+    assert [rt['id'] for rt in response.json['related_topics']] == [sample_topics[2].id, sample_topics[0].id]
+    
+    response = client.get(f'/topics/{topic.id}?per_page=2&page=3')
+    assert [doc['id'] for doc in response.json['documents']] == [sample_documents[0].id]
+    assert response.json['documents_page']['has_more'] is False
+    
+    response = client.get(f'/topics/{topic.id}', headers={'HX-Request': 'true'})
+    assert response.status_code == 200
+    assert 'Load more documents' not in response.get_data(as_text=True)
+    response = client.get(f'/topics/{topic.id}/documents?page=2&per_page=2')
+    assert 'Load more documents' in response.get_data(as_text=True)
+    assert f'id="doc-{sample_documents[2].id}"' in response.get_data(as_text=True)
+
 def test_health_endpoint(client):
     """Test health endpoint"""
     response = client.get('/jobs/health')
@@ -85,3 +140,200 @@ def test_get_discovery_status(client, sample_collection):
     # May return 404 if no job exists, which is acceptable
     assert response.status_code in [200, 404]
 
+
+def test_metrics_endpoint(client):
+    """Test metrics endpoint"""
+    response = client.get('/jobs/metrics')
+    assert response.status_code == 200
+    assert 'hit_rate' in response.json['embedding_cache']
+    assert 'pool_saturation' in response.json['genai_http']
+    assert 'throttled_responses' in response.json['genai_rate_limit']
+    assert 'hit_rate' in response.json['qa_cache']
+
+def test_start_discovery_rejects_unknown_clustering_backend(client, sample_collection):
+    """Test per-job clustering backend validation"""
+    response = client.post(f'/collections/{sample_collection.id}/discover', json={'clustering_backend': 'spectral'})
+    assert response.status_code == 400
+
+def test_create_collection_with_clustering_backend(client):
+    """Test collection-level clustering defaults"""
+    data = {'name': 'Large Collection', 'clustering_backend': 'minibatch', 'clustering_params': {'reduction': 'pca'}}
+    response = client.post('/collections', json=data)
+    assert response.status_code == 201
+    assert response.json['clustering_backend'] == 'minibatch'
+
+def test_resume_completed_job_rejected(client, sample_collection):
+    """Test only unfinished jobs can be resumed"""
+    from app import db
+    from app.models import DiscoveryJob, JobStatus
+    job = DiscoveryJob(collection_id=sample_collection.id, status=JobStatus.SUCCEEDED, checkpoints={'embed': {}})
+    db.session.add(job)
+    db.session.commit()
+    
+    response = client.post(f'/jobs/{job.id}/resume')
+    assert response.status_code == 409
+    assert client.get(f'/jobs/{job.id}').json['checkpoints'] == {'embed': {}}
+
+def test_resume_only_failed_or_interrupted_jobs(client, sample_collection, monkeypatch):
+    """Test a job is only resumed once none of its RQ jobs is queued or running"""
+    from app import db, queue as app_queue
+    from app.models import DiscoveryJob, JobStatus
+    
+    class FakeRQJob:
+        def __init__(self, job_id, status):
+            self.id = job_id
+            self.status = status
+        
+        def get_status(self):
+            return self.status
+    
+    class FakeQueue:
+        def __init__(self):
+            self.jobs = {
+                'rq-live': FakeRQJob('rq-live', 'started'),
+                'rq-done': FakeRQJob('rq-done', 'finished'),
+                'rq-stage': FakeRQJob('rq-stage', 'started'),
+                'rq-finalize': FakeRQJob('rq-finalize', 'deferred')
+            }
+        
+        def fetch_job(self, job_id):
+            return self.jobs.get(job_id)
+        
+        def enqueue(self, func, *args, **kwargs):
+            return FakeRQJob('rq-resumed', 'queued')
+    
+    monkeypatch.setattr(app_queue, 'get_queue', lambda: FakeQueue())
+    running = DiscoveryJob(collection_id=sample_collection.id, status=JobStatus.RUNNING, rq_job_id='rq-live')
+    lost = DiscoveryJob(collection_id=sample_collection.id, status=JobStatus.RUNNING, rq_job_id='rq-lost')
+    failed = DiscoveryJob(collection_id=sample_collection.id, status=JobStatus.FAILED, checkpoints={'embed': {}})
+    pending = DiscoveryJob(collection_id=sample_collection.id, status=JobStatus.PENDING)
+    # The discovery job finished after enqueueing its stages, which are still live
+    staged = DiscoveryJob(collection_id=sample_collection.id, status=JobStatus.RUNNING, rq_job_id='rq-done',
+                          stage_rq_job_ids={'relate': 'rq-stage', 'finalize': 'rq-finalize'})
+    db.session.add_all([running, lost, failed, pending, staged])
+    db.session.commit()
+    
+    assert client.post(f'/jobs/{running.id}/resume').status_code == 409
+    assert client.post(f'/jobs/{pending.id}/resume').status_code == 409
+    assert client.post(f'/jobs/{staged.id}/resume').status_code == 409
+    for job in (lost, failed):
+        response = client.post(f'/jobs/{job.id}/resume')
+        assert response.status_code == 202
+        assert response.json['rq_job_id'] == 'rq-resumed'
+        assert response.json['status'] == 'PENDING'
+
+def test_topic_qa_stream(client, sample_topics, monkeypatch):
+    """Test streamed Q&A is sent as Server-Sent Events"""
+    from app.routes import topics
+    events = [('token', {'text': 'Line one\nline two'}), ('done', {'answer': 'Line one\nline two'})]
+    monkeypatch.setattr(topics.qa_service, 'answer_stream', lambda topic, question: iter(events))
+    
+    response = client.post(f'/topics/{sample_topics[0].id}/qa/stream', json={'question': 'Why?'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    assert response.get_data(as_text=True) == (
+        'event: token\ndata: {"text": "Line one\\nline two"}\n\n'
+        'event: done\ndata: {"answer": "Line one\\nline two"}\n\n'
+    )
+    
+    response = client.post(f'/topics/{sample_topics[0].id}/qa/stream', json={})
+    assert response.status_code == 400
+
+def test_topic_graph_snapshot_is_etag_validated(client, sample_collection, sample_topics, monkeypatch):
+    """Test the graph is served from the job version's snapshot with ETag revalidation and gzip"""
+    import gzip
+    from collections import OrderedDict
+    from datetime import datetime
+    from app import db
+    from app.models import DiscoveryJob, JobStatus
+    from app.services import graph_snapshot
+    from app.services.graph_snapshot import GraphSnapshotStore
+    monkeypatch.setattr(graph_snapshot, 'get_redis', lambda: None)
+    monkeypatch.setattr(GraphSnapshotStore, '_local', OrderedDict())
+    
+    url = f'/collections/{sample_collection.id}/topics/graph'
+    job = DiscoveryJob(collection_id=sample_collection.id, status=JobStatus.SUCCEEDED, completed_at=datetime.utcnow())
+    db.session.add(job)
+    db.session.commit()
+    
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(json.loads(gzip.decompress(response.data))['nodes']) == len(sample_topics)
+    etag = response.headers['ETag']
+    
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+    
+    # Topics changed outside a job are picked up with the next completed job
+    db.session.add(Topic(collection_id=sample_collection.id, name='New Topic'))
+    db.session.commit()
+    assert len(client.get(url).json['nodes']) == len(sample_topics)
+    
+    job.completed_at = datetime.utcnow()
+    db.session.commit()
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert len(response.json['nodes']) == len(sample_topics) + 1
+    assert response.headers['ETag'] != etag
+    
+    response = client.get(f'/collections/{sample_collection.id}/graph')
+    assert response.status_code == 200
+    not_modified = client.get(f'/collections/{sample_collection.id}/graph',
+                              headers={'If-None-Match': response.headers['ETag'], 'Accept-Encoding': 'gzip'})
+    assert not_modified.status_code == 304
+    assert not_modified.headers['ETag'] == response.headers['ETag']
+    assert 'no-cache' in not_modified.headers['Cache-Control']
+    assert 'Content-Encoding' not in not_modified.headers and not_modified.data == b''
+
+def test_subtopic_graph_enqueues_expansion(client, sample_collection, sample_topics, monkeypatch):
+    """Test an unexpanded topic's level is expanded in the background while clients poll"""
+    from collections import OrderedDict
+    from datetime import datetime
+    from app import db
+    from app.routes import topics
+    from app.services import graph_snapshot
+    from app.services.graph_snapshot import GraphSnapshotStore
+    monkeypatch.setattr(graph_snapshot, 'get_redis', lambda: None)
+    monkeypatch.setattr(GraphSnapshotStore, '_local', OrderedDict())
+    
+    class FakeQueue:
+        def __init__(self):
+            self.enqueued = []
+        
+        def fetch_job(self, job_id):
+            return None
+        
+        def enqueue(self, func, *args, **kwargs):
+            self.enqueued.append((func.__name__, args, kwargs.get('job_id')))
+    
+    queue = FakeQueue()
+    monkeypatch.setattr(topics, 'get_queue', lambda: queue)
+    topic = sample_topics[0]
+    topic.document_count = 50
+    db.session.commit()
+    
+    response = client.get(f'/topics/{topic.id}/graph')
+    assert response.status_code == 202
+    assert response.json['status'] == 'pending'
+    assert response.json['parent']['id'] == f't{topic.id}'
+    assert queue.enqueued == [('expand_topic_job', (topic.id,), f'expand-topic-{topic.id}')]
+    
+    topic.expanded_at = datetime.utcnow()
+    db.session.commit()
+    response = client.get(f'/topics/{topic.id}/graph')
+    assert response.status_code == 200
+    assert response.json['nodes'] == []
+    assert len(queue.enqueued) == 1
+    etag = response.headers['ETag']
+    
+    # The stored level is served until the topic is expanded again
+    builds = []
+    build_subgraph = topics.graph_snapshots.build_subgraph
+    monkeypatch.setattr(topics.graph_snapshots, 'build_subgraph', lambda t: builds.append(t.id) or build_subgraph(t))
+    assert client.get(f'/topics/{topic.id}/graph', headers={'If-None-Match': etag}).status_code == 304
+    assert builds == []
+    
+    topic.expanded_at = datetime.utcnow()
+    db.session.commit()
+    assert client.get(f'/topics/{topic.id}/graph').status_code == 200
+    assert builds == [topic.id]
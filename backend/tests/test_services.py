@@ -49,3 +49,784 @@ def test_insight_service_structure(app):
         service = InsightService()
         assert service.genai is not None
 
+
+def test_embedding_batches_respect_token_budget():
+    """Test token-budgeted embedding batches"""
+    from app.services.genai_service import GenAIService
+    genai = GenAIService()
+    genai.embedding_batch_max_tokens = 100
+    genai.embedding_batch_max_inputs = 3
+    texts = ['x' * 200] * 5 + ['y' * 4] * 4
+    batches = genai.batch_by_token_budget(texts)
+    assert sorted(i for batch in batches for i in batch) == list(range(len(texts)))
+    for batch in batches:
+        assert len(batch) <= 3
+        assert len(batch) == 1 or sum(genai.estimate_tokens(texts[i]) for i in batch) <= 100
+
+def test_document_service_ingest_reports_failures(app, sample_collection):
+    """Test bulk ingestion reports per-document failures"""
+    with app.app_context():
+        service = DocumentService()
+        result = service.ingest_documents(sample_collection.id, [
+            {'content': 'Content 1', 'title': 'Doc 1'},
+            {'title': 'Missing content'},
+            {'content': 'Content 3'}
+        ])
+        assert len(result['document_ids']) == 2
+        assert result['failed'] == [{'index': 1, 'error': 'Document content must be a string'}]
+        assert result['documents'][1].title == 'Content 3'
+
+def test_embedding_cache_reuses_embeddings(app):
+    """Test re-embedding seen text costs no API calls"""
+    from app.services.embedding_cache import EmbeddingCache
+    with app.app_context():
+        cache = EmbeddingCache()
+        calls = []
+        def fake_batch(texts):
+            calls.append(list(texts))
+            return [[float(len(text)), 1.0] for text in texts]
+        cache.genai.get_embeddings_batch = fake_batch
+        
+        first = cache.get_embeddings(['alpha', 'beta', 'alpha'])
+        assert calls == [['alpha', 'beta']]
+        assert first[0] == first[2]
+        
+        second = cache.get_embeddings(['beta', 'alpha'])
+        assert len(calls) == 1
+        assert second == [first[1], first[0]]
+        assert cache.stats()['entries'] == 2
+
+def test_embedding_cache_evicts_least_recently_used(app):
+    """Test size-bounded cache eviction"""
+    from app.services.embedding_cache import EmbeddingCache
+    with app.app_context():
+        cache = EmbeddingCache()
+        cache.max_entries = 10
+        cache.genai.get_embeddings_batch = lambda texts: [[1.0, 0.0] for _ in texts]
+        cache.get_embeddings([f'text {i}' for i in range(12)])
+        assert cache.stats()['entries'] <= 10
+
+def test_embedding_store_load_matrix_backfills(app, sample_collection, sample_documents):
+    """Test bulk embedding load backfills missing embeddings in one batch"""
+    import numpy as np
+    from app.services.embedding_store import EmbeddingStore
+    with app.app_context():
+        store = EmbeddingStore()
+        calls = []
+        def fake_batch(texts):
+            calls.append(len(texts))
+            return [[float(i), 1.0, 0.5] for i in range(len(texts))]
+        store.genai.get_embeddings_batch = fake_batch
+        
+        doc_ids, matrix = store.load_matrix(sample_collection.id)
+        assert doc_ids == sorted(doc.id for doc in sample_documents)
+        assert matrix.dtype == np.float32
+        assert matrix.shape == (len(sample_documents), 3)
+        assert calls == [len(sample_documents)]
+        
+        # Second load is served entirely from the database
+        doc_ids_again, matrix_again = store.load_matrix(sample_collection.id)
+        assert calls == [len(sample_documents)]
+        assert np.array_equal(matrix, matrix_again)
+
+def test_embedding_store_nearest_documents(app, sample_collection, sample_documents):
+    """Test k-NN document lookup (NumPy fallback on SQLite)"""
+    from app.services.embedding_store import EmbeddingStore
+    with app.app_context():
+        store = EmbeddingStore()
+        vectors = [[1.0, 0.0], [0.0, 1.0], [0.7, 0.7], [-1.0, 0.0], [0.9, 0.1]]
+        store.save({doc.id: vec for doc, vec in zip(sample_documents, vectors)})
+        
+        nearest = store.nearest_documents([1.0, 0.0], k=2, collection_id=sample_collection.id)
+        assert [doc_id for doc_id, _ in nearest] == [sample_documents[0].id, sample_documents[4].id]
+        assert nearest[0][1] > nearest[1][1]
+        
+        subset = store.nearest_documents([0.0, 1.0], k=1, document_ids=[sample_documents[2].id, sample_documents[3].id])
+        assert subset[0][0] == sample_documents[2].id
+
+def test_topic_index_uses_ann_index_for_document_vectors(app, sample_collection, sample_documents, monkeypatch):
+    """Test Q&A retrieval goes through nearest_documents (filtered by topic) when the ANN index is enabled"""
+    from app import db
+    from app.models import Topic, DocumentTopic
+    from app.services.embedding_store import EmbeddingStore
+    from app.services.topic_index import TopicVectorIndex
+    with app.app_context():
+        store = EmbeddingStore(representation='document')
+        store.save({doc.id: vec for doc, vec in zip(sample_documents, [[1.0, 0.0], [0.0, 1.0], [0.7, 0.7], [-1.0, 0.0], [0.9, 0.1]])})
+        topic = Topic(collection_id=sample_collection.id, name='T')
+        db.session.add(topic)
+        db.session.flush()
+        for doc in sample_documents[1:4]:
+            db.session.add(DocumentTopic(document_id=doc.id, topic_id=topic.id, is_primary=True))
+        db.session.commit()
+        
+        # Only the topic's members are ranked
+        assert [doc_id for doc_id, _ in store.nearest_documents([1.0, 0.0], k=2, topic_id=topic.id)] == \
+            [sample_documents[2].id, sample_documents[1].id]
+        
+        calls = []
+        def nearest(query_vec, **kwargs):
+            calls.append(kwargs)
+            return [(sample_documents[2].id, 0.9)]
+        monkeypatch.setattr(store, 'uses_index', lambda: True)
+        monkeypatch.setattr(store, 'nearest_documents', nearest)
+        hits = TopicVectorIndex(store).search(topic, [1.0, 0.0], 1)
+        assert hits[0][:2] == (sample_documents[2].id, None)
+        assert calls == [{'k': 1, 'topic_id': topic.id}]
+
+def test_clustering_engine_streaming_matches_full_fit():
+    """Test streaming MiniBatchKMeans recovers the same clusters as full KMeans"""
+    import numpy as np
+    from app.services.clustering import ClusteringEngine
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(3, 32))
+    true_labels = np.repeat(np.arange(3), 40)
+    matrix = (centers[true_labels] + rng.normal(scale=0.05, size=(120, 32))).astype(np.float32)
+    doc_ids = list(range(1, 121))
+    
+    full = ClusteringEngine(backend='kmeans').fit(doc_ids, matrix, 3)
+    streamed = ClusteringEngine(backend='minibatch', reduction='pca', n_components=8, batch_size=32).fit_stream(
+        lambda: ((doc_ids[i:i + 25], matrix[i:i + 25]) for i in range(0, 120, 25)), 3
+    )
+    assert streamed['doc_ids'] == doc_ids
+    for result in (full, streamed):
+        # Same partition up to label permutation
+        assert len({(t, l) for t, l in zip(true_labels, result['labels'])}) == 3
+        assert result['centroids'].shape == (3, 32)
+        assert result['similarities'].min() > 0.9
+
+def test_clustering_engine_selects_cluster_count():
+    """Test automatic cluster-count selection recovers well-separated clusters beyond 10"""
+    import numpy as np
+    from app.services.clustering import ClusteringEngine
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(16, 32)) * 5
+    true_labels = np.repeat(np.arange(16), 30)
+    matrix = (centers[true_labels] + rng.normal(scale=0.1, size=(480, 32))).astype(np.float32)
+    doc_ids = list(range(1, 481))
+    
+    engine = ClusteringEngine(backend='kmeans', n_clusters='auto', max_clusters=64, k_candidates=16, sample_size=200)
+    assert engine.candidate_counts(3) == [2]
+    result = engine.fit(doc_ids, matrix)
+    assert result['n_clusters'] == 16
+    assert result['silhouette_score'] > 0.5
+    assert len({(t, l) for t, l in zip(true_labels, result['labels'])}) == 16
+    
+    fixed = ClusteringEngine(backend='kmeans', n_clusters=4).fit(doc_ids, matrix)
+    assert fixed['n_clusters'] == 4 and fixed['silhouette_score'] is None
+
+def test_clustering_engine_rejects_unknown_backend():
+    """Test clustering backend validation"""
+    from app.services.clustering import ClusteringEngine
+    with pytest.raises(ValueError):
+        ClusteringEngine(backend='spectral')
+    with pytest.raises(ValueError):
+        ClusteringEngine(reduction='tsne')
+
+def test_incremental_discovery_assigns_new_documents(app, sample_collection, sample_documents):
+    """Test incremental discovery assigns new documents to persisted centroids without the LLM"""
+    from app import db
+    from app.models import Topic, DocumentTopic
+    with app.app_context():
+        service = TopicDiscoveryService()
+        def no_llm(*args, **kwargs):
+            raise AssertionError('LLM called')
+        service.genai.chat_completion = no_llm
+        vectors = [[1.0, 0.0], [0.9, 0.1], [0.0, 1.0], [0.1, 0.9], [0.8, 0.2]]
+        service.embedding_store.save({doc.id: vec for doc, vec in zip(sample_documents, vectors)})
+        
+        topics = [
+            Topic(collection_id=sample_collection.id, name='X', cluster_id=0, document_count=2,
+                  clustered_document_count=2, centroid=[0.95, 0.05], avg_confidence=0.99),
+            Topic(collection_id=sample_collection.id, name='Y', cluster_id=1, document_count=2,
+                  clustered_document_count=2, centroid=[0.05, 0.95], avg_confidence=0.99)
+        ]
+        db.session.add_all(topics)
+        db.session.flush()
+        for doc, topic in zip(sample_documents[:4], [topics[0], topics[0], topics[1], topics[1]]):
+            db.session.add(DocumentTopic(document_id=doc.id, topic_id=topic.id, relevance_score=0.99, is_primary=True))
+        db.session.commit()
+        
+        result = service.discover_topics(sample_collection.id, incremental=True)
+        assert result['reclustered'] is False
+        assert result['assigned_documents'] == 1
+        assignment = DocumentTopic.query.filter_by(document_id=sample_documents[4].id).one()
+        assert assignment.topic_id == topics[0].id
+        assert topics[0].document_count == 3
+        assert topics[0].centroid[0] == pytest.approx((0.95 * 2 + 0.8) / 3)
+        assert topics[1].centroid == pytest.approx([0.05, 0.95])
+
+def test_topic_hierarchy_expands_lazily(app, sample_collection):
+    """Test a topic is split into named sub-topics on first expansion only"""
+    from app import db
+    from app.models import Topic, Document, DocumentTopic
+    from app.services.graph_snapshot import GraphSnapshotStore
+    with app.app_context():
+        docs = [Document(collection_id=sample_collection.id, title=f'Doc {i}', content=f'Content {i}') for i in range(24)]
+        db.session.add_all(docs)
+        topic = Topic(collection_id=sample_collection.id, name='Parent', cluster_id=0, document_count=24)
+        db.session.add(topic)
+        db.session.flush()
+        centers = [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]]
+        store = GraphSnapshotStore()
+        hierarchy = store.hierarchy
+        hierarchy.topic_discovery.embedding_store.save({
+            doc.id: [c + 0.01 * (i % 4) for c in centers[i % 3]] for i, doc in enumerate(docs)
+        })
+        for doc in docs:
+            db.session.add(DocumentTopic(document_id=doc.id, topic_id=topic.id, relevance_score=0.9, is_primary=True))
+        # A secondary member is primary elsewhere: it is neither split into sub-topics nor used for naming
+        secondary = Document(collection_id=sample_collection.id, title='Loose', content='Loosely related')
+        db.session.add(secondary)
+        db.session.flush()
+        hierarchy.topic_discovery.embedding_store.save({secondary.id: [1.0, 0.0, 0.0]})
+        db.session.add(DocumentTopic(document_id=secondary.id, topic_id=topic.id, relevance_score=0.4, is_primary=False))
+        db.session.commit()
+        assert secondary.id not in [doc.id for doc in hierarchy.topic_discovery._sample_documents(topic.id, limit=30)]
+        
+        calls = []
+        def fake_chat_completions(conversations, **kwargs):
+            calls.append(len(conversations))
+            return [f'Sub {i}' for i in range(len(conversations))]
+        hierarchy.topic_discovery.genai.chat_completions = fake_chat_completions
+        
+        assert not hierarchy.is_materialized(topic)
+        hierarchy.expand(topic)
+        assert hierarchy.is_materialized(topic)
+        graph = store.build_subgraph(topic)
+        assert graph['parent']['id'] == f't{topic.id}'
+        assert sorted(node['document_count'] for node in graph['nodes']) == [8, 8, 8]
+        assert {node['label'] for node in graph['nodes']} == {'Sub 0', 'Sub 1', 'Sub 2'}
+        assert all(node['level'] == 1 and not node['expandable'] for node in graph['nodes'])
+        assert topic.expanded_at is not None
+        assert DocumentTopic.query.filter(
+            DocumentTopic.document_id == secondary.id, DocumentTopic.topic_id != topic.id
+        ).count() == 0
+        
+        # A second expansion reads the stored level without clustering or naming again
+        assert len(hierarchy.expand(topic)) == 3
+        assert len(store.build_subgraph(topic)['nodes']) == 3
+        assert calls == [3]
+        
+        # Collection-level views only see the top level
+        assert [node['id'] for node in store.build_graph(sample_collection.id)['nodes']] == [f't{topic.id}']
+        hierarchy.topic_discovery._delete_topics([topic.id])
+        db.session.commit()
+        assert Topic.query.count() == 0
+
+def test_soft_assignment_records_secondary_topics(app, sample_collection, sample_documents):
+    """Test documents between clusters also join the other topic, and relationships count the overlap"""
+    from app.models import DocumentTopic
+    from app.services.clustering import ClusteringEngine
+    from app.services.relationship_service import RelationshipService
+    with app.app_context():
+        service = TopicDiscoveryService()
+        vectors = [[1.0, 0.2], [1.0, 0.2], [0.2, 1.0], [0.2, 1.0], [0.7, 0.7]]
+        service.embedding_store.save({doc.id: vec for doc, vec in zip(sample_documents, vectors)})
+        
+        result = service.cluster_topics(sample_collection.id, clustering=ClusteringEngine(backend='kmeans', n_clusters=2))
+        assert len(result['topics']) == 2
+        assert DocumentTopic.query.filter_by(is_primary=True).count() == 5
+        secondary = DocumentTopic.query.filter_by(is_primary=False).all()
+        assert [assignment.document_id for assignment in secondary] == [sample_documents[4].id]
+        assert secondary[0].relevance_score >= service.soft_min_similarity
+        
+        relationships = RelationshipService().build_relationships(sample_collection.id)
+        assert [relationship.common_document_count for relationship in relationships] == [1]
+        
+        # Secondary members are scored but do not move the topic centroids
+        primary_scores = {row.id: row.relevance_score for row in DocumentTopic.query.filter_by(is_primary=True)}
+        service.calculate_relevance_scores(sample_collection.id)
+        rescored = {row.id: row.relevance_score for row in DocumentTopic.query.populate_existing().filter_by(is_primary=True)}
+        assert rescored == pytest.approx(primary_scores)
+
+def test_incremental_discovery_reclusters_on_drift(app, sample_collection, sample_documents):
+    """Test incremental discovery falls back to re-clustering when new documents drift"""
+    from app import db
+    from app.models import Topic, DocumentTopic
+    with app.app_context():
+        service = TopicDiscoveryService()
+        service.embedding_store.save({doc.id: [1.0, 0.0] for doc in sample_documents[:4]})
+        service.embedding_store.save({sample_documents[4].id: [0.6, 0.8]})
+        
+        topic = Topic(collection_id=sample_collection.id, name='X', cluster_id=0, document_count=4,
+                      clustered_document_count=4, centroid=[1.0, 0.0], avg_confidence=1.0)
+        db.session.add(topic)
+        db.session.flush()
+        for doc in sample_documents[:4]:
+            db.session.add(DocumentTopic(document_id=doc.id, topic_id=topic.id, relevance_score=1.0, is_primary=True))
+        db.session.commit()
+        
+        assert service.assign_new_documents(sample_collection.id) is None
+
+def test_insight_batch_isolates_concurrent_failures(app, sample_topics):
+    """Test concurrent insight generation keeps per-topic failures isolated"""
+    import json
+    with app.app_context():
+        service = InsightService()
+        service.genai.llm_concurrency = 3
+        def fake_chat(messages, **kwargs):
+            if '"Topic 2"' in messages[1]['content']:
+                raise Exception('rate limited')
+            return json.dumps({'summary': 'ok', 'themes': ['a'], 'common_questions': [], 'related_concepts': []})
+        service.genai.chat_completion = fake_chat
+        
+        insights = service.generate_insights_batch([topic.id for topic in sample_topics])
+        assert [insight.topic_id for insight in insights] == [topic.id for topic in sample_topics]
+        assert [insight.summary for insight in insights] == ['ok', 'Topic: Topic 2', 'ok']
+
+def test_relationship_service_builds_relationships_in_bulk(app, sample_collection, sample_documents, sample_topics):
+    """Test vectorized relationship building and upsert"""
+    from app import db
+    from app.models import DocumentTopic, Topic, TopicRelationship
+    with app.app_context():
+        service = RelationshipService()
+        sample_topics[0].centroid = [1.0, 0.0]
+        sample_topics[1].centroid = [0.8, 0.6]
+        # Topic 3 has no stored centroid: it is the mean of its documents' embeddings
+        service.embedding_store.save({sample_documents[3].id: [0.0, 1.0], sample_documents[4].id: [0.0, 1.0]})
+        for doc, topic in [(0, 0), (1, 0), (1, 1), (2, 1), (3, 2), (4, 2)]:
+            db.session.add(DocumentTopic(document_id=sample_documents[doc].id, topic_id=sample_topics[topic].id))
+        db.session.commit()
+        
+        relationships = service.build_relationships(sample_collection.id)
+        pairs = {(r.source_topic_id, r.target_topic_id): r for r in relationships}
+        assert set(pairs) == {(sample_topics[0].id, sample_topics[1].id), (sample_topics[1].id, sample_topics[2].id)}
+        first = pairs[(sample_topics[0].id, sample_topics[1].id)]
+        assert first.similarity_score == pytest.approx(0.8)
+        assert first.relationship_type == 'STRONGLY_RELATED'
+        assert first.common_document_count == 1
+        assert pairs[(sample_topics[1].id, sample_topics[2].id)].relationship_type == 'RELATED'
+        
+        # Rebuilding updates rows in place
+        service.build_relationships(sample_collection.id)
+        assert TopicRelationship.query.count() == 2
+        
+        # A pair that falls below the threshold loses its relationship
+        db.session.get(Topic, sample_topics[1].id).centroid = [-1.0, 0.1]
+        db.session.commit()
+        relationships = service.build_relationships(sample_collection.id)
+        assert relationships == []
+        assert TopicRelationship.query.count() == 0
+
+def test_calculate_relevance_scores_vectorized(app, sample_collection, sample_documents, sample_topics):
+    """Test relevance scores are cosine similarities to each topic's mean embedding"""
+    import numpy as np
+    from app import db
+    from app.models import DocumentTopic, Topic
+    with app.app_context():
+        service = TopicDiscoveryService()
+        vectors = [[1.0, 0.0], [0.6, 0.8], [0.0, 1.0], [1.0, 1.0], [-1.0, 0.5]]
+        service.embedding_store.save({doc.id: vec for doc, vec in zip(sample_documents, vectors)})
+        members = {0: [0, 1, 3], 1: [1, 2], 2: [4]}
+        for topic, docs in members.items():
+            for doc in docs:
+                db.session.add(DocumentTopic(document_id=sample_documents[doc].id, topic_id=sample_topics[topic].id))
+        db.session.commit()
+        
+        service.calculate_relevance_scores(sample_collection.id)
+        for topic, docs in members.items():
+            centroid = np.mean([vectors[doc] for doc in docs], axis=0)
+            expected = [service.genai.cosine_similarity(centroid, vectors[doc]) for doc in docs]
+            actual = [DocumentTopic.query.filter_by(document_id=sample_documents[doc].id,
+                                                    topic_id=sample_topics[topic].id).one().relevance_score for doc in docs]
+            assert actual == pytest.approx(expected)
+            assert db.session.get(Topic, sample_topics[topic].id).avg_confidence == pytest.approx(np.mean(expected))
+
+def test_discovery_job_resumes_after_failed_stage(app, sample_collection, sample_documents):
+    """Test a failed job keeps its checkpoints and resumes without repeating paid stages"""
+    import json
+    from app.models import DiscoveryJob, JobStatus
+    from app.services.discovery_job import DiscoveryJobService
+    with app.app_context():
+        service = DiscoveryJobService()
+        vectors = [[1.0, 0.0], [0.9, 0.1], [0.0, 1.0], [0.1, 0.9], [0.95, 0.05]]
+        service.topic_discovery.embedding_store.save({doc.id: vec for doc, vec in zip(sample_documents, vectors)})
+        
+        name_calls = []
+        def fake_name(messages, **kwargs):
+            name_calls.append(1)
+            return 'Named Topic'
+        service.topic_discovery.genai.chat_completion = fake_name
+        def failing_insights(topic_ids):
+            raise Exception('insights down')
+        service.insight_service.generate_insights_batch = failing_insights
+        
+        with pytest.raises(Exception):
+            service.run_discovery(sample_collection.id)
+        job = DiscoveryJob.query.filter_by(collection_id=sample_collection.id).one()
+        assert job.status == JobStatus.FAILED
+        assert set(job.checkpoints) == {'embed', 'cluster', 'name', 'relate'}
+        assert len(name_calls) == 2
+        
+        del service.insight_service.generate_insights_batch
+        service.insight_service.genai.chat_completion = lambda messages, **kwargs: json.dumps({'summary': 's'})
+        result = service.run_discovery(sample_collection.id, job_id=job.id)
+        assert result['status'] == 'success'
+        assert result['insights_count'] == 2
+        assert len(name_calls) == 2
+        assert DiscoveryJob.query.get(job.id).status == JobStatus.SUCCEEDED
+        
+        # With a queue, the RQ jobs of the concurrent stages and finalize are recorded
+        class FakeRQJob(str):
+            @property
+            def id(self):
+                return str(self)
+        class FakeQueue:
+            def enqueue(self, func, job_id, *args, **kwargs):
+                return FakeRQJob(f"rq-{args[0] if args else 'finalize'}")
+        result = service.run_discovery(sample_collection.id, job_id=job.id, queue=FakeQueue())
+        assert result['enqueued_stages'] == ['relate', 'insights']
+        assert DiscoveryJob.query.get(job.id).stage_rq_job_ids == {
+            'relate': 'rq-relate', 'insights': 'rq-insights', 'finalize': 'rq-finalize'
+        }
+
+def test_discovery_job_fails_when_a_stage_job_did_not_complete(app, sample_collection):
+    """Test finalize marks the job FAILED instead of completing it without a stage"""
+    from app import db
+    from app.models import DiscoveryJob, JobStatus
+    from app.services.discovery_job import DiscoveryJobService
+    with app.app_context():
+        job = DiscoveryJob(collection_id=sample_collection.id, status=JobStatus.RUNNING,
+                           checkpoints={'embed': {}, 'cluster': {}, 'name': {}, 'insights': {}})
+        db.session.add(job)
+        db.session.commit()
+        
+        result = DiscoveryJobService().finalize_stages(job.id)
+        assert result['status'] == 'failed'
+        assert result['missing_stages'] == ['relate']
+        job = DiscoveryJob.query.get(job.id)
+        assert job.status == JobStatus.FAILED
+        assert 'relate' in job.error_message
+        assert set(job.checkpoints) == {'embed', 'cluster', 'name', 'insights'}
+
+def test_worker_reuses_app_and_services():
+    """Test RQ job functions share one app and service instance per process"""
+    from app import workers
+    assert workers.get_app() is workers.get_app()
+    assert workers.get_discovery_service() is workers.get_discovery_service()
+
+def test_genai_http_transport_tracks_in_flight_requests(monkeypatch):
+    """Test pooled GenAI HTTP requests count as in flight until their body is closed"""
+    import httpx
+    from app.services.genai_clients import _InstrumentedTransport, _RequestStats
+    monkeypatch.setattr(httpx.HTTPTransport, 'handle_request', lambda self, request: httpx.Response(200, content=b'{}'))
+    stats = _RequestStats()
+    transport = _InstrumentedTransport(stats, max_connections=1)
+    
+    first = transport.handle_request(httpx.Request('POST', 'https://api.example.com/v1/embeddings'))
+    second = transport.handle_request(httpx.Request('POST', 'https://api.example.com/v1/embeddings'))
+    assert (stats.in_flight, stats.saturated_requests) == (2, 1)
+    first.read()
+    first.close()
+    second.close()
+    assert (stats.in_flight, stats.peak_in_flight, stats.requests) == (0, 2, 2)
+
+def test_genai_request_retries_retryable_errors(monkeypatch):
+    """Test GenAI calls back off on retryable errors and fail fast on others"""
+    from app.services.genai_service import GenAIService, GenAIError, GenAIRateLimitError
+    from app.services.rate_limiter import RateLimiter
+    monkeypatch.setattr(RateLimiter, '_get_redis', staticmethod(lambda: None))
+    
+    class StatusError(Exception):
+        def __init__(self, status_code):
+            super().__init__(f"HTTP {status_code}")
+            self.status_code = status_code
+    
+    class RawResponse:
+        headers = {'x-ratelimit-limit-requests': '6000', 'x-ratelimit-remaining-requests': '5999'}
+        def parse(self):
+            return 'ok'
+    
+    service = GenAIService()
+    service.max_retries = 2
+    service.rate_limiter.key_prefix = 'test:retries'
+    sleeps = []
+    service._backoff = lambda attempt, headers=None: sleeps.append(attempt) or 0
+    outcomes = [StatusError(503), StatusError(429)]
+    def call():
+        if outcomes:
+            raise outcomes.pop(0)
+        return RawResponse()
+    assert service._request('llm', 10, "Failed", call) == 'ok'
+    assert len(sleeps) == 2
+    
+    with pytest.raises(GenAIRateLimitError) as error:
+        service._request('llm', 10, "Failed", lambda: (_ for _ in ()).throw(StatusError(429)))
+    assert error.value.retryable and len(sleeps) == 4
+    
+    with pytest.raises(GenAIError) as error:
+        service._request('llm', 10, "Failed", lambda: (_ for _ in ()).throw(StatusError(400)))
+    assert not error.value.retryable and len(sleeps) == 4
+
+def test_rate_limiter_local_bucket_adapts_to_headers(monkeypatch):
+    """Test the token bucket throttles once empty and learns limits from response headers"""
+    from app.services.rate_limiter import RateLimiter, parse_reset
+    monkeypatch.setattr(RateLimiter, '_get_redis', staticmethod(lambda: None))
+    limiter = RateLimiter()
+    limiter.key_prefix = 'test:ratelimit'
+    limiter.limits['llm'] = (60.0, 6000.0)
+    
+    assert limiter._take('llm', 100) == 0
+    limiter.observe('llm', {'x-ratelimit-remaining-tokens': '50'})
+    # 50 more tokens refill at 100 tokens/second
+    assert limiter._take('llm', 100) == pytest.approx(0.5, abs=0.05)
+    limiter.observe('llm', {}, throttled=True)
+    assert limiter._take('llm', 1) > 0
+    
+    limiter.observe('llm', {'x-ratelimit-limit-requests': '6000'})
+    assert RateLimiter._local_buckets['test:ratelimit:llm:requests']['capacity'] == 6000.0
+    # A reported capacity of 0 is ignored instead of dividing by zero
+    limiter.observe('llm', {'x-ratelimit-limit-requests': '0', 'x-ratelimit-limit-tokens': '-1'})
+    assert RateLimiter._local_buckets['test:ratelimit:llm:requests']['capacity'] == 6000.0
+    assert limiter._take('llm', 1) >= 0
+    assert parse_reset('6m0s') == 360.0 and parse_reset('20ms') == pytest.approx(0.02)
+
+def test_qa_service_caches_answers_until_topic_changes(app, sample_topics, monkeypatch):
+    """Test Q&A answers are served from the cache (exactly or by similar question) until the topic version changes"""
+    from app import db
+    from app.models import Topic
+    from app.services import qa_cache
+    from app.services.qa_cache import QACache
+    from app.services.qa_service import QAService
+    monkeypatch.setattr(qa_cache, 'get_redis', lambda: None)
+    
+    service = QAService()
+    service.cache.key_prefix = 'test:qa'
+    llm_calls = []
+    service.genai.chat_completion = lambda messages, **kwargs: llm_calls.append(messages) or 'An answer'
+    service.genai.get_embedding = lambda text: [1.0, 0.0] if 'work' in text else [0.0, 1.0]
+    topic = sample_topics[0]
+    
+    assert service.answer(topic, 'How does it work?')['cached'] is None
+    assert service.answer(topic, '  how does it WORK ')['cached'] == 'exact'
+    assert service.answer(topic, 'Why does it work so well?')['cached'] == 'semantic'
+    assert service.answer(topic, 'Who maintains it?')['cached'] is None
+    assert len(llm_calls) == 2
+    
+    QACache.invalidate([topic.id])
+    db.session.commit()
+    topic = Topic.query.get(topic.id)
+    assert topic.version == 2
+    assert service.answer(topic, 'How does it work?')['cached'] is None
+    assert len(llm_calls) == 3
+
+def test_qa_service_retrieves_context_for_the_question(app, sample_documents, sample_topics, monkeypatch):
+    """Test Q&A context is the topic's documents nearest to the question, packed into the token budget"""
+    from collections import OrderedDict
+    from app import db
+    from app.models import DocumentTopic
+    from app.services import qa_cache
+    from app.services.qa_service import QAService
+    from app.services.topic_index import TopicVectorIndex
+    monkeypatch.setattr(qa_cache, 'get_redis', lambda: None)
+    monkeypatch.setattr(TopicVectorIndex, '_indexes', OrderedDict())
+    
+    service = QAService()
+    service.cache.enabled = False
+    service.context_max_tokens = 40
+    topic = sample_topics[0]
+    service.index.embedding_store.save({
+        sample_documents[0].id: [1.0, 0.0],
+        sample_documents[1].id: [0.0, 1.0],
+        sample_documents[2].id: [0.6, 0.8]
+    })
+    for doc in sample_documents[:3]:
+        db.session.add(DocumentTopic(document_id=doc.id, topic_id=topic.id, relevance_score=1.0))
+    db.session.commit()
+    
+    prompts = []
+    service.genai.chat_completion = lambda messages, **kwargs: prompts.append(messages[1]['content']) or 'See [Doc1]'
+    service.genai.get_embedding = lambda text: [0.0, 1.0]
+    result = service.answer(topic, 'Question?')
+    
+    # Nearest first; the least similar document does not fit the budget
+    assert result['citations'][0]['document_id'] == sample_documents[1].id
+    assert prompts[0].index('document 2.') < prompts[0].index('document 3.')
+    assert 'document 1.' not in prompts[0]
+
+def test_document_chunker_splits_on_boundaries_with_overlap():
+    """Test chunks cover the text, prefer word boundaries and overlap"""
+    from app.services.chunking import DocumentChunker
+    chunker = DocumentChunker(chunk_tokens=5, overlap_tokens=1)
+    text = 'alpha beta gamma delta epsilon zeta eta theta iota kappa'
+    spans = chunker.split(text)
+    
+    assert spans[0][0] == 0 and spans[-1][1] == len(text)
+    assert all(end - start <= 20 for start, end in spans)
+    for (_, prev_end), (start, _) in zip(spans, spans[1:]):
+        assert start < prev_end
+        assert text[start - 1] == ' '
+    assert chunker.split('   ') == []
+    with pytest.raises(ValueError):
+        DocumentChunker(chunk_tokens=5, overlap_tokens=5)
+
+def test_embedding_store_embeds_chunks(app, sample_collection, monkeypatch):
+    """Test the chunks representation stores chunk embeddings and a mean document vector"""
+    from app.models import Document, DocumentChunk, DocumentEmbedding
+    from app.services.embedding_store import EmbeddingStore
+    from app.services.chunking import DocumentChunker
+    store = EmbeddingStore(representation='chunks')
+    store.chunker = DocumentChunker(chunk_tokens=5, overlap_tokens=0)
+    store.genai.get_embeddings_batch = lambda texts: [[1.0, 0.0] if 'cats' in text else [0.0, 2.0] for text in texts]
+    store.embedding_cache.enabled = False
+    
+    service = DocumentService()
+    service.embedding_store = store
+    result = service.ingest_documents(sample_collection.id, [
+        {'title': 'Long', 'content': 'cats cats cats cats dogs dogs dogs dogs'},
+        {'title': 'Blank', 'content': '   '}
+    ])
+    long_id, blank_id = result['document_ids']
+    assert [failure['document_id'] for failure in result['embedding_failed']] == [blank_id]
+    
+    chunks = DocumentChunk.query.filter_by(document_id=long_id).order_by(DocumentChunk.chunk_index).all()
+    assert [chunk.content.strip() for chunk in chunks] == ['cats cats cats cats', 'dogs dogs dogs dogs']
+    assert chunks[1].start_char == chunks[0].end_char
+    # Mean of the normalized chunk vectors, weighted by chunk tokens
+    embedding = DocumentEmbedding.query.filter_by(document_id=long_id).one().embedding
+    assert embedding == pytest.approx([5 / 9, 4 / 9])
+    assert DocumentEmbedding.query.filter_by(document_id=blank_id).count() == 0
+    
+    # Re-chunking replaces a document's chunks and its mean vector
+    store.genai.get_embeddings_batch = lambda texts: [[0.0, 1.0] for text in texts]
+    store.embed_chunked([long_id])
+    assert DocumentChunk.query.filter_by(document_id=long_id).count() == 2
+    embedding = DocumentEmbedding.query.populate_existing().filter_by(document_id=long_id).one().embedding
+    assert embedding == pytest.approx([0.0, 1.0])
+
+def test_qa_service_retrieves_chunks(app, sample_collection, sample_topics, monkeypatch):
+    """Test Q&A context is built from the topic's chunks nearest to the question"""
+    from collections import OrderedDict
+    from app import db
+    from app.models import DocumentTopic
+    from app.services import qa_cache
+    from app.services.chunking import DocumentChunker
+    from app.services.embedding_store import EmbeddingStore
+    from app.services.qa_service import QAService
+    from app.services.topic_index import TopicVectorIndex
+    monkeypatch.setattr(qa_cache, 'get_redis', lambda: None)
+    monkeypatch.setattr(TopicVectorIndex, '_indexes', OrderedDict())
+    
+    store = EmbeddingStore(representation='chunks')
+    store.chunker = DocumentChunker(chunk_tokens=5, overlap_tokens=0)
+    store.embedding_cache.enabled = False
+    store.genai.get_embeddings_batch = lambda texts: [[1.0, 0.0] if 'cats' in text else [0.0, 1.0] for text in texts]
+    service = DocumentService()
+    service.embedding_store = store
+    doc_id = service.ingest_documents(sample_collection.id, [
+        {'title': 'Pets', 'content': 'cats cats cats cats dogs dogs dogs dogs'}
+    ])['document_ids'][0]
+    topic = sample_topics[0]
+    db.session.add(DocumentTopic(document_id=doc_id, topic_id=topic.id))
+    db.session.commit()
+    
+    qa = QAService()
+    qa.index = TopicVectorIndex(store)
+    qa.retrieval_k = 1
+    prompts = []
+    qa.genai.chat_completion = lambda messages, **kwargs: prompts.append(messages[1]['content']) or 'Dogs [Doc1]'
+    qa.genai.get_embedding = lambda text: [0.0, 1.0]
+    result = qa.answer(topic, 'What about dogs?')
+    
+    assert 'dogs dogs' in prompts[0] and 'cats' not in prompts[0]
+    assert result['citations'] == [{'doc': 1, 'document_id': doc_id, 'title': 'Pets', 'preview': 'dogs dogs dogs dogs'}]
+
+def test_qa_service_streams_tokens_and_citations(app, sample_documents, sample_topics, monkeypatch):
+    """Test streamed Q&A resolves [DocN] markers split across tokens once, then caches the answer"""
+    from app import db
+    from app.models import DocumentTopic
+    from app.services import qa_cache
+    from app.services.qa_service import QAService
+    monkeypatch.setattr(qa_cache, 'get_redis', lambda: None)
+    
+    service = QAService()
+    service.cache.key_prefix = 'test:qa-stream'
+    topic = sample_topics[0]
+    for doc in sample_documents[:2]:
+        db.session.add(DocumentTopic(document_id=doc.id, topic_id=topic.id, relevance_score=1.0))
+    db.session.commit()
+    
+    service.genai.get_embedding = lambda text: None
+    service.genai.chat_completion_stream = lambda messages, **kwargs: iter(['See [Do', 'c1] and [Doc1', '], [Doc2].'])
+    events = list(service.answer_stream(topic, 'Question?'))
+    
+    assert [event for event, _ in events] == ['token', 'token', 'citation', 'token', 'citation', 'done']
+    assert [data['doc'] for event, data in events if event == 'citation'] == [1, 2]
+    done = events[-1][1]
+    assert done['answer'] == 'See [Doc1] and [Doc1], [Doc2].'
+    assert done['cached'] is None
+    
+    events = list(service.answer_stream(topic, 'Question?'))
+    assert [event for event, _ in events] == ['token', 'citation', 'citation', 'done']
+    assert events[-1][1]['cached'] == 'exact'
+
+def test_folder_loader_skips_loaded_files(app, sample_collection, tmp_path, monkeypatch):
+    """Test folder loads recurse, batch inserts, skip unchanged or duplicate files and replace changed ones"""
+    import os
+    from app.services import folder_loader
+    from app.services.folder_loader import FolderLoader
+    monkeypatch.setattr(folder_loader, 'extract_text_from_pdf', lambda data: data.decode())
+    
+    (tmp_path / 'nested').mkdir()
+    (tmp_path / 'a.pdf').write_text('Content of the first document')
+    (tmp_path / 'nested' / 'b_file.pdf').write_text('Content of the second document')
+    (tmp_path / 'nested' / 'copy.pdf').write_text('Content of the second document')
+    (tmp_path / 'short.pdf').write_text('tiny')
+    (tmp_path / 'notes.txt').write_text('Not a PDF file at all')
+    
+    service = DocumentService()
+    embed_calls = []
+    service.embedding_cache.embed_many = lambda texts: embed_calls.append(len(texts)) or ([[0.1, 0.2]] * len(texts), [None] * len(texts))
+    loader = FolderLoader(service, workers=0, batch_size=1)
+    
+    stats = loader.load(sample_collection.id, str(tmp_path))
+    assert (stats['found'], stats['loaded'], stats['unchanged'], stats['failed']) == (4, 2, 1, 1)
+    assert embed_calls == [1, 1]
+    titles = sorted(doc.title for doc in Document.query.filter_by(collection_id=sample_collection.id))
+    assert titles == ['a', 'b file']
+    
+    # Unchanged paths are skipped without extraction; a changed file replaces its document
+    (tmp_path / 'a.pdf').write_text('Updated content of the first document')
+    os.utime(tmp_path / 'a.pdf', (1e9, 1e9))
+    stats = loader.load(sample_collection.id, str(tmp_path))
+    assert (stats['loaded'], stats['replaced']) == (1, 1)
+    contents = sorted(doc.content for doc in Document.query.filter_by(collection_id=sample_collection.id))
+    assert contents == ['Content of the second document', 'Updated content of the first document']
+    
+    # A replacement that fails to insert keeps the previous version
+    (tmp_path / 'a.pdf').write_text('Third version of the first document')
+    os.utime(tmp_path / 'a.pdf', (2e9, 2e9))
+    def failing_ingest(collection_id, documents):
+        raise Exception('insert failed')
+    monkeypatch.setattr(service, 'ingest_documents', failing_ingest)
+    with pytest.raises(Exception):
+        loader.load(sample_collection.id, str(tmp_path))
+    contents = sorted(doc.content for doc in Document.query.filter_by(collection_id=sample_collection.id))
+    assert contents == ['Content of the second document', 'Updated content of the first document']
+
+def test_document_service_flags_near_duplicates(app, sample_collection):
+    """Test near-duplicates within a batch and across batches are flagged, not embedded and left out of clustering"""
+    service = DocumentService()
+    embedded = []
+    service.embedding_cache.embed_many = lambda texts: embedded.extend(texts) or ([[0.1, 0.2]] * len(texts), [None] * len(texts))
+    
+    words = ' '.join(f'word{i}' for i in range(300))
+    result = service.ingest_documents(sample_collection.id, [
+        {'content': f'Quarterly report. {words}'},
+        {'content': f'quarterly REPORT {words}'},
+        {'content': ' '.join(f'other{i}' for i in range(300))}
+    ])
+    original, copy, other = result['document_ids']
+    assert result['duplicates'] == [{'document_id': copy, 'duplicate_of': original}]
+    assert len(embedded) == 2
+    
+    # A lightly edited re-upload in a later batch
+    edited = words.replace('word150', 'changed150')
+    result = service.ingest_documents(sample_collection.id, [{'content': f'Quarterly report. {edited}'}])
+    assert result['duplicates'] == [{'document_id': result['document_ids'][0], 'duplicate_of': original}]
+    assert len(embedded) == 2
+    
+    doc_ids, _ = service.embedding_store.load_matrix(sample_collection.id)
+    assert doc_ids == [original, other]
+    assert Document.query.get(copy).duplicate_of_id == original
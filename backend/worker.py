@@ -0,0 +1,28 @@
+"""
+RQ worker entry point.
+Preloads the Flask app, DB pool, services and HTTP clients once, then
+processes jobs. By default jobs run in this process (SimpleWorker), so
+everything stays warm across jobs; with --fork every job runs in a forked
+work horse that inherits the preloaded state.
+"""
+import argparse
+import logging
+from rq import Worker, SimpleWorker
+from app.queue import get_queue
+from app.workers import preload
+
+def main():
+    parser = argparse.ArgumentParser(description='Run an RQ worker with a preloaded app')
+    parser.add_argument('queues', nargs='*', default=['default'], help='Queues to listen on (default: default)')
+    parser.add_argument('--fork', action='store_true', help='Run each job in a forked work horse')
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    preload()
+    
+    worker_class = Worker if args.fork else SimpleWorker
+    worker = worker_class(args.queues, connection=get_queue().connection)
+    worker.work()
+
+if __name__ == '__main__':
+    main()